@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the memory and build time of the PostCatalog with the original dict-of-dicts meta info (plus the counts
+built on top of it by `_list_meta_info`), on a synthetic corpus held in memory.
+
+Usage (from the repo root): PYTHONPATH=. python benchmarks/bench_catalog.py [--posts 100000]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from blogging.catalog import PostCatalog
+
+
+def synthetic_meta(count, categories=30, tags=2000, tags_per_post=4):
+    """
+    Yield (file_name, meta) with freshly built strings, as parsing each file would produce.
+    """
+    rng = random.Random(0)
+    for i in range(count):
+        yield '2020-01-01-post-{0}.md'.format(i), {
+            'title': '"Synthetic post number {0} about things"'.format(i),
+            'category': 'category-{0}'.format(rng.randrange(categories)),
+            'tag': ['tag-{0}'.format(rng.randrange(tags)) for _ in range(tags_per_post)],
+        }
+
+
+def legacy_build(count):
+    info = dict()
+    for file_name, meta in synthetic_meta(count):
+        info[file_name] = meta
+    categories, tags, titles = dict(), dict(), dict()
+    for file_name, meta in info.items():
+        categories[meta['category']] = categories.get(meta['category'], 0) + 1
+        for tag in meta['tag']:
+            tags[tag] = tags.get(tag, 0) + 1
+        titles[meta['title']] = file_name
+    return info, {'category': categories, 'tag': tags, 'title': titles}
+
+
+def catalog_build(count):
+    catalog = PostCatalog()
+    for file_name, meta in synthetic_meta(count):
+        catalog.add(file_name, meta)
+    return catalog
+
+
+def measure(build, count):
+    # Timed apart from the memory measure, as tracemalloc slows every allocation down
+    gc.collect()
+    start = time.perf_counter()
+    result = build(count)
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = build(count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=100000)
+    args = parser.parse_args()
+    results = [('legacy dict of dicts', measure(legacy_build, args.posts)),
+               ('PostCatalog', measure(catalog_build, args.posts))]
+    for name, (memory, elapsed) in results:
+        print('{0:<22} {1:8.1f} MB  {2:8.1f} ms'.format(name, memory / 1024 / 1024, elapsed * 1000))
+    print('memory ratio: {0:.1f}x'.format(results[0][1][0] / results[1][1][0]))
+
+
+if __name__ == '__main__':
+    main()
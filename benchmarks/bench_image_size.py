@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare `get_image_size` (one mmap, header probing) with the original byte-at-a-time JPEG segment loop, on large
+progressive JPEGs carrying the usual EXIF/ICC/XMP metadata, and time the cached sizes of `ImageStore`.
+
+Usage (from the repo root): PYTHONPATH=. python benchmarks/bench_image_size.py [--images 200] [--scan-size 4000000]
+"""
+import argparse
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+from blogging.images import ImageStore, get_image_size
+
+
+def legacy_get_image_size(file_path):
+    with open(file_path, 'rb') as input:
+        input.read(2)
+        b = input.read(1)
+        while (b and b[0] != 0xDA):
+            while (b[0] != 0xFF): b = input.read(1)
+            while (b[0] == 0xFF): b = input.read(1)
+            if (b[0] >= 0xC0 and b[0] <= 0xC3):
+                input.read(3)
+                h, w = struct.unpack(">HH", input.read(4))
+                break
+            else:
+                input.read(int(struct.unpack(">H", input.read(2))[0]) - 2)
+            b = input.read(1)
+        return int(w), int(h)
+
+
+def _segment(marker, payload):
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def generate_jpeg(file_path, scan_size):
+    exif = b'Exif\0\0MM\0*' + struct.pack('>IH', 8, 1) + struct.pack('>HHIHH', 274, 3, 1, 1, 0) + b'\0' * 4
+    segments = [_segment(0xE0, b'JFIF\0\x01\x02\0\0\x01\0\x01\0\0'), _segment(0xE1, exif + b'\0' * 30000)]
+    # An ICC profile split over several APP2 segments, XMP, comments and the tables
+    segments += [_segment(0xE2, b'ICC_PROFILE\0' + bytes(60000)) for _ in range(8)]
+    segments.append(_segment(0xE1, b'http://ns.adobe.com/xap/1.0/\0' + b' ' * 20000))
+    segments += [_segment(0xFE, b'comment %d' % i) for i in range(50)]
+    segments += [_segment(0xDB, bytes(65)) for _ in range(2)] + [_segment(0xC4, bytes(180)) for _ in range(4)]
+    segments.append(_segment(0xC2, b'\x08' + struct.pack('>HH', 3000, 4000) + b'\x03' + bytes(9)))
+    with open(file_path, 'wb') as f:
+        f.write(b'\xff\xd8' + b''.join(segments) + b'\xff\xda' + os.urandom(scan_size) + b'\xff\xd9')
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--scan-size', type=int, default=4000000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    root = tempfile.mkdtemp(prefix='blogging-bench-')
+    try:
+        os.makedirs(os.path.join(root, '_images'))
+        paths = [os.path.join(root, '_images', 'image-{0}.jpg'.format(i)) for i in range(args.images)]
+        for path in paths:
+            generate_jpeg(path, args.scan_size)
+        assert all(legacy_get_image_size(path) == get_image_size(path) == (4000, 3000) for path in paths)
+        store = ImageStore(root, '_images', cache_dir=os.path.join(root, 'cache'))
+        store.refresh()
+        results = [
+            ('legacy byte loop', timed(lambda: [legacy_get_image_size(path) for path in paths])),
+            ('get_image_size (mmap)', timed(lambda: [get_image_size(path) for path in paths])),
+            ('ImageStore.dimensions (cached by hash)',
+             timed(lambda: ImageStore(root, '_images', cache_dir=os.path.join(root, 'cache')).dimensions())),
+        ]
+        for name, elapsed in results:
+            print('{0:<40} {1:8.1f} ms  {2:8.1f} us/image'.format(name, elapsed * 1000,
+                                                                  elapsed * 1e6 / args.images))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the front matter scanning of MetaIndex with the original sequential `codecs.open` + `readline` loop.
+
+Usage (from the repo root): PYTHONPATH=. python benchmarks/bench_scan.py [--posts 5000] [--body-size 20000]
+"""
+import argparse
+import codecs
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from blogging.metadata import MetaIndex
+
+
+def legacy_get_meta_info(folder_path):
+    info = dict()
+    for file_name in os.listdir(folder_path):
+        if file_name.startswith('.'):
+            continue
+        info[file_name] = dict()
+        with codecs.open(os.path.join(folder_path, file_name), 'r', encoding='utf-8') as f:
+            first_line = f.readline()
+            if first_line.startswith('---'):
+                while True:
+                    line = f.readline()
+                    if line.startswith('title:'):
+                        info[file_name]['title'] = line[6:].strip()
+                    elif line.startswith('category:'):
+                        info[file_name]['category'] = line[9:].strip()
+                    elif line.startswith('tags:'):
+                        info[file_name]['tag'] = [tag.strip() for tag in line[5:].strip()[1:-1].split(',')]
+                    if line.startswith('---'):
+                        break
+    return info
+
+
+def generate_posts(folder_path, count, body_size):
+    random.seed(0)
+    body = ('lorem ipsum dolor sit amet ' * (body_size // 27 + 1))[:body_size]
+    for i in range(count):
+        with open(os.path.join(folder_path, '2020-01-01-post-{0}.md'.format(i)), 'w') as f:
+            f.write('---\nlayout: post\ntitle: "Post {0}"\ncategory: cat{1}\ntags: [tag{2}, tag{3}]\n'
+                    'date: 2020-01-01\n---\n{4}\n'.format(i, random.randrange(20), random.randrange(200),
+                                                        random.randrange(200), body))
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--body-size', type=int, default=20000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='blogging-bench-')
+    try:
+        os.makedirs(os.path.join(root, '_posts'))
+        generate_posts(os.path.join(root, '_posts'), args.posts, args.body_size)
+        cache_dir = os.path.join(root, 'cache')
+        index = MetaIndex(root, '_posts', cache_dir=cache_dir)
+        results = [
+            ('legacy sequential readline', timed(lambda: legacy_get_meta_info(os.path.join(root, '_posts')))),
+            ('MetaIndex cold (bounded read, thread pool)', timed(lambda: index.refresh(rebuild=True))),
+            ('MetaIndex warm (nothing changed)',
+             timed(lambda: MetaIndex(root, '_posts', cache_dir=cache_dir).refresh())),
+        ]
+        for name, elapsed in results:
+            print('{0:<45} {1:8.1f} ms  {2:10.0f} files/s'.format(name, elapsed * 1000, args.posts / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
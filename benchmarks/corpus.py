@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generate a synthetic blog project (`_drafts`, `_posts` and `_images`) for the benchmarks.
+
+Usage (from the repo root): PYTHONPATH=. python benchmarks/corpus.py {target_dir} [--posts 1000] [--images 100] ...
+"""
+import argparse
+import datetime
+import os
+import random
+import struct
+import zlib
+
+WORDS = ('python', 'vim', 'linux', 'git', 'docker', 'network', 'cache', 'shell', 'design', 'notes', 'tips', 'rust',
+         'performance', 'memory', 'server', 'editor', 'config', 'debug', 'async', 'index')
+
+
+def _png(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return b'\211PNG\r\n\032\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(b'\0' * 64)) + chunk(b'IEND', b'')
+
+
+def _jpeg(width, height, padding):
+    def segment(marker, payload):
+        return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+    return b'\xff\xd8' + segment(0xE0, b'JFIF\0\x01\x02\0\0\x01\0\x01\0\0') + segment(0xE1, bytes(padding)) + \
+        segment(0xDB, bytes(65)) + segment(0xC2, b'\x08' + struct.pack('>HH', height, width) + b'\x03' + bytes(9)) + \
+        b'\xff\xda' + bytes(256) + b'\xff\xd9'
+
+
+def generate_project(root, posts=1000, drafts=None, categories=20, tags=500, tags_per_post=3, front_matter_lines=3,
+                     body_size=4000, images=100, seed=0):
+    """
+    Create the project under `root` (which is created if needed) and return its path.
+    `drafts` defaults to a tenth of the posts; `front_matter_lines` extra keys are added to each front matter.
+    """
+    rng = random.Random(seed)
+    drafts = max(1, posts // 10) if drafts is None else drafts
+    for folder in ('_drafts', '_posts', '_images'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    body = ('lorem ipsum dolor sit amet ' * (body_size // 27 + 1))[:body_size]
+    start = datetime.date(2010, 1, 1)
+    for i in range(posts + drafts):
+        folder = '_posts' if i < posts else '_drafts'
+        date = start + datetime.timedelta(days=i // 3)
+        words = [rng.choice(WORDS) for _ in range(4)]
+        title = '{0} {1}'.format(' '.join(words).capitalize(), i)
+        extra = ''.join('key{0}: value {1}\n'.format(k, rng.randrange(1000)) for k in range(front_matter_lines))
+        with open(os.path.join(root, folder, '{0}-{1}-{2}.md'.format(date, '-'.join(words), i)), 'w') as f:
+            f.write('---\nlayout: post\ntitle: "{0}"\ncategory: category-{1}\ntags: [{2}]\ndate: {3}\n{4}---\n'
+                    '{5}\n'.format(title, rng.randrange(categories),
+                                   ', '.join('tag-{0}'.format(rng.randrange(tags)) for _ in range(tags_per_post)),
+                                   date, extra, body))
+    for i in range(images):
+        width, height = rng.randrange(200, 4000), rng.randrange(200, 3000)
+        if i % 2:
+            data, extension = _jpeg(width, height, rng.randrange(1000, 30000)), '.jpg'
+        else:
+            data, extension = _png(width, height), '.png'
+        with open(os.path.join(root, '_images', 'image-{0}{1}'.format(i, extension)), 'wb') as f:
+            f.write(data)
+    return root
+
+
+def write_settings(home, project_path):
+    """
+    Write a settings file for `project_path` in `home` (to be used as the HOME of the benchmarked commands).
+    """
+    os.makedirs(home, exist_ok=True)
+    with open(os.path.join(home, '.blogging'), 'w') as f:
+        f.write('project_path={0}\ndrafts_folder=_drafts\nposts_folder=_posts\nimages_folder=_images\n'.format(
+            project_path))
+
+
+def add_arguments(parser):
+    parser.add_argument('--drafts', type=int, default=None, help='Number of drafts (a tenth of the posts by default)')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--tags-per-post', type=int, default=3)
+    parser.add_argument('--front-matter-lines', type=int, default=3, help='Extra keys in each front matter')
+    parser.add_argument('--body-size', type=int, default=4000)
+    parser.add_argument('--images', type=int, default=100)
+
+
+def corpus_options(args):
+    return dict(drafts=args.drafts, categories=args.categories, tags=args.tags, tags_per_post=args.tags_per_post,
+                front_matter_lines=args.front_matter_lines, body_size=args.body_size, images=args.images)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('target_dir')
+    parser.add_argument('--posts', type=int, default=1000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate_project(args.target_dir, posts=args.posts, **corpus_options(args))
+    print('Generated {0}'.format(args.target_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the hot paths of the tool on synthetic blogs of growing size.
+
+For each size, a project is generated (see corpus.py) with its own settings file and cache dir. A worker process
+(using the project as its HOME) times the in-process hot paths, then the end-to-end tab completions are timed by
+running the CLI the way the shell does, with argcomplete's `_ARGCOMPLETE`/`COMP_LINE` environment.
+
+The results are written as JSON lines (one per benchmark and size), for tracking regressions across commits; a
+readable table goes to stderr.
+
+Usage (from the repo root): PYTHONPATH=. python benchmarks/suite.py [--posts 80 1000 10000 50000] [--repeat 5]
+                                                                   [--output results.jsonl]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPLETIONS = (
+    ('complete_continue', 'blogging continue '),
+    ('complete_edit_filter', 'blogging edit --filter tag:tag-1 '),
+    ('complete_edit_fuzzy', 'blogging edit dockernet'),
+    ('complete_new_category', 'blogging new title category-'),
+    ('complete_new_tags', 'blogging new title category-1 tag-1'),
+)
+
+
+def summarize(name, durations, **fields):
+    durations = sorted(durations)
+    result = {'benchmark': name, 'runs': len(durations), 'min_ms': durations[0] * 1000,
+              'median_ms': statistics.median(durations) * 1000,
+              'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000}
+    result.update(fields)
+    return result
+
+
+def measure(func, repeat, setup=None):
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run_worker(repeat):
+    """
+    Time the in-process hot paths on the project of the current settings file. Print the results as json.
+    """
+    from blogging import blogging
+    from blogging.images import get_image_size
+    from blogging.metadata import project_cache_dir
+    settings = blogging.SETTINGS
+    posts = settings.POSTS_FOLDER
+
+    def forget_memory():
+        blogging._META_INDEXES.clear()
+        blogging._FILTER_INDEXES.clear()
+
+    def forget_all():
+        forget_memory()
+        shutil.rmtree(project_cache_dir(settings.PROJECT_PATH), ignore_errors=True)
+
+    def quiet(func):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()
+        return run
+
+    completer = blogging.FileCompleterWithFilter(posts)
+    images_path = os.path.join(settings.PROJECT_PATH, settings.IMAGES_FOLDER)
+    image_paths = [os.path.join(images_path, name) for name in os.listdir(images_path)]
+    results = [
+        summarize('meta_info_cold', measure(lambda: blogging._get_meta_info(posts), repeat, forget_all)),
+        summarize('meta_info_warm', measure(lambda: blogging._get_meta_info(posts), repeat, forget_memory)),
+        summarize('filter_by_keyword_tag', measure(lambda: completer.filter_by_keyword('tag:tag-1'), repeat,
+                                                   forget_memory)),
+        summarize('filter_by_keyword_title', measure(lambda: completer.filter_by_keyword('title:python'), repeat)),
+        summarize('category_completer', measure(lambda: list(blogging.CategoryCompleter('category-1')), repeat,
+                                                forget_memory)),
+        summarize('stats_tags', measure(quiet(blogging.stats_tags), repeat, forget_memory)),
+        summarize('get_image_size', measure(lambda: [get_image_size(path) for path in image_paths], repeat),
+                  images=len(image_paths)),
+    ]
+    print(json.dumps(results))
+
+
+def time_completion(comp_line, env, repeat):
+    durations = []
+    count = 0
+    with tempfile.NamedTemporaryFile(prefix='blogging-completion-') as output:
+        env = dict(env, _ARGCOMPLETE='1', COMP_LINE=comp_line, COMP_POINT=str(len(comp_line)),
+                   _ARGCOMPLETE_STDOUT_FILENAME=output.name)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'from blogging.cli import main; main()'], env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            durations.append(time.perf_counter() - start)
+        with open(output.name, 'r') as f:
+            completions = f.read()
+        count = len([c for c in completions.split('\v') if c])
+    return durations, count
+
+
+def _commit():
+    proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, universal_newlines=True)
+    return proc.stdout.strip() or None
+
+
+def bench_size(posts, args, context):
+    root = tempfile.mkdtemp(prefix='blogging-suite-')
+    try:
+        project = corpus.generate_project(os.path.join(root, 'blog'), posts=posts, **corpus.corpus_options(args))
+        home = os.path.join(root, 'home')
+        corpus.write_settings(home, project)
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(root, 'cache'),
+                   PYTHONPATH=os.pathsep.join([REPO_ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(args.repeat)],
+                              env=env, cwd=project, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        results = json.loads(proc.stdout)
+        for name, comp_line in COMPLETIONS:
+            durations, count = time_completion(comp_line, env, args.repeat)
+            results.append(summarize(name, durations, completions=count))
+        for result in results:
+            result.update(context, posts=posts)
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, nargs='+', default=[80, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Append the json lines to this file instead of printing them')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    corpus.add_arguments(parser)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.repeat)
+        return
+
+    context = {'commit': _commit(), 'python': platform.python_version(), 'timestamp': int(time.time())}
+    lines = []
+    for posts in args.posts:
+        results = bench_size(posts, args, context)
+        for result in results:
+            sys.stderr.write('{0:>6} posts  {1:<26} median {2:9.2f} ms  p95 {3:9.2f} ms\n'.format(
+                posts, result['benchmark'], result['median_ms'], result['p95_ms']))
+        lines.extend(json.dumps(result, sort_keys=True) for result in results)
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        print('\n'.join(lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Auto-save for `blogging watch`: the drafts, posts and images are committed as they are written.
+
+The folders are watched with FolderWatcher (inotify on Linux), so nothing runs while nothing changes: the loop only
+wakes up on file events and on the deadlines it set itself. Changes are batched: they are committed once the files
+have been left alone for `quiet` seconds (editors write in bursts), no more often than every `interval` seconds,
+unless the files keep changing for `max_wait` seconds. The commits are pushed by the background PushQueue worker, at
+most every `push_interval` seconds, so neither the editor nor the watch loop waits for the network.
+"""
+import os
+import select
+import time
+
+from blogging.gitops import GitError, GitSession, PushQueue, PUSH_DELAY
+from blogging.watcher import FolderWatcher
+
+QUIET = 10.0
+COMMIT_INTERVAL = 60.0
+MAX_WAIT = 300.0
+PUSH_INTERVAL = 300.0
+# Seconds before trying again a failed commit (e.g. while another git command holds the index)
+RETRY_DELAY = 30.0
+
+
+def is_temporary(file_name):
+    """
+    Swap, backup and lock files of the editors, which are not worth a commit.
+    """
+    return file_name.startswith(('.', '#')) or file_name.endswith(('~', '.swp', '.swx', '.tmp')) \
+        or file_name == '4913'
+
+
+class AutoSaver(object):
+    def __init__(self, project_path, folders, quiet=QUIET, interval=COMMIT_INTERVAL, max_wait=MAX_WAIT,
+                 push_interval=PUSH_INTERVAL, push_delay=PUSH_DELAY, on_change=None, log=print):
+        """
+        `on_change` is called with {folder: set of file names} before each commit.
+        """
+        self.project_path = project_path
+        self.folders = {os.path.abspath(os.path.join(project_path, folder)): folder for folder in folders}
+        self.quiet = quiet
+        self.interval = interval
+        self.max_wait = max_wait
+        self.push_interval = push_interval
+        self.on_change = on_change
+        self.log = log
+        self.session = GitSession(project_path)
+        self.queue = PushQueue(project_path, delay=push_delay)
+        self.watcher = FolderWatcher(self.folders)
+        # folder -> names of the changed files not committed yet
+        self.pending = dict()
+        self.first_change = None
+        self.last_change = None
+        self.last_commit = None
+        self.last_push = None
+        self.push_pending = False
+        self.retry_at = None
+        self.running = False
+
+    def add_changes(self, changes):
+        """
+        Record the (folder path, file_name) pairs reported by the watcher.
+        """
+        added = False
+        for folder, file_name in changes:
+            if folder in self.folders and not is_temporary(file_name):
+                self.pending.setdefault(self.folders[folder], set()).add(file_name)
+                added = True
+        if added:
+            self.last_change = time.monotonic()
+            if self.first_change is None:
+                self.first_change = self.last_change
+
+    def commit_deadline(self):
+        if not self.pending:
+            return None
+        deadline = self.last_change + self.quiet
+        if self.last_commit is not None:
+            deadline = max(deadline, self.last_commit + self.interval)
+        deadline = min(deadline, self.first_change + self.max_wait)
+        if self.retry_at is not None:
+            deadline = max(deadline, self.retry_at)
+        return deadline
+
+    def push_deadline(self):
+        if not self.push_pending:
+            return None
+        return self.last_push + self.push_interval if self.last_push is not None else time.monotonic()
+
+    def next_timeout(self):
+        """
+        Seconds until something is due, or None to sleep until the next file event.
+        """
+        deadlines = [deadline for deadline in (self.commit_deadline(), self.push_deadline()) if deadline is not None]
+        timeouts = [max(0.0, min(deadlines) - time.monotonic())] if deadlines else []
+        if self.watcher.next_timeout() is not None:
+            timeouts.append(self.watcher.next_timeout())
+        return min(timeouts) if timeouts else None
+
+    def _changed_files(self):
+        return [(status, path) for status, path in self.session.changed_files(list(self.folders.values()))
+                if not is_temporary(os.path.basename(path))]
+
+    def commit(self):
+        pending = self.pending
+        self.pending = dict()
+        self.first_change = None
+        if self.on_change is not None:
+            self.on_change(pending)
+        try:
+            changes = self._changed_files()
+            committed = False
+            if changes:
+                self.session.stage([os.path.join(self.project_path, path) for status, path in changes])
+                message = 'Auto-save drafts and edited posts\n\n' + '\n'.join(
+                    '{0}: {1}'.format(status, path) for status, path in changes)
+                committed = self.session.commit(message)
+        except GitError as e:
+            self.log('Git failed: {0}. Trying again in {1:.0f}s.'.format(e, RETRY_DELAY))
+            for folder, file_names in pending.items():
+                self.pending.setdefault(folder, set()).update(file_names)
+            self.first_change = self.last_change = time.monotonic()
+            self.retry_at = self.last_change + RETRY_DELAY
+            return False
+        self.retry_at = None
+        self.last_commit = time.monotonic()
+        if committed:
+            self.log('{0} Committed {1}'.format(time.strftime('%H:%M:%S'), ', '.join(path for status, path in changes)))
+            self.queue.request(spawn=False)
+            self.push_pending = True
+        return committed
+
+    def push(self):
+        # The worker process pushes (and records the outcome for `blogging status`)
+        self.queue.spawn_worker()
+        self.last_push = time.monotonic()
+        self.push_pending = False
+
+    def run_due(self):
+        now = time.monotonic()
+        deadline = self.commit_deadline()
+        if deadline is not None and now >= deadline:
+            self.commit()
+        deadline = self.push_deadline()
+        if deadline is not None and now >= deadline:
+            self.push()
+
+    def serve_forever(self):
+        self.running = True
+        # What was left uncommitted before the watch started is saved too
+        for status, path in self._changed_files():
+            folder, file_name = os.path.split(path)
+            self.add_changes([(os.path.abspath(os.path.join(self.project_path, folder)), file_name)])
+        try:
+            while self.running:
+                timeout = self.next_timeout()
+                if self.watcher.polling:
+                    time.sleep(timeout)
+                else:
+                    select.select([self.watcher], [], [], timeout)
+                self.add_changes(self.watcher.read_events())
+                self.run_due()
+        finally:
+            # Do not lose what was written right before stopping
+            self.add_changes(self.watcher.read_events())
+            if self.pending:
+                self.commit()
+            if self.push_pending:
+                self.push()
+            self.watcher.close()
@@ -5,85 +5,34 @@ import html
 import os
 import datetime
 import re
+import shutil
+import tempfile
+import fnmatch
+import glob
+import json
+import subprocess
 from subprocess import call
 import sys
 from tabulate import tabulate
-import codecs
 import argcomplete
 import time
 from termcolor import colored
+from blogging import completion, trace
 from blogging.constants import __VERSION__, BLOGGING_SETTINGS_FILE
-import struct
-
-
-class UnknownImageFormat(Exception):
-    pass
+from blogging.gitops import GitError, GitSession, PushQueue, PUSH_DELAY
+from blogging.images import ImageStore, VARIANT_WIDTHS, expand_image_paths, find_image_references
+from blogging.metadata import MetaIndex, HEADER_LIMIT, atomic_write_json, project_cache_dir
+from blogging.query import FilterIndex
+from blogging.settings import Settings, selected_project
+from concurrent.futures import ThreadPoolExecutor
 
 
 def copy2clip(txt):
-    cmd = f"echo '{txt.strip()}'|pbcopy"
-    return call(cmd, shell=True)
-
-
-def get_image_size(file_path):
-    """
-    Return (width, height) for a given img file content - no external
-    dependencies except the os and struct modules from core
-    """
-    size = os.path.getsize(file_path)
-
-    with open(file_path, 'rb') as input:
-        height = -1
-        width = -1
-        data = input.read(25)
-
-        if (size >= 10) and data[:6] in (b'GIF87a', b'GIF89a'):
-            # GIFs
-            w, h = struct.unpack("<HH", data[6:10])
-            width = int(w)
-            height = int(h)
-        elif ((size >= 24) and data.startswith(b'\211PNG\r\n\032\n')
-              and (data[12:16] == b'IHDR')):
-            # PNGs
-            w, h = struct.unpack(">LL", data[16:24])
-            width = int(w)
-            height = int(h)
-        elif (size >= 16) and data.startswith(b'\211PNG\r\n\032\n'):
-            # older PNGs?
-            w, h = struct.unpack(">LL", data[8:16])
-            width = int(w)
-            height = int(h)
-        elif (size >= 2) and data.startswith(b'\377\330'):
-            # JPEG
-            msg = " raised while trying to decode as JPEG."
-            input.seek(0)
-            input.read(2)
-            b = input.read(1)
-            try:
-                while (b and b[0] != 0xDA):
-                    while (b[0] != 0xFF): b = input.read(1)
-                    while (b[0] == 0xFF): b = input.read(1)
-                    if (b[0] >= 0xC0 and b[0] <= 0xC3):
-                        input.read(3)
-                        h, w = struct.unpack(">HH", input.read(4))
-                        break
-                    else:
-                        input.read(int(struct.unpack(">H", input.read(2))[0]) - 2)
-                    b = input.read(1)
-                width = int(w)
-                height = int(h)
-            except struct.error:
-                raise UnknownImageFormat("StructError" + msg)
-            except ValueError:
-                raise UnknownImageFormat("ValueError" + msg)
-            except Exception as e:
-                raise UnknownImageFormat(e.__class__.__name__ + msg)
-        else:
-            raise UnknownImageFormat(
-                "Sorry, don't know how to get information from this file."
-            )
-
-    return width, height
+    # Through stdin: the tags may contain quotes
+    try:
+        return subprocess.run(['pbcopy'], input=txt.strip().encode('utf-8')).returncode
+    except OSError:
+        return 1
 
 
 def validate_settings():
@@ -127,157 +76,941 @@ def get_valid_title(s):
     return html.escape(s)
 
 
-class Settings(object):
-    def __init__(self, setting_path):
-        self.PROJECT_PATH = None
-        if os.path.isfile(setting_path):
-            with open(setting_path, 'r') as f:
-                for line in f:
-                    k, v = line.split('=')
-                    setattr(self, k.upper(), v.strip())
+with trace.phase('settings'):
+    # Only the selected project is loaded
+    SETTINGS = Settings(BLOGGING_SETTINGS_FILE, selected_project(sys.argv))
 
 
-SETTINGS = Settings(BLOGGING_SETTINGS_FILE)
+_META_INDEXES = dict()
+_FILTER_INDEXES = dict()
 
 
-def _get_meta_info(path=None):
+def _get_meta_index(path=None):
     if path is None:
         path = SETTINGS.POSTS_FOLDER
-    info = dict()
-    for file_name in os.listdir(os.path.join(SETTINGS.PROJECT_PATH, path)):
-        if file_name.startswith('.'):
-            continue
-        info[file_name] = dict()
-        with codecs.open(os.path.join(SETTINGS.PROJECT_PATH, path, file_name), 'r', encoding='utf-8') as f:
-            first_line = f.readline()
-            if first_line.startswith('---'):
-                while True:
-                    line = f.readline()
-                    if line.startswith('title:'):
-                        title = line[6:].strip()
-                        info[file_name]['title'] = title
-                    elif line.startswith('category:'):
-                        category = line[9:].strip()
-                        info[file_name]['category'] = category
-                    elif line.startswith('tags:'):
-                        tag_list = line[5:].strip()[1:-1].split(',')
-                        tag_list = [tag.strip() for tag in tag_list]
-                        info[file_name]['tag'] = tag_list
-                    if line.startswith('---'):
-                        break
-    return info
+    if path not in _META_INDEXES:
+        # `header_limit` in the settings file bounds how many bytes are read to find the front matter
+        header_limit = int(getattr(SETTINGS, 'HEADER_LIMIT', HEADER_LIMIT))
+        _META_INDEXES[path] = MetaIndex(SETTINGS.PROJECT_PATH, path, header_limit=header_limit)
+    return _META_INDEXES[path]
 
 
-def _list_meta_info(path=None):
+def _get_meta_info(path=None):
+    return _get_meta_index(path).info()
+
+
+def _get_catalog(path=None):
+    return _get_meta_index(path).get_catalog()
+
+
+def rebuild_meta_index(rebuild=False):
+    for path in (SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER):
+        index = _get_meta_index(path)
+        parsed = index.refresh(rebuild=rebuild)
+        print('{0}: {1} files indexed, {2} re-parsed'.format(path, len(index.catalog), parsed))
+        for file_name, error in sorted(index.errors().items()):
+            print(colored('  {0}: {1}'.format(file_name, error), 'red'))
+
+
+def _get_filter_index(path=None):
     if path is None:
         path = SETTINGS.POSTS_FOLDER
-    result = dict()
-    categories = dict()
-    tags = dict()
-    titles = dict()
-    result['category'] = categories
-    result['tag'] = tags
-    result['title'] = titles
-    info = _get_meta_info(path)
-    for file_name in info:
-        category = info[file_name].get('category')
-        tag_list = info[file_name].get('tag')
-        title = info[file_name]['title']
+    if path not in _FILTER_INDEXES:
+        _FILTER_INDEXES[path] = FilterIndex(_get_catalog(path))
+    return _FILTER_INDEXES[path]
+
+
+def invalidate_meta_info(path, file_names=None):
+    """
+    Drop the in-memory meta info of `path`, only re-checking `file_names` if given.
+    Used by long running processes (e.g. `blogging daemon`) when the folder changes.
+    """
+    _FILTER_INDEXES.pop(path, None)
+    index = _META_INDEXES.get(path)
+    if index is not None and index.catalog is not None:
+        if file_names:
+            index.update(file_names)
+        else:
+            index.refresh()
+
+
+def _list_meta_info(path=None):
+    catalog = _get_catalog(path)
+    return {'category': catalog.category_stats(), 'tag': catalog.tag_stats(), 'title': catalog.titles}
+
+
+def _across_projects(func):
+    """
+    Call `func(settings)` for each project of the settings file concurrently (each one has its own caches).
+    Return a list of (project name, result), in the order of the settings file.
+    """
+    projects = [Settings(BLOGGING_SETTINGS_FILE, name) for name in SETTINGS.PROJECTS]
+    with ThreadPoolExecutor(max_workers=max(1, len(projects))) as executor:
+        results = list(executor.map(func, projects))
+    return [(settings.PROJECT_NAME, result) for settings, result in zip(projects, results)]
+
+
+def _project_catalog(settings, path):
+    if settings.PROJECT_NAME == SETTINGS.PROJECT_NAME:
+        return _get_catalog(path)
+    header_limit = int(getattr(settings, 'HEADER_LIMIT', HEADER_LIMIT))
+    return MetaIndex(settings.PROJECT_PATH, path, header_limit=header_limit).get_catalog()
+
+
+def _get_fulltext_index(settings=None):
+    from blogging.fulltext import FullTextIndex
+    settings = settings or SETTINGS
+    return FullTextIndex(settings.PROJECT_PATH, (settings.DRAFTS_FOLDER, settings.POSTS_FOLDER))
+
+
+def _search_file_names(query, path, limit=50):
+    index = _get_fulltext_index()
+    index.update()
+    results = index.search(query, folders=[path], limit=limit)
+    index.close()
+    return [file_name for folder, file_name, title, snippet in results]
+
+
+def _search_project(settings, query, limit, rebuild):
+    index = _get_fulltext_index(settings)
+    try:
+        index.update(rebuild=rebuild)
+        return index.search(query, limit=limit, with_rank=True)
+    finally:
+        index.close()
+
+
+def search_blogs(query, limit=20, rebuild=False, all_projects=False):
+    from blogging.fulltext import HIGHLIGHT_START, HIGHLIGHT_END
+    if all_projects:
+        # The bm25 ranks of the projects are merged: the best matches of all of them first
+        results = sorted(((project,) + row for project, rows in _across_projects(
+            lambda settings: _search_project(settings, query, limit, rebuild)) for row in rows),
+            key=lambda row: row[-1])[:limit]
+    else:
+        results = [(None,) + row for row in _search_project(SETTINGS, query, limit, rebuild)]
+    if not results:
+        print('No blog matches "{0}".'.format(query))
+    highlight = re.compile('{0}(.*?){1}'.format(HIGHLIGHT_START, HIGHLIGHT_END))
+    for project, folder, file_name, title, snippet, rank in results:
+        location = folder if project is None else '{0}:{1}'.format(project, folder)
+        print(colored(file_name, 'cyan') + ' ' + colored('[{0}]'.format(location), 'magenta') + ' ' + title)
+        snippet = highlight.sub(lambda m: colored(m.group(1), 'yellow', attrs=['bold']), ' '.join(snippet.split()))
+        print('    ' + snippet)
+
+
+def _git_session():
+    return GitSession(SETTINGS.PROJECT_PATH)
+
+
+def _push_queue():
+    # `push_delay` in the settings file: seconds to wait for more commits before pushing
+    return PushQueue(SETTINGS.PROJECT_PATH, delay=float(getattr(SETTINGS, 'PUSH_DELAY', PUSH_DELAY)))
+
+
+def commit_and_push(paths, message, folders=None):
+    """
+    Stage `paths` and/or every change under `folders` and commit them, then leave the push to the background push
+    queue.
+    """
+    session = _git_session()
+    try:
+        if folders:
+            session.stage_folders(folders)
+        if paths:
+            session.stage(paths)
+        committed = session.commit(message)
+    except GitError as e:
+        print(colored('Git failed: {0}'.format(e), 'red'))
+        exit(1)
+    if not committed:
+        print('Nothing to commit.')
+        return False
+    _push_queue().request()
+    print('Committed. Pushing in the background (see `blogging status`).')
+    return True
+
+
+def _folders_snapshot(folders):
+    snapshot = dict()
+    for folder in folders:
+        folder_path = os.path.join(SETTINGS.PROJECT_PATH, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                st = entry.stat()
+                snapshot[folder + '/' + entry.name] = [st.st_mtime_ns, st.st_size]
+    return snapshot
+
+
+def save_changes():
+    """
+    Commit the changed drafts/posts. The folders' stat snapshot of the last save tells cheaply when nothing
+    changed since, in which case git is not even called.
+    """
+    # The images stored by `blogging image` go with the drafts which use them
+    folders = [SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER, SETTINGS.IMAGES_FOLDER]
+    snapshot_path = os.path.join(project_cache_dir(SETTINGS.PROJECT_PATH), 'save-snapshot.json')
+    snapshot = _folders_snapshot(folders)
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == snapshot:
+                print('Nothing to save.')
+                return
+    except (OSError, ValueError):
+        pass
+    try:
+        changes = _git_session().changed_files(folders)
+    except GitError as e:
+        print(colored('Git failed: {0}'.format(e), 'red'))
+        exit(1)
+    if changes:
+        message = 'Save drafts and edited posts\n\n' + '\n'.join(
+            '{0}: {1}'.format(status, path) for status, path in changes)
+        if not commit_and_push([os.path.join(SETTINGS.PROJECT_PATH, path) for status, path in changes], message):
+            return
+        for status, path in changes:
+            print('  {0}: {1}'.format(status, path))
+    else:
+        print('Nothing to save.')
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    atomic_write_json(snapshot_path, snapshot)
+
+
+def _update_meta_indexes(changed):
+    for path, file_names in changed.items():
+        if path in (SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER):
+            _FILTER_INDEXES.pop(path, None)
+            _get_meta_index(path).update(file_names)
+
+
+def watch_changes(quiet, interval, push_interval):
+    """
+    Commit the drafts, posts and images as they change, until interrupted. The meta info cache used by the
+    completions is kept up to date along the way.
+    """
+    import signal
+    from blogging.autosave import AutoSaver
+    saver = AutoSaver(SETTINGS.PROJECT_PATH, [SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER, SETTINGS.IMAGES_FOLDER],
+                      quiet=quiet, interval=interval, push_interval=push_interval,
+                      push_delay=float(getattr(SETTINGS, 'PUSH_DELAY', PUSH_DELAY)), on_change=_update_meta_indexes)
+
+    def on_signal(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    print('Watching the drafts, posts and images. Press Ctrl-C to stop.')
+    try:
+        saver.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def _require_pillow():
+    try:
+        import PIL
+    except ImportError:
+        print(colored('Optimizing images needs Pillow: pip install Pillow', 'red'))
+        exit(1)
+
+
+def _image_url(image_name):
+    image_url = SETTINGS.IMAGES_FOLDER.replace(SETTINGS.PROJECT_PATH, '') + '/' + image_name
+    return image_url if image_url.startswith('/') else '/' + image_url
+
+
+def _report_optimized(results):
+    saved = 0
+    for name, saved_bytes, variants, error in results:
+        if error:
+            print(colored('Failed to optimize {0}: {1}'.format(name, error), 'red'))
+            continue
+        saved += saved_bytes
+        print('{0}: {1} KB saved{2}'.format(name, saved_bytes // 1024,
+                                            ', variants: ' + ', '.join(variants) if variants else ''))
+    return saved
+
+
+def add_images(image_paths, draft_file, optimize=False):
+    """
+    Store the images for a draft (reusing the already stored ones), stage them and copy all their tags to the
+    clipboard at once.
+    """
+    image_paths = expand_image_paths(image_paths)
+    missing = [path for path in image_paths if not os.path.isfile(path)]
+    if missing or not image_paths:
+        print(colored('No such image: {0}'.format(', '.join(missing)) if missing else 'No image found.', 'red'))
+        exit(1)
+    if optimize:
+        _require_pillow()
+    store = ImageStore(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER)
+    images = store.add(image_paths, draft_file.replace('.md', ''))
+    added = [image.name for image in images if not image.reused]
+    if optimize and added:
+        results = store.optimize(added)
+        _report_optimized(results)
+        for name, saved_bytes, variants, error in results:
+            added.extend(variants)
+    if added:
+        _git_session().stage([os.path.join(store.folder_path, name) for name in added])
+    image_tags = []
+    for image in images:
+        variants = store.variants(image.name)
+        if image.size is None:
+            print(colored('Cannot read the size of {0}: its tag has no width.'.format(image.source), 'yellow'))
+        srcset = ''
+        if variants:
+            # The original is a candidate only with its width
+            candidates = variants + [(image.name, image.size[0])] if image.size else variants
+            srcset = ' srcset="{0}"'.format(', '.join('{0} {1}w'.format(_image_url(name), width)
+                                                      for name, width in candidates))
+        width = ' width="{0}"'.format(image.size[0]) if image.size else ''
+        image_tags.append('''<img title="{0}" src="{1}"{2}{3} />
+<span class="caption">REPLACEME</span>'''.format(image.name, _image_url(image.name), srcset, width))
+        if image.reused:
+            print(colored('{0} is already stored as {1}'.format(image.source, image.name), 'yellow'))
+    image_tag = '\n'.join(image_tags)
+    print(image_tag)
+    print('Above image tags has been copied to clipboard.')
+    # Add to clipboard
+    copy2clip(image_tag)
+
+
+def optimize_images(image_names, widths):
+    _require_pillow()
+    store = ImageStore(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER)
+    results = store.optimize(image_names or None, widths=widths)
+    if not results:
+        print('All the images are optimized already.')
+        return
+    saved = _report_optimized(results)
+    paths = []
+    for name, saved_bytes, variants, error in results:
+        if saved_bytes:
+            paths.append(name)
+        paths.extend(variants)
+    if paths:
+        _git_session().stage([os.path.join(store.folder_path, name) for name in paths])
+    print('{0} KB saved in total. The changes are staged, run `blogging save` to commit them.'.format(saved // 1024))
+
+
+def audit_images(prune=False):
+    """
+    Report the stored images no draft/post refers to and the references to missing images. With `prune`, delete
+    the unreferenced images and stage the deletions.
+    """
+    store = ImageStore(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER)
+    images = store.scan()
+    file_paths = []
+    for folder in (SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER):
+        folder_path = os.path.join(SETTINGS.PROJECT_PATH, folder)
+        if os.path.isdir(folder_path):
+            with os.scandir(folder_path) as it:
+                file_paths.extend(entry.path for entry in it if not entry.name.startswith('.') and entry.is_file())
+    references = find_image_references(file_paths, SETTINGS.IMAGES_FOLDER.replace(SETTINGS.PROJECT_PATH, ''))
+    referenced = set().union(*references.values())
+    unreferenced = sorted(name for name in images if name not in referenced)
+    dangling = sorted((os.path.relpath(path, SETTINGS.PROJECT_PATH), name)
+                      for path, names in references.items() for name in names if name not in images)
+    reclaimable = sum(images[name][1] for name in unreferenced)
+    if unreferenced:
+        print(colored('Images not referenced by any draft or post:', 'magenta'))
+        print(tabulate([(name, '{0} KB'.format(images[name][1] // 1024)) for name in unreferenced],
+                       tablefmt='plain'))
+    if dangling:
+        print(colored('References to missing images:', 'magenta'))
+        print(tabulate(dangling, headers=['File', 'Image']))
+    print('{0} images, {1} unreferenced ({2} KB reclaimable), {3} missing references.'.format(
+        len(images), len(unreferenced), reclaimable // 1024, len(dangling)))
+    if prune and unreferenced:
+        paths = [os.path.join(store.folder_path, name) for name in unreferenced]
+        for path in paths:
+            os.remove(path)
+        _git_session().stage(paths)
+        print('The unreferenced images have been deleted. The deletions are staged, run `blogging save` to commit '
+              'them.')
+
+
+def preview_draft(draft_file, port):
+    import webbrowser
+    from blogging.preview import PreviewServer
+    try:
+        server = PreviewServer(SETTINGS.PROJECT_PATH, (SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER), port=port)
+    except OSError as e:
+        print(colored('Cannot serve on port {0}: {1}'.format(port, e.strerror), 'red'))
+        exit(1)
+    url = server.url(SETTINGS.DRAFTS_FOLDER, draft_file)
+    print('Previewing on {0} (the page reloads when the file is saved). Press Ctrl-C to stop.'.format(url))
+    webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def check_links(include_drafts=False, external=True, refresh=False, host_concurrency=4, timeout=10.0):
+    from blogging.links import LinkChecker, check_local, extract_links, is_external
+    folders = [SETTINGS.POSTS_FOLDER] + ([SETTINGS.DRAFTS_FOLDER] if include_drafts else [])
+    # The posts known by the meta index: the targets of the cross-links, and the titles to show
+    catalog = _get_catalog(SETTINGS.POSTS_FOLDER)
+    post_names = {os.path.splitext(file_name)[0] for file_name in catalog.file_names}
+    titles = {file_name: title for title, file_name in _list_meta_info(SETTINGS.POSTS_FOLDER)['title'].items()}
+    file_paths = []
+    for folder in folders:
+        folder_path = os.path.join(SETTINGS.PROJECT_PATH, folder)
+        if os.path.isdir(folder_path):
+            with os.scandir(folder_path) as it:
+                file_paths.extend(entry.path for entry in it if not entry.name.startswith('.') and entry.is_file())
+
+    def read_links(file_path):
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            return extract_links(f.read())
+
+    with ThreadPoolExecutor() as executor:
+        links = dict(zip(file_paths, executor.map(read_links, file_paths)))
+    problems = []
+    external_links = dict()
+    for file_path, file_links in sorted(links.items()):
+        for link in file_links:
+            if is_external(link):
+                external_links.setdefault(link, []).append(file_path)
+                continue
+            error = check_local(link, SETTINGS.PROJECT_PATH, post_names)
+            if error:
+                problems.append((file_path, link, error))
+    if external and external_links:
+        print('Checking {0} external links...'.format(len(external_links)))
+        checker = LinkChecker(os.path.join(project_cache_dir(SETTINGS.PROJECT_PATH), 'links.json'),
+                              host_concurrency=host_concurrency, timeout=timeout)
+        for link, error in checker.check(list(external_links), refresh=refresh).items():
+            if error:
+                problems.extend((file_path, link, error) for file_path in external_links[link])
+    if not problems:
+        print(colored('No broken link found in {0} files.'.format(len(file_paths)), 'green'))
+        return True
+    table = []
+    for file_path, link, error in sorted(problems):
+        file_name = os.path.basename(file_path)
+        table.append((os.path.relpath(file_path, SETTINGS.PROJECT_PATH), titles.get(file_name, ''), link, error))
+    print(tabulate(table, headers=['File', 'Title', 'Link', 'Problem']))
+    print(colored('{0} broken links.'.format(len(problems)), 'red'))
+    return False
+
+
+def show_trace_summary(trace_file, command=None):
+    records = trace.load(trace_file)
+    if not records:
+        print('No trace recorded yet. Run some commands with --profile or BLOGGING_TRACE=1 first.')
+        return
+    rows = trace.summarize(records, command)
+    runs = len({record['run'] for record in records
+                if not command or (record.get('command') or '').startswith(command)})
+    table = [(name, kind, count, '{0:.2f}'.format(p50), '{0:.2f}'.format(p90), '{0:.2f}'.format(p99),
+              '{0:.2f}'.format(maximum)) for name, kind, count, p50, p90, p99, maximum, total in rows]
+    print(tabulate(table, headers=['Phase', 'Kind', 'Count', 'p50 ms', 'p90 ms', 'p99 ms', 'Max ms']))
+    print('{0} runs.'.format(runs))
+
+
+def _select_drafts(patterns, filters=None):
+    """
+    Return the draft file names matching any of the names/glob patterns, plus the ones matched by the filters.
+    """
+    all_drafts = FileCompleter(SETTINGS.DRAFTS_FOLDER).choices
+    selected = []
+    for pattern in patterns:
+        matched = fnmatch.filter(all_drafts, pattern) if glob.has_magic(pattern) else [pattern]
+        if not matched or (matched == [pattern] and pattern not in all_drafts):
+            print(colored('No draft matches "{0}".'.format(pattern), 'red'))
+            exit(1)
+        selected.extend(sorted(matched))
+    if filters:
+        selected.extend(_get_filter_index(SETTINGS.DRAFTS_FOLDER).query(' '.join(filters)))
+    # Keep the order, drop the duplicates
+    return list(dict.fromkeys(selected))
+
+
+def _prepare_post(draft_file, today):
+    """
+    Write the draft with today's date to a temp file in the posts folder. Return (temp path, post path).
+    """
+    draft_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.DRAFTS_FOLDER, draft_file)
+    post_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, str(today) + draft_file[10:])
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(post_path), prefix='.publish-')
+    try:
+        changed_date = False
+        with open(draft_path, 'r', encoding='utf-8') as out_file, os.fdopen(fd, 'w', encoding='utf-8') as in_file:
+            for line in out_file:
+                if not changed_date and line.startswith('date:'):
+                    changed_date = True
+                    line = 'date: {0}\n'.format(str(today))
+                in_file.write(line)
+        shutil.copystat(draft_path, tmp_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, post_path
+
+
+def publish_drafts(draft_files, feeds=False):
+    """
+    Move the drafts to the posts folder with today's date, in one commit. Either all of them are published or,
+    if any of them fails, none. With `feeds`, the feed and sitemap including them go in the commit too.
+    """
+    # A bad site config stops the publish before any draft is touched
+    feed_writer = _feed_writer() if feeds else None
+    today = datetime.date.today()
+    post_paths = [os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, str(today) + f[10:]) for f in draft_files]
+    conflicts = [path for path in post_paths if os.path.exists(path)]
+    if len(set(post_paths)) != len(post_paths) or conflicts:
+        print(colored('Posts already exist: {0}'.format(', '.join(conflicts or post_paths)), 'red'))
+        exit(1)
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(_prepare_post, draft_file, today) for draft_file in draft_files]
+    prepared = []
+    errors = []
+    for draft_file, future in zip(draft_files, futures):
+        if future.exception() is None:
+            prepared.append(future.result())
+        else:
+            errors.append((draft_file, future.exception()))
+    moved = []
+    if not errors:
+        try:
+            for tmp_path, post_path in prepared:
+                os.rename(tmp_path, post_path)
+                moved.append(post_path)
+        except OSError as e:
+            errors.append(('drafts', e))
+    if errors:
+        for tmp_path, post_path in prepared:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        for post_path in moved:
+            os.remove(post_path)
+        for draft_file, error in errors:
+            print(colored('Failed to publish {0}: {1}'.format(draft_file, error), 'red'))
+        print(colored('Nothing has been published.', 'red'))
+        exit(1)
+    draft_paths = [os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.DRAFTS_FOLDER, f) for f in draft_files]
+    for draft_path in draft_paths:
+        os.remove(draft_path)
+    if len(draft_files) == 1:
+        message = 'Publish post: {0}'.format(draft_files[0])
+    else:
+        message = 'Publish {0} posts\n\n'.format(len(draft_files)) + '\n'.join('- ' + f for f in draft_files)
+    paths = moved + draft_paths
+    if feeds:
+        _get_meta_index(SETTINGS.POSTS_FOLDER).refresh()
+        paths += update_feeds(feed_writer)
+    # The rewritten post and the removed draft are staged together, so git records each one as a rename
+    commit_and_push(paths, message)
+
+
+def _feed_writer():
+    from blogging.feeds import FeedWriter, Site, SiteError
+    try:
+        # `site_url` in the settings file, else `url` in the _config.yml of the site
+        site = Site.from_config(SETTINGS.PROJECT_PATH, getattr(SETTINGS, 'SITE_URL', None))
+    except SiteError as e:
+        print(colored('Cannot write the feeds: {0}. Set `url` in _config.yml or `site_url` in {1}.'.format(
+            e, BLOGGING_SETTINGS_FILE), 'red'))
+        exit(1)
+    return FeedWriter(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, site)
+
+
+def write_feed(output=None, fmt=None, limit=10, rebuild=False, writer=None):
+    """
+    Write the feed of the latest posts (to `feed_file` of the settings file, `feed.xml` by default). Return the path
+    if it was rewritten.
+    """
+    path = os.path.join(SETTINGS.PROJECT_PATH, output or getattr(SETTINGS, 'FEED_FILE', 'feed.xml'))
+    fmt = fmt or getattr(SETTINGS, 'FEED_FORMAT', 'atom')
+    if not (writer or _feed_writer()).write_feed(_get_catalog(SETTINGS.POSTS_FOLDER), path, fmt, limit, rebuild):
+        print('{0} is up to date.'.format(os.path.relpath(path, SETTINGS.PROJECT_PATH)))
+        return None
+    print('Wrote {0}.'.format(os.path.relpath(path, SETTINGS.PROJECT_PATH)))
+    return path
+
+
+def write_sitemap(output=None, rebuild=False, writer=None):
+    """
+    Write the sitemap of the posts (to `sitemap_file` of the settings file, `sitemap.xml` by default). Return the
+    paths rewritten or removed.
+    """
+    path = os.path.join(SETTINGS.PROJECT_PATH, output or getattr(SETTINGS, 'SITEMAP_FILE', 'sitemap.xml'))
+    written = (writer or _feed_writer()).write_sitemap(_get_catalog(SETTINGS.POSTS_FOLDER), path, rebuild)
+    if not written:
+        print('{0} is up to date.'.format(os.path.relpath(path, SETTINGS.PROJECT_PATH)))
+    for written_path in written:
+        print('{0} {1}.'.format('Wrote' if os.path.exists(written_path) else 'Removed',
+                                os.path.relpath(written_path, SETTINGS.PROJECT_PATH)))
+    return written
+
+
+def update_feeds(writer=None):
+    """
+    Bring the feed and the sitemap up to date. Return the paths rewritten (or removed).
+    """
+    writer = writer or _feed_writer()
+    feed_path = write_feed(writer=writer)
+    return ([feed_path] if feed_path else []) + write_sitemap(writer=writer)
+
+
+def _rewrite_meta(targets, edit, message, dry_run=False):
+    """
+    Apply `edit` to the front matter of the {folder: file names} targets and commit the rewritten files at once.
+    If any of them cannot be rewritten, none is.
+    """
+    from blogging.frontmatter import apply_rewrites, discard_rewrites, prepare_rewrites
+    locations = {os.path.join(SETTINGS.PROJECT_PATH, folder, file_name): (folder, file_name)
+                 for folder, file_names in targets.items() for file_name in file_names}
+    rewrites, errors = prepare_rewrites(list(locations), edit, dry_run)
+    if errors:
+        discard_rewrites(rewrites)
+        for path, error in errors:
+            folder, file_name = locations[path]
+            print(colored('Failed to rewrite {0}/{1}: {2}'.format(folder, file_name, error), 'red'))
+        print(colored('Nothing has been rewritten.', 'red'))
+        exit(1)
+    if not rewrites:
+        print('Nothing to change.')
+        return
+    rewrites.sort(key=lambda rewrite: locations[rewrite.path])
+    if dry_run:
+        for rewrite in rewrites:
+            print(colored('{0}/{1}'.format(*locations[rewrite.path]), 'cyan'))
+            for line in rewrite.diff():
+                print('    ' + colored(line.rstrip('\r\n'), 'red' if line.startswith('-') else 'green'))
+        print('{0} files would be rewritten.'.format(len(rewrites)))
+        return
+    replaced = apply_rewrites(rewrites)
+    changed = dict()
+    for path in replaced:
+        folder, file_name = locations[path]
+        changed.setdefault(folder, []).append(file_name)
+    _update_meta_indexes(changed)
+    print('{0} files rewritten.'.format(len(replaced)))
+    commit_and_push(replaced, message + '\n\n' + '\n'.join('- {0}/{1}'.format(*locations[path]) for path in replaced))
+
+
+def _tagged(folders, category=None, tag=None):
+    # The meta index tells which files to rewrite, only they are read
+    return {folder: _get_catalog(folder).file_names_with(category=category, tag=tag) for folder in folders}
+
+
+def retag(old_tag, new_tag=None, dry_run=False):
+    """
+    Rename a tag (merging it into `new_tag` if some blogs have both) in all the drafts and posts, or remove it.
+    """
+    def edit(meta):
+        tags = meta.get('tag') or []
+        if old_tag in tags:
+            meta['tag'] = list(dict.fromkeys(new_tag if tag == old_tag else tag for tag in tags
+                                             if new_tag or tag != old_tag))
+        return meta
+
+    if new_tag:
+        message = 'Retag "{0}" as "{1}"'.format(old_tag, new_tag)
+    else:
+        message = 'Remove tag "{0}"'.format(old_tag)
+    targets = _tagged((SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER), tag=old_tag)
+    _rewrite_meta(targets, edit, message, dry_run)
+
+
+def recategorize(old_category, new_category, dry_run=False):
+    """
+    Move all the drafts and posts of a category to another one.
+    """
+    def edit(meta):
+        if meta.get('category') == old_category:
+            meta['category'] = new_category
+        return meta
+
+    targets = _tagged((SETTINGS.DRAFTS_FOLDER, SETTINGS.POSTS_FOLDER), category=old_category)
+    _rewrite_meta(targets, edit, 'Recategorize "{0}" as "{1}"'.format(old_category, new_category), dry_run)
+
+
+def set_meta(file_names, filters, include_drafts=False, category=None, tags=None, add_tags=(), remove_tags=(),
+             dry_run=False):
+    """
+    Set the category and/or tags of the posts (and drafts if asked) named or matched by the filters.
+    """
+    folders = [SETTINGS.POSTS_FOLDER] + ([SETTINGS.DRAFTS_FOLDER] if include_drafts else [])
+    targets = {folder: [] for folder in folders}
+    for file_name in file_names:
+        folder = next((folder for folder in folders if file_name in _get_catalog(folder)), None)
+        if folder is None:
+            print(colored('No blog named "{0}".'.format(file_name), 'red'))
+            exit(1)
+        targets[folder].append(file_name)
+    if filters:
+        for folder in folders:
+            targets[folder].extend(_get_filter_index(folder).query(' '.join(filters)))
+    targets = {folder: list(dict.fromkeys(names)) for folder, names in targets.items()}
+
+    def edit(meta):
         if category:
-            if category in categories:
-                categories[category] += 1
-            else:
-                categories[category] = 1
-        if tag_list:
-            for tag in tag_list:
-                tag = tag.strip()
-                if tag in tags:
-                    tags[tag] += 1
-                else:
-                    tags[tag] = 1
-        titles[title] = file_name
-    return result
+            meta['category'] = category
+        if tags is not None or add_tags or remove_tags:
+            new_tags = list(meta.get('tag') or []) if tags is None else list(tags)
+            meta['tag'] = list(dict.fromkeys(tag for tag in new_tags + list(add_tags) if tag not in remove_tags))
+        return meta
+
+    changes = (['category: ' + category] if category else []) + \
+        (['tags: [{0}]'.format(', '.join(tags))] if tags is not None else []) + \
+        ['+' + tag for tag in add_tags] + ['-' + tag for tag in remove_tags]
+    _rewrite_meta(targets, edit, 'Set {0}'.format(', '.join(changes)), dry_run)
+
+
+def show_status():
+    state = _push_queue().state()
+    unpushed = _git_session().unpushed_commits()
+    if state.get('running'):
+        push_status = colored('pushing', 'yellow')
+    elif state.get('error') and state.get('requested', 0) > state.get('pushed', 0):
+        push_status = colored('failed', 'red')
+    elif state.get('requested', 0) > state.get('pushed', 0):
+        push_status = colored('pending', 'yellow')
+    else:
+        push_status = colored('up to date', 'green')
+    table = [['Push', push_status],
+             ['Unpushed commits', '?' if unpushed is None else unpushed]]
+    if state.get('last_push'):
+        table.append(['Last push', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['last_push']))])
+    if state.get('error'):
+        table.append(['Last failure', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['last_failure']))])
+        table.append(['Error', state['error']])
+    print(tabulate(table, tablefmt='plain'))
+
+
+def push_changes():
+    print('Pushing...')
+    if _push_queue().push_now():
+        print(colored('Pushed.', 'green'))
+    else:
+        print(colored('Push failed: {0}'.format(_push_queue().state().get('error')), 'red'))
+        exit(1)
 
 
 def stats_categories():
-    result = _list_meta_info()
+    category_stats = _get_catalog().category_stats()
     table = []
-    all_categories = list(result['category'].keys())
-    all_categories.sort()
-    for c in all_categories:
-        table.append([c, result['category'][c]])
+    for c in sorted(category_stats):
+        table.append([c, category_stats[c]])
     print(tabulate(table, headers=['Category', 'Count']))
 
 
 def stats_tags():
-    result = _list_meta_info()
+    tag_stats = _get_catalog().tag_stats()
     table = []
-    all_tags = list(result['tag'].keys())
-    all_tags.sort()
-    for c in all_tags:
-        table.append([c, result['tag'][c]])
+    for c in sorted(tag_stats):
+        table.append([c, tag_stats[c]])
     print(tabulate(table, headers=['Tag', 'Count']))
 
 
+def stats_across_projects(facet):
+    """
+    Show the merged counts of the categories or tags (`facet`) of the posts of all the projects.
+    """
+    results = _across_projects(lambda settings: getattr(_project_catalog(settings, settings.POSTS_FOLDER),
+                                                        facet + '_stats')())
+    totals = dict()
+    projects = dict()
+    for project, stats in results:
+        for name, count in stats.items():
+            totals[name] = totals.get(name, 0) + count
+            projects.setdefault(name, []).append(project)
+    table = []
+    for name in sorted(totals):
+        table.append([name, totals[name], ', '.join(projects[name])])
+    print(tabulate(table, headers=[facet.capitalize(), 'Count', 'Projects']))
+
+
+def _list_project_posts(settings, path_key, filters):
+    catalog = _project_catalog(settings, getattr(settings, path_key))
+    if filters:
+        file_names = FilterIndex(catalog).query(' '.join(filters))
+    else:
+        file_names = sorted(catalog.file_names)
+    return [(file_name, catalog.get(file_name).title or '') for file_name in file_names]
+
+
+def list_posts(path_key, filters=None, all_projects=False):
+    """
+    List the posts (or drafts, with `path_key` DRAFTS_FOLDER) matching the filters, of all the projects if asked.
+    """
+    if all_projects:
+        results = _across_projects(lambda settings: _list_project_posts(settings, path_key, filters))
+        table = [(project, file_name, title) for project, posts in results for file_name, title in posts]
+        print(tabulate(table, headers=['Project', 'File', 'Title']))
+    else:
+        table = _list_project_posts(SETTINGS, path_key, filters)
+        print(tabulate(table, headers=['File', 'Title']))
+
+
+def _get_related_index():
+    from blogging.related import RelatedIndex
+    index = RelatedIndex(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER)
+    index.update(_get_catalog(SETTINGS.POSTS_FOLDER))
+    return index
+
+
+def _print_related(index, query_features, limit, exclude=()):
+    catalog = _get_catalog(SETTINGS.POSTS_FOLDER)
+    related = index.query(query_features, limit=limit, exclude=exclude)
+    if not related:
+        print('No related post found.')
+        return
+    table = [(score, file_name, catalog.get(file_name).title or '') for file_name, score in related]
+    print(tabulate(table, headers=['Score', 'Post', 'Title'], floatfmt='.2f'))
+
+
+def _print_suggested_tags(index, query_features, tags):
+    suggested = index.suggest_tags(query_features, exclude=tags)
+    if suggested:
+        print('Suggested tags: ' + ' '.join(colored(tag, 'cyan') for tag, score in suggested))
+
+
+def show_related(file_name, draft=False, limit=10):
+    """
+    Show the posts most similar to a post or draft (by tags, category and title), and the tags of these posts it
+    does not have.
+    """
+    from blogging.related import features
+    catalog = _get_catalog(SETTINGS.DRAFTS_FOLDER if draft else SETTINGS.POSTS_FOLDER)
+    post = catalog.get(file_name)
+    if post is None:
+        print(colored('No such {0}: {1}'.format('draft' if draft else 'post', file_name), 'red'))
+        exit(1)
+    tags = catalog.tags_of(post)
+    query_features = features(post.title, catalog.category_of(post), tags)
+    index = _get_related_index()
+    _print_related(index, query_features, limit, exclude=[] if draft else [file_name])
+    _print_suggested_tags(index, query_features, tags)
+
+
+def show_related_to_new(title, category, tags, limit=5):
+    from blogging.related import features
+    index = _get_related_index()
+    _print_related(index, features(title, category, tags), limit)
+    # The tags are suggested from the title (and category) alone
+    _print_suggested_tags(index, features(title, category), tags)
+
+
+def ProjectCompleter(prefix, **kwargs):
+    return (name for name in SETTINGS.PROJECTS if name.startswith(prefix))
+
+
+def RelatedCompleter(prefix, parsed_args, **kwargs):
+    folder = SETTINGS.DRAFTS_FOLDER if parsed_args.draft else SETTINGS.POSTS_FOLDER
+    return FileCompleter(folder)(prefix, parsed_args)
+
+
+def _completion_limit():
+    # `completion_limit` in the settings file: max number of file names offered (0 for all)
+    return int(getattr(SETTINGS, 'COMPLETION_LIMIT', completion.DEFAULT_LIMIT))
+
+
 class FileCompleter(object):
+    """
+    Completes the file names under `path`, the most recent first, or the best fuzzy matches of the file names and
+    titles when none starts with the typed prefix (see blogging.completion). Nothing is listed until argcomplete
+    actually asks for the completions of this argument, so building the parser does not touch the drafts/posts
+    folders.
+    """
+
     def __init__(self, path):
-        drafts_path = os.path.join(SETTINGS.PROJECT_PATH, path)
-        if os.path.isdir(drafts_path):
-            file_names = os.listdir(os.path.join(SETTINGS.PROJECT_PATH, path))
-        else:
-            file_names = []
-        self.choices = [name for name in file_names if not name.startswith('.')]
+        self.path = path
+        self._choices = None
+        self._ranked = None
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            drafts_path = os.path.join(SETTINGS.PROJECT_PATH, self.path)
+            if os.path.isdir(drafts_path):
+                file_names = os.listdir(drafts_path)
+            else:
+                file_names = []
+            self._choices = [name for name in file_names if not name.startswith('.')]
+        return self._choices
 
+    def _catalog(self):
+        return _get_catalog(self.path)
+
+    @property
+    def ranked(self):
+        if self._ranked is None:
+            self._ranked = completion.RankedNames(self.choices, self._catalog)
+        return self._ranked
+
+    def warm(self):
+        self.ranked
+
+    @trace.traced('completer.files')
     def __call__(self, prefix, parsed_args, **kwargs):
-        return (c for c in self.choices if c.startswith(prefix))
+        return self.ranked.complete(prefix, _completion_limit())
 
 
 class FileCompleterWithFilter(FileCompleter):
-    def __init__(self, path):
-        super(FileCompleterWithFilter, self).__init__(path)
-        self.info = _get_meta_info(path)
+    @property
+    def index(self):
+        return _get_filter_index(self.path)
 
+    def warm(self):
+        super(FileCompleterWithFilter, self).warm()
+        self.index.warm()
+
+    @trace.traced('completer.files_with_filter')
     def __call__(self, prefix, parsed_args, **kwargs):
+        if getattr(parsed_args, 'search', None):
+            # Keep the ranking of the full-text search
+            allowed = set(self.filter_by_keyword(' '.join(parsed_args.filter))) if parsed_args.filter else None
+            results = [c for c in _search_file_names(' '.join(parsed_args.search), self.path)
+                       if c.startswith(prefix) and (allowed is None or c in allowed)]
+            return results[:_completion_limit() or None]
         if parsed_args.filter:
-            keyword = parsed_args.filter[0]
-            results = self.filter_by_keyword(keyword)
-        else:
-            results = self.choices
-        return (c for c in results if c.startswith(prefix))
+            return completion.RankedNames(self.filter_by_keyword(' '.join(parsed_args.filter)),
+                                          self._catalog).complete(prefix, _completion_limit())
+        return self.ranked.complete(prefix, _completion_limit())
 
     def filter_by_keyword(self, keyword):
-        results = []
-        keyword_lower = keyword.lower()
-        for filename in self.info:
-            meta_data = self.info[filename]
-            if (meta_data.get('category') and keyword_lower == meta_data.get('category').lower()) \
-                    or keyword_lower in meta_data['title'].lower() \
-                    or (meta_data.get('tag') and keyword_lower in [tag.lower() for tag in meta_data.get('tag')]):
-                results.append(filename)
-        return results
+        return self.index.query(keyword)
 
 
+@trace.traced('completer.category')
 def CategoryCompleter(prefix, **kwargs):
-    result = _list_meta_info()
-    all_categories = list(result['category'].keys())
+    all_categories = _get_catalog().category_stats()
     return (c for c in all_categories if c.startswith(prefix))
 
 
+@trace.traced('completer.tag')
 def TagCompleter(prefix, **kwargs):
-    result = _list_meta_info()
-    all_tags = list(result['tag'].keys())
+    all_tags = _get_catalog().tag_stats()
     return (c for c in all_tags if c.startswith(prefix))
 
 
+FILTER_HELP = 'Filter posts by keywords in title/tag/category, e.g. "tag:python category:linux OR vim"'
+SEARCH_HELP = 'Only complete the posts whose content contains the words, best matches first'
+
+
 #################################################################
 # To register with argcompletion, run following command:        #
 #   eval "$(register-python-argcomplete blogging)"              #
 #################################################################
-def parse_arguments():
+def build_parser():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description=colored('blogging ({0})\n'.format(__VERSION__), 'cyan') +
                                                  'A simple tool to create new blogging file.\n' +
                                                  'Use example: ./blogging new "post_title" category tag1 tag2\n')
+    # Read from the command line before parsing (see blogging.trace), declared here for the help and the parsing
+    parser.add_argument('--profile', action='store_true',
+                        help='Record the time spent in each phase of the run (see `blogging trace summary`)')
+    parser.add_argument('--cprofile', metavar='FILE', help='Also dump a cProfile of the run to FILE')
+    # Also read from the command line before parsing, as the completers depend on it
+    parser.add_argument('--project', help='Name of the project in the settings file (the default one if omitted)'
+                        ).completer = ProjectCompleter
     subparsers = parser.add_subparsers(help='Use {subcommand} -h for each subcommand\'s optional arguments details',
                                        dest='command')
 
@@ -286,35 +1019,163 @@ def parse_arguments():
     create_parser.add_argument('category', help='The category of the blog').completer = CategoryCompleter
     create_parser.add_argument('tags', help='The tag list of the blog, separate by space',
                                nargs="*").completer = TagCompleter
+    create_parser.add_argument('--related', action='store_true',
+                               help='Also show the posts related to the new blog and suggest more tags')
 
-    ls_parser = subparsers.add_parser('ls', help='List exist stats')
-    ls_parser.add_argument('list_content', choices=['categories', 'tags'])
+    ls_parser = subparsers.add_parser('ls', help='List exist stats, posts or drafts')
+    ls_parser.add_argument('list_content', choices=['categories', 'tags', 'posts', 'drafts'])
+    ls_parser.add_argument('--filter', action='append', help=FILTER_HELP + ' (for posts and drafts)')
+    ls_parser.add_argument('--all-projects', action='store_true', help='List across all the projects')
 
     save_parser = subparsers.add_parser('save', help='Save all the drafts and changes of edited posts to the Github')
 
     continue_parser = subparsers.add_parser('continue', help='Open one draft and continue the writing')
-    continue_parser.add_argument('--filter', action='store', nargs=1,
-                                 help='Filter posts by keywords in title/tag/category')
+    continue_parser.add_argument('--filter', action='append', help=FILTER_HELP)
+    continue_parser.add_argument('--search', action='append', help=SEARCH_HELP)
     continue_parser.add_argument('draft_file', help='File name of the draft').completer = FileCompleterWithFilter(
         SETTINGS.DRAFTS_FOLDER)
 
     publish_parser = subparsers.add_parser('publish', help='Publish the post to the Github')
-    publish_parser.add_argument('draft_file', help='File name of the draft').completer = FileCompleter(
-        SETTINGS.DRAFTS_FOLDER)
+    publish_parser.add_argument('--filter', action='append', help=FILTER_HELP + ', publish all the matched drafts')
+    publish_parser.add_argument('--feeds', action='store_true',
+                                help='Also update the feed and the sitemap (in the same commit)')
+    publish_parser.add_argument('draft_files', nargs='*',
+                                help='File names (or quoted glob patterns) of the drafts').completer = \
+        FileCompleterWithFilter(SETTINGS.DRAFTS_FOLDER)
 
-    image_parser = subparsers.add_parser('image', help='Rename and save the image to the Github')
-    image_parser.add_argument('image_path', help='Path of the image file')
+    image_parser = subparsers.add_parser('image', help='Rename and save the images to the Github')
+    image_parser.add_argument('image_paths', nargs='+', help='Paths of the image files, or of folders of images')
     image_parser.add_argument('draft_file', help='Title of the blog in draft').completer = FileCompleter(
         SETTINGS.DRAFTS_FOLDER)
+    image_parser.add_argument('--optimize', action='store_true',
+                              help='Recompress the images and add downscaled variants to the tags (needs Pillow)')
+
+    images_parser = subparsers.add_parser('images', help='Manage the images folder')
+    images_subparsers = images_parser.add_subparsers(dest='images_command')
+    images_subparsers.required = True
+    optimize_parser = images_subparsers.add_parser(
+        'optimize', help='Recompress the stored images and make their downscaled variants (needs Pillow)')
+    optimize_parser.add_argument('image_names', nargs='*', help='File names of the images (all by default)')
+    optimize_parser.add_argument('--widths', type=int, nargs='+', default=list(VARIANT_WIDTHS),
+                                 help='Widths of the downscaled variants')
+    audit_parser = images_subparsers.add_parser(
+        'audit', help='Find the images no blog refers to and the references to missing images')
+    audit_parser.add_argument('--prune', action='store_true', help='Delete the unreferenced images')
 
     edit_parser = subparsers.add_parser('edit', help='Open one published post and edit')
-    edit_parser.add_argument('--filter', action='store', nargs=1, help='Filter posts by keywords in title/tag/category')
+    edit_parser.add_argument('--filter', action='append', help=FILTER_HELP)
+    edit_parser.add_argument('--search', action='append', help=SEARCH_HELP)
     edit_parser.add_argument('post_file', help='File name of the post').completer = FileCompleterWithFilter(
         SETTINGS.POSTS_FOLDER)
 
-    argcomplete.autocomplete(parser, always_complete_options=False)
+    index_parser = subparsers.add_parser('index', help='Update the cached meta info of drafts and posts')
+    index_parser.add_argument('--rebuild', action='store_true', help='Drop the cache and re-parse all the files')
+
+    watch_parser = subparsers.add_parser('watch', help='Keep saving the drafts and changes of edited posts to the '
+                                                       'Github as they are written')
+    watch_parser.add_argument('--quiet', type=float, default=10.0,
+                              help='Seconds without changes before committing them')
+    watch_parser.add_argument('--interval', type=float, default=60.0, help='Min seconds between two commits')
+    watch_parser.add_argument('--push-interval', type=float, default=300.0, help='Min seconds between two pushes')
+
+    subparsers.add_parser('status', help='Show the state of the background push')
+    subparsers.add_parser('push', help='Push the commits now (e.g. to retry a failed background push)')
+
+    search_parser = subparsers.add_parser('search', help='Search the content of all the drafts and posts')
+    search_parser.add_argument('query', nargs='+', help='Words to search')
+    search_parser.add_argument('--limit', type=int, default=20, help='Max number of results')
+    search_parser.add_argument('--rebuild', action='store_true', help='Rebuild the full-text index before searching')
+    search_parser.add_argument('--all-projects', action='store_true', help='Search all the projects')
+
+    preview_parser = subparsers.add_parser('preview', help='Preview the rendered draft in the browser')
+    preview_parser.add_argument('--filter', action='append', help=FILTER_HELP)
+    preview_parser.add_argument('--search', action='append', help=SEARCH_HELP)
+    preview_parser.add_argument('--port', type=int, default=4000, help='Port of the local preview server')
+    preview_parser.add_argument('draft_file', help='File name of the draft').completer = FileCompleterWithFilter(
+        SETTINGS.DRAFTS_FOLDER)
+
+    related_parser = subparsers.add_parser('related', help='Show the posts related to a post (by tags, category '
+                                                           'and title)')
+    related_parser.add_argument('--draft', action='store_true', help='The file is a draft')
+    related_parser.add_argument('--limit', type=int, default=10, help='Max number of posts')
+    related_parser.add_argument('post_file', help='File name of the post').completer = RelatedCompleter
+
+    links_parser = subparsers.add_parser('check-links', help='Find the broken links and images in the posts')
+    links_parser.add_argument('--drafts', action='store_true', help='Check the drafts too')
+    links_parser.add_argument('--no-external', action='store_true', help='Only check the links inside the blog')
+    links_parser.add_argument('--refresh', action='store_true',
+                              help='Check again the external links which worked recently')
+    links_parser.add_argument('--per-host', type=int, default=4, help='Max concurrent requests to the same host')
+    links_parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for each server')
+
+    trace_parser = subparsers.add_parser('trace', help='Summarize the timings recorded with --profile/BLOGGING_TRACE')
+    trace_subparsers = trace_parser.add_subparsers(dest='trace_command')
+    trace_subparsers.required = True
+    summary_parser = trace_subparsers.add_parser('summary', help='Show the percentiles of the time of each phase')
+    summary_parser.add_argument('--command', dest='command_prefix',
+                                help='Only the runs of this command (e.g. complete, publish)')
+    summary_parser.add_argument('--file', default=trace.DEFAULT_TRACE_FILE, help='Trace file')
+    clear_parser = trace_subparsers.add_parser('clear', help='Delete the recorded traces')
+    clear_parser.add_argument('--file', default=trace.DEFAULT_TRACE_FILE, help='Trace file')
+
+    feed_parser = subparsers.add_parser('feed', help='Write the Atom/RSS feed of the latest posts')
+    feed_parser.add_argument('--format', dest='feed_format', choices=['atom', 'rss'],
+                             help='Format of the feed (atom by default)')
+    feed_parser.add_argument('--limit', type=int, default=10, help='Number of posts in the feed')
+    feed_parser.add_argument('--output', help='Path of the feed in the project (feed.xml by default)')
+    feed_parser.add_argument('--rebuild', action='store_true', help='Render all the entries again')
+
+    sitemap_parser = subparsers.add_parser('sitemap', help='Write the sitemap of the posts')
+    sitemap_parser.add_argument('--output', help='Path of the sitemap in the project (sitemap.xml by default)')
+    sitemap_parser.add_argument('--rebuild', action='store_true', help='Write all the sitemap files again')
+
+    retag_parser = subparsers.add_parser('retag', help='Rename a tag (or merge it into another one) in all the '
+                                                       'drafts and posts, in one commit')
+    retag_parser.add_argument('old_tag', help='Tag to rename').completer = TagCompleter
+    retag_parser.add_argument('new_tag', nargs='?', help='New name of the tag (the tag is removed if omitted)'
+                              ).completer = TagCompleter
+    retag_parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+
+    recategorize_parser = subparsers.add_parser('recategorize', help='Move the drafts and posts of a category to '
+                                                                     'another one, in one commit')
+    recategorize_parser.add_argument('old_category', help='Category to rename').completer = CategoryCompleter
+    recategorize_parser.add_argument('new_category', help='New category').completer = CategoryCompleter
+    recategorize_parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+
+    meta_parser = subparsers.add_parser('meta', help='Change the meta info of many blogs at once')
+    meta_subparsers = meta_parser.add_subparsers(dest='meta_command')
+    meta_subparsers.required = True
+    set_parser = meta_subparsers.add_parser('set', help='Set the category/tags of the named or matched posts, in one '
+                                                        'commit')
+    set_parser.add_argument('--filter', action='append', help=FILTER_HELP)
+    set_parser.add_argument('--drafts', action='store_true', help='Match the drafts too')
+    set_parser.add_argument('--category', help='New category').completer = CategoryCompleter
+    set_parser.add_argument('--tags', nargs='*', help='New tags (replacing all the tags)').completer = TagCompleter
+    set_parser.add_argument('--add-tag', action='append', default=[], help='Tag to add').completer = TagCompleter
+    set_parser.add_argument('--remove-tag', action='append', default=[], help='Tag to remove'
+                            ).completer = TagCompleter
+    set_parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+    set_parser.add_argument('file_names', nargs='*', help='File names of the posts (or drafts)').completer = \
+        FileCompleterWithFilter(SETTINGS.POSTS_FOLDER)
+
+    daemon_parser = subparsers.add_parser('daemon', help='Run a resident server to answer the tab completions')
+    daemon_parser.add_argument('--stop', action='store_true', help='Stop the running daemon')
+
+    return parser
+
+
+def parse_arguments():
+    with trace.phase('build_parser'):
+        parser = build_parser()
+    with trace.phase('autocomplete'):
+        argcomplete.autocomplete(parser, always_complete_options=False, exit_method=trace.exit_completion,
+                                 validator=completion.validator)
     args = parser.parse_args()
+    with trace.phase('command.{0}'.format(args.command)):
+        run_command(args)
+
 
+def run_command(args):
     if args.command == 'new':
         post_name = args.post_title
         post_tags = '[' + ', '.join(args.tags) + ']'
@@ -333,68 +1194,93 @@ date: {date}
         with open(draft_path, 'w') as f:
             f.write(content)
         print("\"{0}\" has been created under _drafts folder.".format(file_name))
+        if args.related:
+            show_related_to_new(args.post_title, args.category, args.tags)
         call(['open', draft_path])
     elif args.command == 'ls':
-        if args.list_content == 'categories':
+        if args.list_content in ('categories', 'tags') and args.all_projects:
+            stats_across_projects('category' if args.list_content == 'categories' else 'tag')
+        elif args.list_content == 'categories':
             stats_categories()
         elif args.list_content == 'tags':
             stats_tags()
+        elif args.list_content == 'posts':
+            list_posts('POSTS_FOLDER', args.filter, args.all_projects)
+        elif args.list_content == 'drafts':
+            list_posts('DRAFTS_FOLDER', args.filter, args.all_projects)
     elif args.command == 'publish':
-        os.chdir(SETTINGS.PROJECT_PATH)
-        # Rename the file name and the date in meta header then commit to Github
-        draft_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.DRAFTS_FOLDER, args.draft_file)
-        new_name = str(datetime.date.today()) + args.draft_file[10:]
-        post_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, new_name)
-        changed_date = False
-        with open(post_path, 'w') as in_file:
-            with open(draft_path, 'r') as out_file:
-                for line in out_file:
-                    if not changed_date and line.startswith('date:'):
-                        changed_date = True
-                        line = 'date: {0}\n'.format(str(datetime.date.today()))
-                    in_file.write(line)
-        call(['git', 'add', post_path])
-        call(['git', 'rm', '-f', draft_path])
-        # If the draft has not been saved to github, the above cmd will do nothing
-        # So here we check if the draft is still exist and remove if exist
-        if os.path.isfile(draft_path):
-            os.remove(draft_path)
-        call(['git', 'commit', '-m', 'Publish post: {0}'.format(args.draft_file)])
-        call(['git', 'push'])
+        draft_files = _select_drafts(args.draft_files, args.filter)
+        if not draft_files:
+            print(colored('No draft to publish.', 'red'))
+            exit(1)
+        # `publish_feeds=true` in the settings file to always update them
+        feeds = args.feeds or getattr(SETTINGS, 'PUBLISH_FEEDS', '').lower() in ('1', 'true', 'yes')
+        publish_drafts(draft_files, feeds)
     elif args.command == 'save':
-        os.chdir(SETTINGS.PROJECT_PATH)
-        all_drafts = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.DRAFTS_FOLDER, '*')
-        all_posts = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, '*')
-        call(['git', 'add', all_drafts])
-        call(['git', 'add', all_posts])
-        call(['git', 'commit', '-m', 'Save drafts and edited posts'])
-        call(['git', 'push'])
+        save_changes()
+    elif args.command == 'watch':
+        watch_changes(args.quiet, args.interval, args.push_interval)
     elif args.command == 'continue':
         draft_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.DRAFTS_FOLDER, args.draft_file)
         call(['open', draft_path])
     elif args.command == 'image':
-        image_extension = args.image_path.split('.')[-1]
-        image_name = args.draft_file.replace('.md', '') + '.' + image_extension
-        image_width, image_height = get_image_size(args.image_path)
-        index = 1
-        while os.path.isfile(os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER, image_name)):
-            image_name = args.draft_file.replace('.md', '') + '-{0}'.format(index) + '.' + image_extension
-            index += 1
-        image_url = SETTINGS.IMAGES_FOLDER.replace(SETTINGS.PROJECT_PATH, '') + '/' + image_name
-        image_url = image_url if image_url.startswith('/') else '/' + image_url
-        call(['cp', args.image_path, os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER, image_name)])
-        os.chdir(SETTINGS.PROJECT_PATH)
-        call(['git', 'add', os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.IMAGES_FOLDER, image_name)])
-        image_tag = '''<img title="{0}" src="{1}" width="{2}" />
-<span class="caption">REPLACEME</span>'''.format(
-            image_name, image_url, image_width)
-        print(image_tag)
-        print('Above image tags has been copied to clipboard.')
-        # Add to clipboard
-        copy2clip(image_tag)
+        add_images(args.image_paths, args.draft_file, args.optimize)
+    elif args.command == 'images':
+        if args.images_command == 'optimize':
+            optimize_images(args.image_names, args.widths)
+        elif args.images_command == 'audit':
+            audit_images(args.prune)
     elif args.command == 'edit':
         post_path = os.path.join(SETTINGS.PROJECT_PATH, SETTINGS.POSTS_FOLDER, args.post_file)
         call(['open', post_path])
+    elif args.command == 'index':
+        rebuild_meta_index(rebuild=args.rebuild)
+    elif args.command == 'status':
+        show_status()
+    elif args.command == 'push':
+        push_changes()
+    elif args.command == 'search':
+        search_blogs(' '.join(args.query), limit=args.limit, rebuild=args.rebuild, all_projects=args.all_projects)
+    elif args.command == 'trace':
+        if args.trace_command == 'summary':
+            show_trace_summary(args.file, args.command_prefix)
+        elif args.trace_command == 'clear':
+            if os.path.exists(args.file):
+                os.remove(args.file)
+            print('The traces have been deleted.')
+    elif args.command == 'daemon':
+        from blogging import daemon
+        # One daemon per project
+        socket_path = daemon.socket_path(SETTINGS.PROJECT)
+        if args.stop:
+            daemon.stop(socket_path)
+        else:
+            daemon.serve(socket_path)
+    elif args.command == 'preview':
+        preview_draft(args.draft_file, args.port)
+    elif args.command == 'related':
+        show_related(args.post_file, args.draft, args.limit)
+    elif args.command == 'feed':
+        write_feed(args.output, args.feed_format, args.limit, args.rebuild)
+    elif args.command == 'sitemap':
+        write_sitemap(args.output, args.rebuild)
+    elif args.command == 'retag':
+        retag(args.old_tag, args.new_tag, args.dry_run)
+    elif args.command == 'recategorize':
+        recategorize(args.old_category, args.new_category, args.dry_run)
+    elif args.command == 'meta':
+        if args.meta_command == 'set':
+            if not args.file_names and not args.filter:
+                print(colored('Give the file names or a --filter of the blogs to change.', 'red'))
+                exit(1)
+            if not args.category and args.tags is None and not args.add_tag and not args.remove_tag:
+                print(colored('Nothing to set: give --category, --tags, --add-tag or --remove-tag.', 'red'))
+                exit(1)
+            set_meta(args.file_names, args.filter, args.drafts, args.category, args.tags, args.add_tag,
+                     args.remove_tag, args.dry_run)
+    elif args.command == 'check-links':
+        if not check_links(args.drafts, not args.no_external, args.refresh, args.per_host, args.timeout):
+            exit(1)
 
 
 def input_until_valid_path(validate_func, retry=3):
@@ -412,6 +1298,17 @@ def input_until_valid_path(validate_func, retry=3):
 
 
 def main():
+    if SETTINGS.error:
+        # Nothing to complete either
+        if '_ARGCOMPLETE' not in os.environ:
+            print(colored('Invalid {0}: {1}. Each project needs its own project_path.'.format(
+                BLOGGING_SETTINGS_FILE, SETTINGS.error), 'red'))
+        exit(1)
+    # While completing, the project name may still be being typed
+    if SETTINGS.unknown_project and '_ARGCOMPLETE' not in os.environ:
+        print(colored('No project named "{0}" in {1} (projects: {2}).'.format(
+            SETTINGS.PROJECT, BLOGGING_SETTINGS_FILE, ', '.join(SETTINGS.PROJECTS) or 'none'), 'red'))
+        exit(1)
     if validate_settings():
         parse_arguments()
     else:
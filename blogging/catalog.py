@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory model of the blogs' meta info.
+
+Posts are stored in append-only columns (lists for the strings, typed arrays for the numbers); categories and tags are
+interned into per-catalog tables and referred to by their integer ids, so a name shared by thousands of posts is stored
+once. Replacing or removing a post leaves a dead row behind; the dead rows are dropped when the catalog is serialized,
+or once they outnumber a fraction of the live ones. The per-facet counts and the title -> file name map are kept up to
+date as posts change.
+
+`Post` records are built on demand when iterating or looking up the catalog.
+"""
+from array import array
+
+NO_CATEGORY = -1
+# The dead rows are dropped once they outnumber this fraction of the live ones (and COMPACT_MIN)
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 64
+
+
+class Post(object):
+    __slots__ = ('file_name', 'title', 'category', 'tags', 'mtime', 'size', 'error')
+
+    def __init__(self, file_name, title, category, tags, mtime=0, size=0, error=None):
+        self.file_name = file_name
+        self.title = title
+        # Id in PostCatalog.category_names, or NO_CATEGORY
+        self.category = category
+        # Tuple of ids in PostCatalog.tag_names
+        self.tags = tags
+        self.mtime = mtime
+        self.size = size
+        self.error = error
+
+
+class PostCatalog(object):
+    def __init__(self):
+        self.category_names = []
+        self.tag_names = []
+        self.category_counts = []
+        self.tag_counts = []
+        self.titles = dict()
+        # title -> file names with that title: `titles` keeps pointing to one of them while any is left
+        self._title_files = dict()
+        self._category_ids = dict()
+        self._tag_ids = dict()
+        # file name -> row of the columns below
+        self._rows = dict()
+        self._file_names = []
+        self._titles = []
+        self._categories = array('i')
+        self._tag_starts = array('i')
+        self._tag_data = array('i')
+        self._mtimes = array('q')
+        self._sizes = array('q')
+        self._errors = dict()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for row in self._rows.values():
+            yield self._post(row)
+
+    def __contains__(self, file_name):
+        return file_name in self._rows
+
+    @property
+    def file_names(self):
+        return self._rows.keys()
+
+    def stamps(self):
+        """
+        Yield the (file_name, mtime, size) of each post, without building its record.
+        """
+        for file_name, row in self._rows.items():
+            yield file_name, self._mtimes[row], self._sizes[row]
+
+    def get(self, file_name):
+        row = self._rows.get(file_name)
+        return None if row is None else self._post(row)
+
+    def _tags(self, row):
+        end = self._tag_starts[row + 1] if row + 1 < len(self._tag_starts) else len(self._tag_data)
+        return tuple(self._tag_data[self._tag_starts[row]:end])
+
+    def _post(self, row):
+        return Post(self._file_names[row], self._titles[row], self._categories[row], self._tags(row),
+                    self._mtimes[row], self._sizes[row], self._errors.get(row))
+
+    def _intern(self, name, ids, names, counts):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+            counts.append(0)
+        return ids[name]
+
+    def category_id(self, name):
+        return self._category_ids.get(name, NO_CATEGORY)
+
+    def tag_id(self, name):
+        return self._tag_ids.get(name)
+
+    def add(self, file_name, meta, mtime=0, size=0, error=None):
+        """
+        Add (or replace) the post of `file_name` from its parsed meta info.
+        """
+        category = meta.get('category')
+        category = self._intern(category, self._category_ids, self.category_names, self.category_counts) \
+            if category else NO_CATEGORY
+        tags = [self._intern(tag, self._tag_ids, self.tag_names, self.tag_counts)
+                for tag in meta.get('tag') or () if tag]
+        self._append(file_name, meta.get('title'), category, tags, mtime, size, error)
+
+    def _append(self, file_name, title, category, tags, mtime, size, error):
+        self.remove(file_name)
+        row = len(self._file_names)
+        self._rows[file_name] = row
+        self._file_names.append(file_name)
+        self._titles.append(title)
+        self._categories.append(category)
+        self._tag_starts.append(len(self._tag_data))
+        self._tag_data.extend(tags)
+        self._mtimes.append(mtime)
+        self._sizes.append(size)
+        if error:
+            self._errors[row] = error
+        if category != NO_CATEGORY:
+            self.category_counts[category] += 1
+        for tag in tags:
+            self.tag_counts[tag] += 1
+        if title:
+            self._title_files.setdefault(title, []).append(file_name)
+            self.titles[title] = file_name
+
+    def remove(self, file_name):
+        row = self._rows.pop(file_name, None)
+        if row is None:
+            return
+        category = self._categories[row]
+        if category != NO_CATEGORY:
+            self.category_counts[category] -= 1
+        for tag in self._tags(row):
+            self.tag_counts[tag] -= 1
+        title = self._titles[row]
+        if title:
+            file_names = self._title_files.get(title, [])
+            if file_name in file_names:
+                file_names.remove(file_name)
+            if file_names:
+                self.titles[title] = file_names[-1]
+            else:
+                self._title_files.pop(title, None)
+                self.titles.pop(title, None)
+        # Leave a dead row: drop what it references
+        self._file_names[row] = None
+        self._titles[row] = None
+        self._errors.pop(row, None)
+        dead = len(self._file_names) - len(self._rows)
+        if dead > COMPACT_MIN and dead > len(self._rows) * COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """
+        Drop the dead rows, so that long running processes (`daemon`, `watch`) do not grow with every edit.
+        """
+        file_names = []
+        titles = []
+        categories = array('i')
+        tag_starts = array('i')
+        tag_data = array('i')
+        mtimes = array('q')
+        sizes = array('q')
+        errors = dict()
+        # In the order of `_rows`, which is the order of iteration
+        for file_name, row in self._rows.items():
+            if row in self._errors:
+                errors[len(file_names)] = self._errors[row]
+            file_names.append(file_name)
+            titles.append(self._titles[row])
+            categories.append(self._categories[row])
+            tag_starts.append(len(tag_data))
+            tag_data.extend(self._tags(row))
+            mtimes.append(self._mtimes[row])
+            sizes.append(self._sizes[row])
+        self._rows = {file_name: row for row, file_name in enumerate(file_names)}
+        self._file_names = file_names
+        self._titles = titles
+        self._categories = categories
+        self._tag_starts = tag_starts
+        self._tag_data = tag_data
+        self._mtimes = mtimes
+        self._sizes = sizes
+        self._errors = errors
+
+    def category_of(self, post):
+        return self.category_names[post.category] if post.category != NO_CATEGORY else None
+
+    def tags_of(self, post):
+        return [self.tag_names[tag] for tag in post.tags]
+
+    def meta_of(self, post):
+        """
+        Return the meta info of a post in the dict form returned by the parser.
+        """
+        meta = dict()
+        if post.title is not None:
+            meta['title'] = post.title
+        if post.category != NO_CATEGORY:
+            meta['category'] = self.category_names[post.category]
+        if post.tags:
+            meta['tag'] = self.tags_of(post)
+        return meta
+
+    def file_names_with(self, category=None, tag=None):
+        """
+        Return the file names of the posts with the (exact) category and/or tag, without building their records.
+        """
+        category_id = self._category_ids.get(category)
+        tag_id = self._tag_ids.get(tag)
+        if (category is not None and category_id is None) or (tag is not None and tag_id is None):
+            return []
+        file_names = []
+        for file_name, row in self._rows.items():
+            if category is not None and self._categories[row] != category_id:
+                continue
+            if tag is not None and tag_id not in self._tags(row):
+                continue
+            file_names.append(file_name)
+        return file_names
+
+    def category_stats(self):
+        return {name: count for name, count in zip(self.category_names, self.category_counts) if count}
+
+    def tag_stats(self):
+        return {name: count for name, count in zip(self.tag_names, self.tag_counts) if count}
+
+    def to_json(self):
+        """
+        Columnar form for the on-disk index. Dead rows and unused facet names are dropped (and the ids renumbered).
+        """
+        categories = [name for name, count in zip(self.category_names, self.category_counts) if count]
+        tags = [name for name, count in zip(self.tag_names, self.tag_counts) if count]
+        category_ids = {name: i for i, name in enumerate(categories)}
+        tag_ids = {name: i for i, name in enumerate(tags)}
+        posts = []
+        for post in self:
+            category = category_ids[self.category_names[post.category]] if post.category != NO_CATEGORY \
+                else NO_CATEGORY
+            posts.append([post.file_name, post.mtime, post.size, post.title, category,
+                          [tag_ids[self.tag_names[tag]] for tag in post.tags], post.error])
+        return {'categories': categories, 'tags': tags, 'posts': posts}
+
+    @classmethod
+    def from_json(cls, data):
+        catalog = cls()
+        for name in data['categories']:
+            catalog._intern(name, catalog._category_ids, catalog.category_names, catalog.category_counts)
+        for name in data['tags']:
+            catalog._intern(name, catalog._tag_ids, catalog.tag_names, catalog.tag_counts)
+        for file_name, mtime, size, title, category, tags, error in data['posts']:
+            catalog._append(file_name, title, category, tags, mtime, size, error)
+        return catalog
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+"""
+Entry point of the `blogging` command.
+
+Kept free of heavy imports so that a tab completion can be answered by `blogging daemon` (if running) without
+loading the whole tool.
+"""
+import os
+import sys
+
+from blogging import trace
+
+
+def main():
+    trace.enable_from_environment(sys.argv)
+    if '_ARGCOMPLETE' in os.environ:
+        from blogging.daemon import complete_via_daemon, socket_path
+        from blogging.settings import selected_project
+        with trace.phase('daemon'):
+            answered = complete_via_daemon(socket_path(selected_project(sys.argv)))
+        if answered:
+            trace.exit_completion(0)
+    with trace.phase('import'):
+        from blogging.blogging import main as blogging_main
+    blogging_main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ranking of the draft/post file name completions.
+
+With thousands of date-prefixed file names (`2024-05-01-...md`), a typed prefix rarely narrows the list enough and
+the shell would dump hundreds of candidates. The names are kept sorted, so the ones starting with the typed prefix
+are found by bisection, and only the `limit` most recent of them are returned (by the date prefix of the name, else
+by the mtime of the file).
+
+When no name starts with the typed word, the characters of the word are fuzzy matched (in order, not necessarily
+next to each other) against the file names and titles, e.g. `dockernet` finds `2021-03-04-docker-networking.md`.
+The best matches are returned, the most recent first among equal ones. As they do not start with the typed word,
+they are marked as `FuzzyMatch`, which `validator` lets through argcomplete's prefix check. The typed word is added
+to several fuzzy matches, so that the shell shows them instead of replacing the word by their common prefix.
+"""
+import heapq
+import re
+import time
+from bisect import bisect_left
+
+DEFAULT_LIMIT = 20
+_DATE_PREFIX = re.compile(r'\d{4}-\d{2}-\d{2}')
+_LAST_CHAR = chr(0x10ffff)
+
+
+class FuzzyMatch(str):
+    """
+    A completion which does not start with the typed prefix.
+    """
+
+
+def validator(completion, prefix):
+    return isinstance(completion, FuzzyMatch) or completion.startswith(prefix)
+
+
+def _word_start(text, index):
+    return index == 0 or not text[index - 1].isalnum()
+
+
+def fuzzy_score(query, text):
+    """
+    Return how well the characters of `query` appear in order in `text`, or None if they do not.
+    A substring scores best; otherwise consecutive characters and characters starting a word score more than
+    scattered ones.
+    """
+    position = text.find(query)
+    if position >= 0:
+        return 3.0 * len(query) + (2.0 if _word_start(text, position) else 0.0)
+    score = 0.0
+    last = -1
+    for char in query:
+        index = text.find(char, last + 1)
+        if index < 0:
+            return None
+        if index == last + 1:
+            score += 2.0
+        elif _word_start(text, index):
+            score += 1.5
+        else:
+            score += 1.0
+        last = index
+    return score
+
+
+class RankedNames(object):
+    def __init__(self, names, catalog=None):
+        """
+        `catalog` is a function returning the PostCatalog of the names (for their titles and mtimes), only called
+        when they are needed.
+        """
+        self.names = sorted(names)
+        self._get_catalog = catalog
+        self._catalog = None
+        self._texts = None
+
+    @property
+    def catalog(self):
+        if self._catalog is None and self._get_catalog is not None:
+            self._catalog = self._get_catalog()
+        return self._catalog
+
+    def starting_with(self, prefix):
+        start = bisect_left(self.names, prefix)
+        return self.names[start:bisect_left(self.names, prefix + _LAST_CHAR, start)]
+
+    def recency(self, name):
+        if _DATE_PREFIX.match(name):
+            return name[:10]
+        post = self.catalog.get(name) if self.catalog is not None else None
+        return time.strftime('%Y-%m-%d', time.localtime(post.mtime / 1e9)) if post is not None else ''
+
+    def _most_recent(self, names, limit):
+        def key(name):
+            return self.recency(name), name
+        if limit and len(names) > limit:
+            return heapq.nlargest(limit, names, key=key)
+        return sorted(names, key=key, reverse=True)
+
+    def _fuzzy_texts(self):
+        if self._texts is None:
+            titles = dict()
+            if self.catalog is not None:
+                titles = {file_name: title for title, file_name in self.catalog.titles.items()}
+            self._texts = [(name, name.lower(), (titles.get(name) or '').lower()) for name in self.names]
+        return self._texts
+
+    def fuzzy(self, query, limit=DEFAULT_LIMIT):
+        """
+        Return the names whose name or title fuzzy matches `query`, best first.
+        """
+        query = ''.join(query.lower().split())
+        if not query:
+            return []
+        # The regex drops the names which cannot match at C speed, only the others are scored
+        search = re.compile('.*?'.join(map(re.escape, query))).search
+        scored = []
+        for name, name_text, title_text in self._fuzzy_texts():
+            if search(name_text) or search(title_text):
+                score = max(fuzzy_score(query, name_text) or 0.0, fuzzy_score(query, title_text) or 0.0)
+                scored.append((score, self.recency(name), name))
+        best = heapq.nlargest(limit, scored) if limit else sorted(scored, reverse=True)
+        return [name for score, recency, name in best]
+
+    def complete(self, prefix, limit=DEFAULT_LIMIT):
+        matches = self.starting_with(prefix)
+        if matches:
+            return self._most_recent(matches, limit)
+        matches = [FuzzyMatch(name) for name in self.fuzzy(prefix, limit)]
+        if len(matches) > 1:
+            matches.append(FuzzyMatch(prefix))
+        return matches
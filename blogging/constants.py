@@ -5,3 +5,5 @@ import os
 
 __VERSION__ = '2.0.4'
 BLOGGING_SETTINGS_FILE = os.path.join(os.path.expanduser("~"), '.blogging')
+BLOGGING_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), '.cache'),
+                                  'blogging')
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A resident server answering the tab completions over a unix domain socket.
+
+Each tab press normally starts a new interpreter which imports all the dependencies, loads the settings and scans
+the blog. `blogging daemon` keeps the parser, the meta info and the file lists in memory, and refreshes them only
+when the watched drafts/posts folders change. The client side (`complete_via_daemon`) only uses the standard
+library, so the completion hook stays cheap; if no daemon is running it returns False and the caller falls back to
+the normal in-process completion.
+"""
+import io
+import json
+import os
+import select
+import signal
+import socket
+
+from blogging import completion
+from blogging.constants import BLOGGING_CACHE_DIR
+
+SOCKET_PATH = os.path.join(BLOGGING_CACHE_DIR, 'daemon.sock')
+ENV_PREFIXES = ('COMP_', '_ARGCOMPLETE')
+CLIENT_TIMEOUT = 0.5
+
+
+def socket_path(project=None):
+    """
+    Each project of the settings file has its own daemon; the default one keeps `SOCKET_PATH`.
+    """
+    from blogging.settings import DEFAULT_PROJECT
+    if project in (None, DEFAULT_PROJECT):
+        return SOCKET_PATH
+    return os.path.join(BLOGGING_CACHE_DIR, 'daemon-{0}.sock'.format(project))
+
+
+def _request(message, socket_path=SOCKET_PATH, timeout=CLIENT_TIMEOUT):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def complete_via_daemon(socket_path=SOCKET_PATH):
+    """
+    Ask the daemon for the completions of the current argcomplete invocation and write them out the same way
+    argcomplete does. Return False if there is no daemon to answer.
+    """
+    if not os.path.exists(socket_path):
+        return False
+    env = {k: v for k, v in os.environ.items() if k.startswith(ENV_PREFIXES)}
+    try:
+        response = _request({'command': 'complete', 'env': env, 'cwd': os.getcwd()}, socket_path=socket_path)
+    except (OSError, ValueError):
+        return False
+    if not response.get('ok'):
+        return False
+    filename = env.get('_ARGCOMPLETE_STDOUT_FILENAME')
+    try:
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(response['output'])
+        else:
+            with os.fdopen(8, 'w') as f:
+                f.write(response['output'])
+    except OSError:
+        return False
+    return True
+
+
+class _Exit(Exception):
+    def __init__(self, code=0):
+        super(_Exit, self).__init__(code)
+        self.code = code
+
+
+def _exit(code=0):
+    raise _Exit(code)
+
+
+class CompletionServer(object):
+    def __init__(self, socket_path=SOCKET_PATH):
+        from blogging import blogging
+        from blogging.watcher import FolderWatcher
+        self.blogging = blogging
+        self.socket_path = socket_path
+        self.folders = {os.path.abspath(os.path.join(blogging.SETTINGS.PROJECT_PATH, path)): path
+                        for path in (blogging.SETTINGS.DRAFTS_FOLDER, blogging.SETTINGS.POSTS_FOLDER)}
+        self.watcher = FolderWatcher(self.folders)
+        self.running = False
+        self.reload()
+
+    def reload(self):
+        import argcomplete
+
+        class CompletionFinder(argcomplete.CompletionFinder):
+            def _init_debug_stream(self):
+                # The daemon has no fd 9 of the shell to write debug output to
+                pass
+
+        self.parser = self.blogging.build_parser()
+        # argcomplete patches the parser bound to the finder at first use, so they must be kept in pairs
+        self.finder = CompletionFinder(validator=completion.validator)
+        self._warm(self.parser)
+
+    def _warm(self, parser):
+        for action in parser._actions:
+            warm = getattr(getattr(action, 'completer', None), 'warm', None)
+            if warm is not None:
+                warm()
+            for subparser in getattr(action, '_name_parser_map', dict()).values():
+                self._warm(subparser)
+        if parser is self.parser:
+            self.blogging._get_catalog()
+
+    def apply_changes(self, changes):
+        changed = dict()
+        for folder, file_name in changes:
+            if folder in self.folders:
+                changed.setdefault(self.folders[folder], []).append(file_name)
+        for path, file_names in changed.items():
+            self.blogging.invalidate_meta_info(path, file_names)
+        if changed:
+            self.reload()
+
+    def complete(self, env, cwd):
+        saved_env = {k: v for k, v in os.environ.items() if k.startswith(ENV_PREFIXES)}
+        saved_cwd = os.getcwd()
+        for k in saved_env:
+            del os.environ[k]
+        os.environ.update(env)
+        output = io.StringIO()
+        try:
+            os.chdir(cwd)
+            self.finder(self.parser, always_complete_options=False, output_stream=output, exit_method=_exit,
+                        validator=completion.validator)
+        except _Exit as e:
+            if e.code:
+                return {'ok': False}
+        except OSError:
+            return {'ok': False}
+        finally:
+            for k in env:
+                os.environ.pop(k, None)
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
+        return {'ok': True, 'output': output.getvalue()}
+
+    def handle(self, conn):
+        conn.settimeout(CLIENT_TIMEOUT)
+        chunks = []
+        while True:
+            chunk = conn.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        message = json.loads(b''.join(chunks).decode('utf-8'))
+        if message.get('command') == 'stop':
+            self.running = False
+            response = {'ok': True}
+        elif message.get('command') == 'complete':
+            # Catch up with the changes not picked by the loop yet (e.g. made right before the tab press)
+            self.apply_changes(self.watcher.read_events())
+            response = self.complete(message.get('env', dict()), message.get('cwd', '/'))
+        else:
+            response = {'ok': False}
+        conn.sendall(json.dumps(response).encode('utf-8'))
+
+    def serve_forever(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(16)
+        self.running = True
+        try:
+            while self.running:
+                watched = [server]
+                if not self.watcher.polling:
+                    watched.append(self.watcher)
+                readable, _, _ = select.select(watched, [], [], self.watcher.next_timeout())
+                self.apply_changes(self.watcher.read_events())
+                if server in readable:
+                    conn, _ = server.accept()
+                    try:
+                        self.handle(conn)
+                    except (OSError, ValueError):
+                        pass
+                    finally:
+                        conn.close()
+        finally:
+            server.close()
+            self.watcher.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def is_running(socket_path=SOCKET_PATH):
+    try:
+        _request({'command': 'ping'}, socket_path=socket_path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def serve(socket_path=SOCKET_PATH):
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            print('The daemon is already running ({0}).'.format(socket_path))
+            return
+        # Left over by a daemon which was killed
+        os.remove(socket_path)
+
+    def on_signal(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    server = CompletionServer(socket_path)
+    print('Serving completions on {0}'.format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def stop(socket_path=SOCKET_PATH):
+    try:
+        _request({'command': 'stop'}, socket_path=socket_path)
+    except (OSError, ValueError):
+        print('The daemon is not running.')
+        return
+    print('The daemon has been stopped.')
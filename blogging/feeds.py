@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Atom/RSS feed and sitemap of the posts, for `blogging feed` and `blogging sitemap`.
+
+The entries are made from the meta index (title/category/tags), the dates in the file names and the mtimes, so the
+sitemap never reads the posts, and the feed only reads the few posts it lists (for their excerpt). The files are written
+by a small streaming XML writer straight to a temp file, which then replaces the output; the sitemap urls are made from
+the catalog as they are written, so memory stays flat whatever the size of the archive. What was written is remembered
+under the cache dir: a feed entry is only rendered again when its post changed, and an output whose entries did not
+change is not rewritten at all. Past 50000 posts (the limit of a sitemap file) the sitemap is split into parts listed by
+a sitemap index, and only the parts which changed are rewritten: new posts only touch the last one.
+
+The url, base url, title, description and permalink style of the site are read from the top-level keys of its
+`_config.yml`, as Jekyll does.
+"""
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+from email.utils import format_datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape, quoteattr
+
+from blogging.metadata import atomic_write_json, file_lock, project_cache_dir, split_front_matter, unquote
+
+# Part of the cache key: bump when the entries change
+STATE_VERSION = 1
+FEED_LIMIT = 10
+# Max number of urls in a sitemap file
+SITEMAP_LIMIT = 50000
+PERMALINK_STYLES = {
+    'date': '/:categories/:year/:month/:day/:title:output_ext',
+    'pretty': '/:categories/:year/:month/:day/:title/',
+    'ordinal': '/:categories/:year/:y_day/:title:output_ext',
+    'none': '/:categories/:title:output_ext',
+}
+_DATED_NAME = re.compile(r'(\d{4})-(\d{2})-(\d{2})-(.+)\.[^.]+$')
+_PLACEHOLDER = re.compile(r':(\w+)')
+_URL_FIELDS = ('year', 'month', 'day', 'i_month', 'i_day', 'short_year', 'y_day', 'title', 'slug', 'output_ext',
+               'categories')
+_SAFE = re.compile(r'[\w.~-]*$', re.ASCII)
+
+
+class SiteError(Exception):
+    pass
+
+
+def read_site_config(project_path):
+    """
+    Return the top-level scalar keys of the `_config.yml` of the site (without a yaml parser).
+    """
+    config = dict()
+    try:
+        f = open(os.path.join(project_path, '_config.yml'), 'r', encoding='utf-8')
+    except OSError:
+        return config
+    with f:
+        for line in f:
+            if line[:1] in (' ', '\t', '#', '-') or ':' not in line:
+                continue
+            key, _, value = line.partition(':')
+            config[key.strip()] = unquote(value.split(' #')[0])
+    return config
+
+
+class Site(object):
+    def __init__(self, url, baseurl='', title='', description='', author='', permalink='date'):
+        if not url:
+            raise SiteError('the url of the site is unknown')
+        self.url = url.rstrip('/')
+        self.baseurl = '/' + baseurl.strip('/') if baseurl.strip('/') else ''
+        self.title = title
+        self.description = description
+        self.author = author
+        self.permalink = PERMALINK_STYLES.get(permalink or 'date', permalink)
+        # As a format string (e.g. `/{categories}/{year}/{month}/{day}/{title}/`), filled once per post
+        self._template = _PLACEHOLDER.sub(lambda m: '{' + m.group(1) + '}' if m.group(1) in _URL_FIELDS else m.group(0),
+                                          self.permalink.replace('{', '{{').replace('}', '}}'))
+
+    @classmethod
+    def from_config(cls, project_path, url=None):
+        """
+        The site described by `_config.yml`, with `url` (e.g. from the settings file) taking precedence.
+        """
+        config = read_site_config(project_path)
+        return cls(url or config.get('url', ''), config.get('baseurl', ''), config.get('title', ''),
+                   config.get('description', ''), config.get('author', ''), config.get('permalink', 'date'))
+
+    def signature(self):
+        return [self.url, self.baseurl, self.title, self.description, self.author, self.permalink]
+
+    def absolute(self, path):
+        return self.url + self.baseurl + path
+
+    def post_url(self, date, slug, category):
+        """
+        The url of a post, as Jekyll makes it from the permalink pattern.
+        """
+        slug = slug if _SAFE.match(slug) else quote(slug)
+        category = category.lower() if category else ''
+        category = category if _SAFE.match(category) else quote(category)
+        path = '/' + self._template.format(
+            year='%04d' % date.year, month='%02d' % date.month, day='%02d' % date.day, i_month=date.month,
+            i_day=date.day, short_year='%02d' % (date.year % 100), y_day='%03d' % date.timetuple().tm_yday,
+            title=slug, slug=slug, output_ext='.html', categories=category)
+        if '//' in path:
+            # No category
+            path = re.sub('/+', '/', path)
+        return self.absolute(path)
+
+
+def post_date(file_name):
+    """
+    Return the date and the slug of a post from its file name, or (None, None) if it is not dated.
+    """
+    match = _DATED_NAME.match(file_name)
+    if not match:
+        return None, None
+    try:
+        return datetime.date(*map(int, match.groups()[:3])), match.group(4)
+    except ValueError:
+        return None, None
+
+
+def _utc(mtime):
+    return datetime.datetime.fromtimestamp(mtime / 1e9, datetime.timezone.utc).replace(microsecond=0)
+
+
+def _excerpt(file_path):
+    """
+    The first paragraph of the body of a post, as Jekyll takes it.
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        meta, body = split_front_matter(f.read())
+    return body.strip().split('\n\n', 1)[0].strip()
+
+
+class XMLWriter(object):
+    """
+    Writes the elements as they come, indented, to a text file object.
+    """
+    def __init__(self, f, depth=0):
+        self.f = f
+        self.depth = depth
+
+    @staticmethod
+    def _attrs(attrs):
+        return ''.join(' {0}={1}'.format(name, quoteattr(value)) for name, value in (attrs or ()))
+
+    def declaration(self):
+        self.f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+
+    def start(self, tag, attrs=None):
+        self.f.write('{0}<{1}{2}>\n'.format('  ' * self.depth, tag, self._attrs(attrs)))
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+        self.f.write('{0}</{1}>\n'.format('  ' * self.depth, tag))
+
+    def element(self, tag, text=None, attrs=None):
+        if text is None:
+            self.f.write('{0}<{1}{2}/>\n'.format('  ' * self.depth, tag, self._attrs(attrs)))
+        else:
+            self.f.write('{0}<{1}{2}>{3}</{1}>\n'.format('  ' * self.depth, tag, self._attrs(attrs), escape(text)))
+
+    def raw(self, text):
+        self.f.write(text)
+
+
+class _Output(object):
+    """
+    A temp file next to `path`, replacing it when closed without error (unless `keep` was turned off).
+    The digest of what is written is computed on the way.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.keep = True
+        self._hash = hashlib.sha1()
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.feed-')
+        self.f = os.fdopen(fd, 'w', encoding='utf-8')
+        return XMLWriter(self)
+
+    def write(self, text):
+        self._hash.update(text.encode('utf-8'))
+        self.f.write(text)
+
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+        if exc_type is None and self.keep:
+            os.chmod(self.tmp_path, 0o644)
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+class FeedWriter(object):
+    def __init__(self, project_path, folder, site, cache_dir=None):
+        self.project_path = project_path
+        self.folder_path = os.path.join(project_path, folder)
+        self.site = site
+        cache_dir = cache_dir or project_cache_dir(project_path)
+        self.state_path = os.path.join(cache_dir, 'feeds.json')
+        self.lock_path = self.state_path + '.lock'
+        self._state = None
+        try:
+            import markdown
+        except ImportError:
+            self._markdown = None
+        else:
+            self._markdown = markdown
+
+    def _signature(self):
+        return [STATE_VERSION, self.site.signature(), self._markdown is not None]
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = dict()
+        if state.get('signature') != self._signature():
+            state = {'signature': self._signature(), 'entries': dict(), 'outputs': dict()}
+        return state
+
+    def _posts(self, catalog):
+        """
+        The (date, file_name, slug, post) of the dated posts, the oldest first.
+        """
+        posts = []
+        for post in catalog:
+            date, slug = post_date(post.file_name)
+            if date is not None:
+                posts.append((date, post.file_name, slug, post))
+        posts.sort(key=lambda row: row[:2])
+        return posts
+
+    def _unchanged(self, path, digest):
+        return self._state['outputs'].get(os.path.abspath(path)) == digest and os.path.exists(path)
+
+    def _written(self, path, digest):
+        self._state['outputs'][os.path.abspath(path)] = digest
+
+    def _summary(self, file_name):
+        try:
+            excerpt = _excerpt(os.path.join(self.folder_path, file_name))
+        except OSError:
+            return '', 'text'
+        if self._markdown is None:
+            return excerpt, 'text'
+        return self._markdown.markdown(excerpt), 'html'
+
+    def _entry(self, fmt, catalog, date, slug, post):
+        """
+        Return the xml of the feed entry of a post.
+        """
+        url = self.site.post_url(date, slug, catalog.category_of(post))
+        terms = ([catalog.category_of(post)] if catalog.category_of(post) else []) + catalog.tags_of(post)
+        summary, summary_type = self._summary(post.file_name)
+        published = datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc)
+        buffer = io.StringIO()
+        writer = XMLWriter(buffer, depth=1 if fmt == 'atom' else 2)
+        if fmt == 'atom':
+            writer.start('entry')
+            writer.element('title', post.title or slug)
+            writer.element('link', attrs=[('href', url), ('rel', 'alternate'), ('type', 'text/html')])
+            writer.element('published', published.isoformat())
+            writer.element('updated', max(published, _utc(post.mtime)).isoformat())
+            writer.element('id', url)
+            for term in terms:
+                writer.element('category', attrs=[('term', term)])
+            writer.element('summary', summary, attrs=[('type', summary_type)])
+            writer.end('entry')
+        else:
+            writer.start('item')
+            writer.element('title', post.title or slug)
+            writer.element('link', url)
+            writer.element('guid', url, attrs=[('isPermaLink', 'true')])
+            writer.element('pubDate', format_datetime(published))
+            for term in terms:
+                writer.element('category', term)
+            writer.element('description', summary)
+            writer.end('item')
+        return buffer.getvalue()
+
+    def write_feed(self, catalog, path, fmt='atom', limit=FEED_LIMIT, rebuild=False):
+        """
+        Write the feed of the `limit` latest posts to `path`. Return whether it was (re)written.
+        """
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with file_lock(self.lock_path):
+            self._state = self._load_state()
+            if rebuild:
+                self._state['entries'] = dict()
+            latest = self._posts(catalog)[-limit:][::-1]
+            digest = hashlib.sha1(json.dumps([fmt, self.site.url] + [[file_name, post.mtime, post.size]
+                                  for date, file_name, slug, post in latest]).encode('utf-8')).hexdigest()
+            if not rebuild and self._unchanged(path, digest):
+                return False
+            cached = self._state['entries'].get(fmt, dict())
+            entries = dict()
+            for date, file_name, slug, post in latest:
+                entry = cached.get(file_name)
+                if entry is None or entry[:2] != [post.mtime, post.size]:
+                    entry = [post.mtime, post.size, self._entry(fmt, catalog, date, slug, post)]
+                entries[file_name] = entry
+            # Only the entries still listed are kept
+            self._state['entries'][fmt] = entries
+            updated = max([_utc(post.mtime) for date, file_name, slug, post in latest] or [_utc(time.time() * 1e9)])
+            feed_url = self.site.absolute('/' + os.path.relpath(path, self.project_path).replace(os.sep, '/'))
+            with _Output(path) as writer:
+                writer.declaration()
+                if fmt == 'atom':
+                    writer.start('feed', [('xmlns', 'http://www.w3.org/2005/Atom')])
+                    writer.element('title', self.site.title or self.site.url)
+                    if self.site.description:
+                        writer.element('subtitle', self.site.description)
+                    writer.element('link', attrs=[('href', feed_url), ('rel', 'self'),
+                                                  ('type', 'application/atom+xml')])
+                    writer.element('link', attrs=[('href', self.site.absolute('/')), ('rel', 'alternate'),
+                                                  ('type', 'text/html')])
+                    writer.element('updated', updated.isoformat())
+                    writer.element('id', feed_url)
+                    if self.site.author:
+                        writer.start('author')
+                        writer.element('name', self.site.author)
+                        writer.end('author')
+                else:
+                    writer.start('rss', [('version', '2.0')])
+                    writer.start('channel')
+                    writer.element('title', self.site.title or self.site.url)
+                    writer.element('link', self.site.absolute('/'))
+                    writer.element('description', self.site.description or self.site.title or self.site.url)
+                    writer.element('lastBuildDate', format_datetime(updated))
+                for date, file_name, slug, post in latest:
+                    writer.raw(entries[file_name][2])
+                if fmt == 'atom':
+                    writer.end('feed')
+                else:
+                    writer.end('channel')
+                    writer.end('rss')
+            self._written(path, digest)
+            atomic_write_json(self.state_path, self._state)
+        return True
+
+    def _sitemap_urls(self, catalog, file_names):
+        """
+        Yield the (url, lastmod) of the site's home, then of the posts of `file_names`.
+        """
+        yield self.site.absolute('/'), None
+        for file_name in file_names:
+            date, slug = post_date(file_name)
+            post = catalog.get(file_name)
+            yield self.site.post_url(date, slug, catalog.category_of(post)), _utc(post.mtime).isoformat()
+
+    def _write_if_changed(self, path, write, rebuild):
+        """
+        Stream the content made by `write(writer)` to a temp file, which only replaces `path` when its digest differs
+        from the one last written there. Return whether it did, and what `write` returned.
+        """
+        output = _Output(path)
+        with output as writer:
+            writer.declaration()
+            result = write(writer)
+            output.keep = rebuild or not self._unchanged(path, output.digest())
+        if output.keep:
+            self._written(path, output.digest())
+        return output.keep, result
+
+    @staticmethod
+    def _urlset(urls):
+        def write(writer):
+            latest = ''
+            writer.start('urlset', [('xmlns', 'http://www.sitemaps.org/schemas/sitemap/0.9')])
+            for url, lastmod in urls:
+                writer.start('url')
+                writer.element('loc', url)
+                if lastmod:
+                    writer.element('lastmod', lastmod)
+                    latest = max(latest, lastmod)
+                writer.end('url')
+            writer.end('urlset')
+            return latest
+        return write
+
+    @staticmethod
+    def _sitemapindex(index):
+        def write(writer):
+            writer.start('sitemapindex', [('xmlns', 'http://www.sitemaps.org/schemas/sitemap/0.9')])
+            for url, lastmod in index:
+                writer.start('sitemap')
+                writer.element('loc', url)
+                writer.element('lastmod', lastmod)
+                writer.end('sitemap')
+            writer.end('sitemapindex')
+        return write
+
+    def write_sitemap(self, catalog, path, rebuild=False):
+        """
+        Write the sitemap of the site's home and posts to `path` (split into `{name}-{n}.xml` parts listed by `path`
+        past SITEMAP_LIMIT urls). Return the paths (re)written, and the parts removed since there are fewer of them.
+        """
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with file_lock(self.lock_path):
+            self._state = self._load_state()
+            # The dates lead the names: sorting the names sorts the posts by date
+            file_names = sorted(catalog.file_names)
+            # The posts did not change since the last run: no need to make their urls
+            stamps = hashlib.sha1()
+            for file_name in file_names:
+                post = catalog.get(file_name)
+                stamps.update('{0}\0{1}\0{2}\n'.format(file_name, post.mtime, post.size).encode('utf-8'))
+            stamps = stamps.hexdigest()
+            inputs = self._state.setdefault('inputs', dict())
+            if not rebuild and inputs.get(os.path.abspath(path)) == stamps and os.path.exists(path):
+                return []
+            # The urls are only made while they are written
+            file_names = [file_name for file_name in file_names if post_date(file_name)[0]]
+            urls = self._sitemap_urls(catalog, file_names)
+            count = (len(file_names) + SITEMAP_LIMIT) // SITEMAP_LIMIT
+            if count > 1:
+                base, extension = os.path.splitext(path)
+                part_paths = ['{0}-{1}{2}'.format(base, i + 1, extension) for i in range(count)]
+            else:
+                part_paths = [path]
+            written = []
+            index = []
+            for part_path in part_paths:
+                changed, latest = self._write_if_changed(
+                    part_path, self._urlset(itertools.islice(urls, SITEMAP_LIMIT)), rebuild)
+                if changed:
+                    written.append(part_path)
+                index.append((self.site.absolute('/' + os.path.relpath(part_path, self.project_path)
+                                                 .replace(os.sep, '/')), latest))
+            if count > 1 and self._write_if_changed(path, self._sitemapindex(index), rebuild)[0]:
+                written.append(path)
+            # The parts of the previous runs which are not written anymore
+            parts = self._state.setdefault('parts', dict())
+            current = [os.path.abspath(part_path) for part_path in part_paths]
+            for part_path in parts.get(os.path.abspath(path), []):
+                if part_path not in current and part_path != os.path.abspath(path):
+                    self._state['outputs'].pop(part_path, None)
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                        written.append(part_path)
+            parts[os.path.abspath(path)] = current
+            inputs[os.path.abspath(path)] = stamps
+            atomic_write_json(self.state_path, self._state)
+        return written
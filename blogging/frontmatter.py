@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bulk rewrite of the category/tags in the front matter, for `blogging retag`, `recategorize` and `meta set`.
+
+Only the lines of the fields which change are rewritten, in the style they were written in (`[a, b]`, `a, b`, `a b`
+or one `- item` per line), so the parser (blogging.metadata) reads back exactly the new values. The items which are
+kept are written as they were (quotes included), only the new ones are formatted. Each file is streamed: its front matter is read line by line and the body is copied in
+chunks to a temp file next to it. The files are prepared across a thread pool, and the temp files replace them
+(`os.replace`, atomic) only once all of them are ready.
+"""
+import difflib
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from blogging.metadata import META_KEYS, list_items, parse_front_matter, unquote
+
+# Key of a field which is not in the front matter yet
+NEW_KEYS = {'category': 'category', 'tag': 'tags'}
+# Items which can be written without quotes
+_PLAIN_ITEM = re.compile(r'[^\s,\[\]{}#&*!|>\'"%@`:-][^,\[\]{}#:"]*$')
+
+
+class RewriteError(Exception):
+    pass
+
+
+def _is_item(stripped):
+    return stripped.startswith('-') and (len(stripped) == 1 or stripped[1] in ' \t')
+
+
+def _field_spans(lines):
+    """
+    Return {field: (start, end, key, style, values, indent, written)} for the lines of a front matter (without its
+    `---` lines): the field is written on lines[start:end], and `written` maps each value to its text (its whole
+    line in a block list). As in the parser, the last definition of a field wins.
+    """
+    spans = dict()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        start = i
+        i += 1
+        if line[:1] in (' ', '\t') or ':' not in line:
+            continue
+        key, _, value = line.partition(':')
+        field = META_KEYS.get(key.strip())
+        if field is None or field == 'title':
+            continue
+        value = value.strip()
+        indent = ''
+        written = dict()
+        if value:
+            values = []
+            for text in list_items(value):
+                item = unquote(text)
+                if item:
+                    values.append(item)
+                    written.setdefault(item, text)
+            if value.startswith('[') and value.endswith(']'):
+                style = 'flow'
+            else:
+                style = 'comma' if ',' in value else 'space'
+        else:
+            style = 'block'
+            values = []
+            end = i
+            while i < len(lines):
+                stripped = lines[i].strip()
+                if _is_item(stripped):
+                    if not values:
+                        indent = lines[i][:len(lines[i]) - len(lines[i].lstrip())]
+                    item = unquote(stripped[1:])
+                    if item:
+                        values.append(item)
+                        written.setdefault(item, lines[i])
+                    end = i + 1
+                elif stripped and not stripped.startswith('#'):
+                    break
+                i += 1
+            # The blank lines and comments after the last item are left alone
+            i = end
+        spans[field] = (start, i, key, style, values, indent, written)
+    return spans
+
+
+def _format_item(item):
+    if _PLAIN_ITEM.match(item):
+        return item
+    return '"{0}"'.format(item.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _render(key, style, values, indent, line_end, written=None):
+    written = written or dict()
+    if style == 'block' and values:
+        return [key + ':' + line_end] + [written.get(value) or indent + '- ' + _format_item(value) + line_end
+                                         for value in values]
+    items = [written.get(value) or _format_item(value) for value in values]
+    if style == 'comma' and len(items) > 1:
+        text = ', '.join(items)
+    elif style in ('comma', 'space') and items and all(
+            (item == value or item == written.get(value)) and not any(c.isspace() for c in item)
+            for item, value in zip(items, values)):
+        text = ' '.join(items)
+    else:
+        # Quoted items, or items with spaces, only read back as a flow list
+        text = '[' + ', '.join(items) + ']'
+    return ['{0}: {1}{2}'.format(key, text, line_end)]
+
+
+def rewrite_lines(lines, changes):
+    """
+    Return the lines of a front matter (without its `---` lines) with the fields of `changes` ({'category': name,
+    'tag': [names]}) replaced. A field which is not there yet is added at the end.
+    """
+    spans = _field_spans(lines)
+    line_end = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    edits = []
+    for field, value in changes.items():
+        values = [value] if field == 'category' else list(value)
+        if field in spans:
+            start, end, key, style, old_values, indent, written = spans[field]
+            if field == 'category' and key.strip() == 'categories':
+                # Only the first one is the category of the tool, the others are kept
+                values += old_values[1:]
+            edits.append((start, end, _render(key, style, values, indent, line_end, written)))
+        else:
+            edits.append((len(lines), len(lines), _render(NEW_KEYS[field], 'flow', values, '', line_end)))
+    new_lines = list(lines)
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        new_lines[start:end] = replacement
+    return new_lines
+
+
+class Rewrite(object):
+    def __init__(self, path, old_lines, new_lines, tmp_path=None):
+        self.path = path
+        self.old_lines = old_lines
+        self.new_lines = new_lines
+        # The rewritten file, waiting to replace `path` (None for a dry run)
+        self.tmp_path = tmp_path
+
+    def diff(self):
+        """
+        The removed (`-`) and added (`+`) lines of the front matter.
+        """
+        return [line for line in difflib.unified_diff(self.old_lines, self.new_lines, n=0, lineterm='')
+                if line[:1] in '-+' and not line.startswith(('---', '+++'))]
+
+
+def prepare_rewrite(path, edit, dry_run=False):
+    """
+    Apply `edit` (a function taking the meta info dict of the file and returning the new one) to the category/tags
+    of the file. Return None if nothing changes, else a Rewrite (with the rewritten file in a temp file, unless
+    `dry_run`).
+    """
+    with open(path, 'rb') as f:
+        first_line = f.readline()
+        if not first_line.startswith(b'---'):
+            raise RewriteError('no front matter')
+        lines = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise RewriteError('front matter is not closed')
+            if line.startswith(b'---'):
+                closing_line = line
+                break
+            lines.append(line.decode('utf-8'))
+        meta, consumed, closed = parse_front_matter([first_line.decode('utf-8')] + lines + ['---'])
+        new_meta = edit(dict(meta))
+        # No field is removed, and an empty one is the same as a missing one
+        changes = {field: new_meta[field] for field in ('category', 'tag')
+                   if new_meta.get(field) is not None and (new_meta[field] or None) != (meta.get(field) or None)}
+        if not changes:
+            return None
+        new_lines = rewrite_lines(lines, changes)
+        if new_lines == lines:
+            return None
+        if dry_run:
+            return Rewrite(path, lines, new_lines)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.rewrite-')
+        try:
+            with os.fdopen(fd, 'wb') as out_file:
+                out_file.write(first_line)
+                out_file.write(''.join(new_lines).encode('utf-8'))
+                out_file.write(closing_line)
+                # The body is copied as is
+                shutil.copyfileobj(f, out_file)
+            shutil.copymode(path, tmp_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return Rewrite(path, lines, new_lines, tmp_path)
+
+
+def prepare_rewrites(paths, edit, dry_run=False, workers=None):
+    """
+    Prepare the rewrite of the files across threads. Return the Rewrites of the files which change and the
+    (path, error) of the files which could not be read.
+    """
+    def prepare(path):
+        try:
+            return prepare_rewrite(path, edit, dry_run)
+        except (OSError, UnicodeDecodeError, RewriteError) as e:
+            return e
+
+    rewrites = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, result in zip(paths, executor.map(prepare, paths)):
+            if isinstance(result, Exception):
+                errors.append((path, result))
+            elif result is not None:
+                rewrites.append(result)
+    return rewrites, errors
+
+
+def discard_rewrites(rewrites):
+    for rewrite in rewrites:
+        if rewrite.tmp_path is not None and os.path.exists(rewrite.tmp_path):
+            os.remove(rewrite.tmp_path)
+
+
+def apply_rewrites(rewrites):
+    """
+    Replace the files by their rewritten version. Return the paths replaced.
+    """
+    replaced = []
+    try:
+        for rewrite in rewrites:
+            os.replace(rewrite.tmp_path, rewrite.path)
+            replaced.append(rewrite.path)
+    finally:
+        discard_rewrites(rewrites[len(replaced):])
+    return replaced
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Full-text index over the drafts and posts, stored in a sqlite FTS5 table under the cache dir.
+
+The index remembers the mtime/size of each indexed file, so an update only reads the files that changed; a search
+never opens the markdown files. Results are ranked with bm25 (title and tags weigh more than the body).
+"""
+import os
+import sqlite3
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from blogging import trace
+from blogging.metadata import project_cache_dir, split_front_matter
+
+SCHEMA_VERSION = 2
+# bm25 weights of the columns: title, category, tags, body
+COLUMN_WEIGHTS = (8.0, 4.0, 4.0, 1.0)
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+
+def _read_document(file_path):
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        meta, body = split_front_matter(f.read())
+    return meta.get('title', ''), meta.get('category', ''), ' '.join(meta.get('tag') or []), body
+
+
+def to_match_expression(query, prefix=False):
+    """
+    Turn the words typed by the user into a FTS5 query: all the words must match, the last one may be a prefix.
+    """
+    words = [word.replace('"', '""') for word in query.split()]
+    if not words:
+        return None
+    terms = ['"{0}"'.format(word) for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class FullTextIndex(object):
+    def __init__(self, project_path, folders, db_path=None):
+        self.project_path = project_path
+        self.folders = list(folders)
+        cache_dir = project_cache_dir(project_path)
+        self.db_path = db_path or os.path.join(cache_dir, 'fulltext.sqlite')
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+
+    def _create_tables(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS docs;
+                CREATE TABLE files (id INTEGER PRIMARY KEY, folder TEXT, file_name TEXT, mtime INTEGER, size INTEGER,
+                                    UNIQUE (folder, file_name));
+                CREATE VIRTUAL TABLE docs USING fts5(title, category, tags, body, tokenize='unicode61');
+                PRAGMA user_version = {0};
+            '''.format(SCHEMA_VERSION))
+
+    def close(self):
+        self.conn.close()
+
+    def _scan(self):
+        current = dict()
+        for folder in self.folders:
+            folder_path = os.path.join(self.project_path, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            with os.scandir(folder_path) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode):
+                        current[(folder, entry.name)] = (st.st_mtime_ns, st.st_size)
+        return current
+
+    @trace.traced('fulltext.update')
+    def update(self, rebuild=False, workers=None):
+        """
+        Index the new/changed files and drop the removed ones. Return the number of (re-)indexed files.
+        """
+        if rebuild:
+            with self.conn:
+                self.conn.execute('DELETE FROM files')
+                self.conn.execute('DELETE FROM docs')
+        current = self._scan()
+        indexed = dict()
+        for row_id, folder, file_name, mtime, size in self.conn.execute(
+                'SELECT id, folder, file_name, mtime, size FROM files'):
+            indexed[(folder, file_name)] = (row_id, mtime, size)
+        removed = [value[0] for key, value in indexed.items() if key not in current]
+        changed = [key for key, value in current.items()
+                   if key not in indexed or indexed[key][1:] != value]
+        if not removed and not changed:
+            return 0
+        paths = [os.path.join(self.project_path, folder, file_name) for folder, file_name in changed]
+        # Reading and parsing is spread across threads; sqlite writes stay in this thread
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            documents = list(executor.map(_read_document, paths))
+        with self.conn:
+            for row_id in removed:
+                self.conn.execute('DELETE FROM files WHERE id = ?', (row_id,))
+                self.conn.execute('DELETE FROM docs WHERE rowid = ?', (row_id,))
+            for key, document in zip(changed, documents):
+                mtime, size = current[key]
+                if key in indexed:
+                    row_id = indexed[key][0]
+                    self.conn.execute('UPDATE files SET mtime = ?, size = ? WHERE id = ?', (mtime, size, row_id))
+                    self.conn.execute('DELETE FROM docs WHERE rowid = ?', (row_id,))
+                else:
+                    row_id = self.conn.execute('INSERT INTO files (folder, file_name, mtime, size) VALUES (?, ?, ?, ?)',
+                                               (key[0], key[1], mtime, size)).lastrowid
+                self.conn.execute('INSERT INTO docs (rowid, title, category, tags, body) VALUES (?, ?, ?, ?, ?)',
+                                  (row_id,) + document)
+        return len(changed)
+
+    def search(self, query, folders=None, limit=20, prefix=False, with_rank=False):
+        """
+        Return a list of (folder, file_name, title, snippet) ranked by relevance, with the bm25 rank (lower is
+        better) as a fifth item if `with_rank`.
+        The matched words in the snippet are wrapped by HIGHLIGHT_START and HIGHLIGHT_END.
+        """
+        expression = to_match_expression(query, prefix=prefix)
+        if expression is None:
+            return []
+        folders = list(folders or self.folders)
+        sql = '''
+            SELECT files.folder, files.file_name, docs.title,
+                   snippet(docs, 3, ?, ?, '...', 16), bm25(docs, ?, ?, ?, ?) AS rank
+            FROM docs JOIN files ON files.id = docs.rowid
+            WHERE docs MATCH ? AND files.folder IN ({0})
+            ORDER BY rank
+            LIMIT ?
+        '''.format(', '.join('?' * len(folders)))
+        params = [HIGHLIGHT_START, HIGHLIGHT_END] + list(COLUMN_WEIGHTS) + [expression] + folders + [limit]
+        try:
+            rows = self.conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # e.g. a query made only of separators
+            return []
+        return rows if with_rank else [row[:4] for row in rows]
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Git interactions of the blog project.
+
+`GitSession` stages any set of added/modified/removed paths with a single `git update-index` and commits them.
+Pushing is left to `PushQueue`: a command only records a push request and returns, while a detached worker process
+pushes in the background. Requests arriving while the worker waits or pushes are coalesced into one push, and the
+outcome is recorded so that `blogging status` can show pending or failed pushes.
+"""
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+
+from blogging import trace
+from blogging.metadata import atomic_write_json, file_lock, project_cache_dir
+
+# Seconds the push worker waits for more commits before pushing
+PUSH_DELAY = 2.0
+
+
+class GitError(Exception):
+    pass
+
+
+class GitSession(object):
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self._prefix = None
+
+    def run(self, *args, input=None, check=True):
+        with trace.phase('git ' + args[0], kind='subprocess', argv=list(args)):
+            proc = subprocess.run(['git'] + list(args), cwd=self.repo_path, input=input, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, universal_newlines=True)
+        if check and proc.returncode != 0:
+            raise GitError(proc.stderr.strip() or 'git {0} failed'.format(args[0]))
+        return proc
+
+    def stage(self, paths):
+        """
+        Stage the current state of `paths` (new, modified or deleted files alike) in one index update.
+        """
+        paths = [os.path.relpath(path, self.repo_path) for path in paths]
+        if paths:
+            self.run('update-index', '--add', '--remove', '-z', '--stdin', input='\0'.join(paths) + '\0')
+
+    def stage_folders(self, folders):
+        self.run('add', '--all', '--', *folders)
+
+    def prefix(self):
+        """
+        The path of `repo_path` inside the git repository (e.g. `site/`), empty at its top level.
+        """
+        if self._prefix is None:
+            self._prefix = self.run('rev-parse', '--show-prefix').stdout.strip()
+        return self._prefix
+
+    def changed_files(self, folders):
+        """
+        Return the (status, path) of the files changed under `folders`, as reported by `git status`, with the paths
+        relative to `repo_path`. The status is one of 'added', 'modified', 'deleted' or 'renamed'; renames also
+        report the old path.
+        """
+        proc = self.run('status', '--porcelain', '-z', '--untracked-files=all', '--', *folders)
+        # The porcelain paths are relative to the top level of the repository, not to `repo_path`
+        prefix = self.prefix()
+
+        def relative(path):
+            return os.path.relpath(path, prefix) if prefix else path
+
+        entries = proc.stdout.split('\0')
+        changes = []
+        i = 0
+        while i < len(entries):
+            entry = entries[i]
+            i += 1
+            if len(entry) < 4:
+                continue
+            code, path = entry[:2], relative(entry[3:])
+            if 'R' in code or 'C' in code:
+                # The old path comes as the next entry
+                changes.append(('renamed', path))
+                changes.append(('deleted', relative(entries[i])))
+                i += 1
+            elif 'D' in code:
+                changes.append(('deleted', path))
+            elif code == '??' or 'A' in code:
+                changes.append(('added', path))
+            else:
+                changes.append(('modified', path))
+        return changes
+
+    def commit(self, message):
+        """
+        Commit the staged changes. Return False if there was nothing to commit.
+        """
+        proc = self.run('commit', '--quiet', '--file', '-', input=message, check=False)
+        if proc.returncode == 0:
+            return True
+        if self.run('diff', '--cached', '--quiet', check=False).returncode == 0:
+            return False
+        raise GitError(proc.stderr.strip() or proc.stdout.strip() or 'git commit failed')
+
+    def unpushed_commits(self):
+        proc = self.run('rev-list', '--count', '@{upstream}..HEAD', check=False)
+        return int(proc.stdout.strip()) if proc.returncode == 0 else None
+
+
+class PushQueue(object):
+    def __init__(self, repo_path, state_dir=None, delay=PUSH_DELAY):
+        self.repo_path = repo_path
+        self.state_dir = state_dir or project_cache_dir(repo_path)
+        self.state_path = os.path.join(self.state_dir, 'push.json')
+        self.lock_path = self.state_path + '.lock'
+        self.worker_lock_path = os.path.join(self.state_dir, 'push-worker.lock')
+        self.delay = delay
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'requested': 0, 'pushed': 0, 'attempted': 0}
+
+    def state(self):
+        state = self._read_state()
+        state['running'] = self.worker_running()
+        return state
+
+    def _update_state(self, **changes):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            state = self._read_state()
+            state.update(changes)
+            atomic_write_json(self.state_path, state)
+        return state
+
+    def request(self, spawn=True):
+        """
+        Ask for a push of the current HEAD and make sure a worker is there to do it.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            state = self._read_state()
+            state['requested'] = state.get('requested', 0) + 1
+            state['requested_at'] = time.time()
+            atomic_write_json(self.state_path, state)
+        if spawn:
+            self.spawn_worker()
+
+    def spawn_worker(self):
+        # The worker exits at once if another one holds the worker lock
+        subprocess.Popen([sys.executable, '-m', 'blogging.gitops', self.repo_path, self.state_dir, str(self.delay)],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True, close_fds=True)
+
+    def worker_running(self):
+        try:
+            with open(self.worker_lock_path, 'a') as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        return False
+
+    def pending(self):
+        state = self._read_state()
+        return state.get('requested', 0) > state.get('pushed', 0)
+
+    def push_now(self):
+        """
+        Push in the foreground, recording the outcome. Return True on success.
+        """
+        requested = self._read_state().get('requested', 0)
+        proc = GitSession(self.repo_path).run('push', '--quiet', check=False)
+        if proc.returncode == 0:
+            # Requests made while pushing stay pending
+            self._update_state(attempted=requested, pushed=requested, last_push=time.time(), error=None)
+            return True
+        self._update_state(attempted=requested, last_failure=time.time(),
+                           error=proc.stderr.strip() or 'git push failed')
+        return False
+
+    def _drain(self):
+        while self.pending():
+            requested = self._read_state().get('requested', 0)
+            # Wait for the burst of commands to settle, so their commits go in one push
+            while True:
+                time.sleep(self.delay)
+                state = self._read_state()
+                if state.get('requested', 0) == requested:
+                    break
+                requested = state.get('requested', 0)
+            if not self.push_now():
+                # Leave it pending: shown by `blogging status`, retried by the next command or `blogging push`
+                return
+
+    def work(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.worker_lock_path, 'a') as f:
+            while True:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+                try:
+                    self._drain()
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                # A request made while the lock was being released would otherwise be left alone
+                state = self._read_state()
+                if state.get('requested', 0) <= state.get('pushed', 0):
+                    return
+                if state.get('error') and state.get('requested', 0) <= state.get('attempted', 0):
+                    return
+
+
+if __name__ == '__main__':
+    PushQueue(sys.argv[1], sys.argv[2], float(sys.argv[3])).work()
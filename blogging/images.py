@@ -0,0 +1,695 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The images folder of the blog.
+
+`ImageStore` keeps the content hash of each stored image in a json file under the cache dir, together with the
+mtime/size of the file when it was hashed, so only new or changed images are hashed again. Adding an image whose
+content is already stored reuses the stored file instead of copying it under a new name. The copies are made
+in-process, using the kernel fast paths (`copy_file_range`, then `sendfile`) when available.
+
+The size of an image is probed from its header, in the same pass over the mmapped file as the hash, and cached by
+hash: regenerating tags never reads an image again.
+
+`ImageStore.optimize` recompresses the images without their metadata and writes downscaled variants (for `srcset`)
+across a process pool. It needs Pillow, which is imported by the workers only. The hashes of the optimized images
+(and of their variants) are recorded, so the next runs skip them.
+
+`find_image_references` looks for the images mentioned by the drafts/posts. Rather than searching each image name
+in each post, a single pattern matches any path into the images folder (in `<img src/srcset>`, markdown images,
+links...), so each post is scanned once whatever the number of images.
+"""
+import errno
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import shutil
+import stat
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote
+
+from blogging.metadata import atomic_write_json, file_lock, project_cache_dir
+
+INDEX_VERSION = 3
+COPY_CHUNK = 64 * 1024 * 1024
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.bmp', '.tif', '.tiff', '.avif', '.ico')
+OPTIMIZABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# Widths of the downscaled variants (only the ones narrower than the image are made)
+VARIANT_WIDTHS = (480, 960, 1600)
+OPTIMIZE_QUALITY = 85
+# Bytes of an SVG file searched for the root element
+SVG_HEAD = 4 * 1024
+# JPEG start-of-frame markers (C4, C8 and CC are DHT, JPG and DAC)
+JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length
+JPEG_STANDALONE = frozenset(range(0xD0, 0xD9)) | {0x01}
+# EXIF/TIFF orientations which turn the image by 90 degrees
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+_SVG_TAG = re.compile(br'<svg\b[^>]*>', re.IGNORECASE)
+_SVG_ATTRIBUTE = br'\b{0}\s*=\s*["\']\s*([^"\']*)["\']'
+_SVG_LENGTH = re.compile(r'^([0-9]*\.?[0-9]+)\s*(px)?$')
+
+
+class UnknownImageFormat(Exception):
+    pass
+
+
+def _tiff_tags(data, start, end, wanted):
+    """
+    Return the values of the `wanted` (short/long) tags in the first IFD of the TIFF structure at `start`.
+    """
+    if data[start:start + 2] == b'II':
+        order = '<'
+    elif data[start:start + 2] == b'MM':
+        order = '>'
+    else:
+        raise UnknownImageFormat('Bad TIFF byte order')
+    ifd = start + struct.unpack_from(order + 'I', data, start + 4)[0]
+    count = struct.unpack_from(order + 'H', data, ifd)[0]
+    values = dict()
+    for entry in range(ifd + 2, min(ifd + 2 + count * 12, end - 11), 12):
+        tag, value_type = struct.unpack_from(order + 'HH', data, entry)
+        if tag in wanted:
+            if value_type == 3:
+                values[tag] = struct.unpack_from(order + 'H', data, entry + 8)[0]
+            elif value_type == 4:
+                values[tag] = struct.unpack_from(order + 'I', data, entry + 8)[0]
+    return values
+
+
+def _jpeg_size(data):
+    end = len(data)
+    i = 2
+    orientation = 1
+    while i + 4 <= end:
+        if data[i] != 0xFF:
+            # Garbage between segments
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        i += 2
+        if marker in JPEG_STANDALONE:
+            continue
+        if marker in (0xD9, 0xDA):
+            break
+        length = struct.unpack_from('>H', data, i)[0]
+        if marker in JPEG_SOF:
+            height, width = struct.unpack_from('>HH', data, i + 3)
+            if orientation in ROTATED_ORIENTATIONS:
+                return height, width
+            return width, height
+        if marker == 0xE1 and data[i + 2:i + 8] == b'Exif\0\0':
+            try:
+                orientation = _tiff_tags(data, i + 8, i + length, (274,)).get(274, 1)
+            except (struct.error, UnknownImageFormat):
+                pass
+        i += length
+    raise UnknownImageFormat('No frame found in the JPEG file')
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack_from('<HH', data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and data[20] == 0x2F:
+        bits = struct.unpack_from('<I', data, 21)[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    raise UnknownImageFormat('Unknown WebP chunk')
+
+
+def _boxes(data, start, end):
+    """
+    Yield the (type, body start, end) of the ISOBMFF boxes between `start` and `end`.
+    """
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            # Up to the end of the enclosing box
+            size = end - start
+        if size < header or start + size > end:
+            raise UnknownImageFormat('Truncated {0} box'.format(kind.decode('latin-1')))
+        yield kind, start + header, start + size
+        start += size
+
+
+def _box(data, start, end, kind):
+    for child, body, child_end in _boxes(data, start, end):
+        if child == kind:
+            return body, child_end
+    return None
+
+
+def _avif_primary_properties(data, meta, meta_end, properties):
+    """
+    Return the indexes (1-based) in `ipco` of the properties of the primary item, or None if they are not given.
+    """
+    pitm = _box(data, meta, meta_end, b'pitm')
+    ipma = _box(data, meta, meta_end, b'iprp')
+    ipma = ipma and _box(data, ipma[0], ipma[1], b'ipma')
+    if not pitm or not ipma:
+        return None
+    primary = struct.unpack_from('>H' if data[pitm[0]] == 0 else '>I', data, pitm[0] + 4)[0]
+    version, flags = data[ipma[0]], int.from_bytes(data[ipma[0] + 1:ipma[0] + 4], 'big')
+    position = ipma[0] + 4
+    count = struct.unpack_from('>I', data, position)[0]
+    position += 4
+    for _ in range(count):
+        item = struct.unpack_from('>H' if version < 1 else '>I', data, position)[0]
+        position += 2 if version < 1 else 4
+        associations = data[position]
+        position += 1
+        if flags & 1:
+            indexes = [index & 0x7FFF for index in struct.unpack_from('>{0}H'.format(associations), data, position)]
+            position += 2 * associations
+        else:
+            indexes = [index & 0x7F for index in data[position:position + associations]]
+            position += associations
+        if item == primary:
+            return [index for index in indexes if 0 < index <= len(properties)]
+    return None
+
+
+def _avif_size(data):
+    # Only the top-level `meta` box is read: meta -> iprp -> ipco holds the item properties, ipma tells which of them
+    # belong to the primary item (pitm)
+    meta = _box(data, 0, len(data), b'meta')
+    if not meta:
+        raise UnknownImageFormat('No meta box in the AVIF file')
+    # Full box: skip its version and flags
+    meta_start, meta_end = meta[0] + 4, meta[1]
+    iprp = _box(data, meta_start, meta_end, b'iprp')
+    ipco = iprp and _box(data, iprp[0], iprp[1], b'ipco')
+    if not ipco:
+        raise UnknownImageFormat('No item properties in the AVIF file')
+    properties = list(_boxes(data, ipco[0], ipco[1]))
+    indexes = _avif_primary_properties(data, meta_start, meta_end, properties)
+    if indexes is not None:
+        properties = [properties[index - 1] for index in indexes]
+    sizes = [struct.unpack_from('>II', data, body + 4) for kind, body, end in properties if kind == b'ispe']
+    if not sizes:
+        raise UnknownImageFormat('No size found in the AVIF file')
+    # Without the associations, the largest image is the primary one
+    width, height = max(sizes, key=lambda size: size[0] * size[1])
+    if any(data[body] & 1 for kind, body, end in properties if kind == b'irot'):
+        return height, width
+    return width, height
+
+
+def _svg_length(value):
+    match = _SVG_LENGTH.match(value.decode('utf-8', 'replace').strip())
+    return float(match.group(1)) if match else None
+
+
+def _svg_size(data):
+    match = _SVG_TAG.search(data[:SVG_HEAD])
+    if not match:
+        raise UnknownImageFormat('No svg element found')
+    tag = match.group(0)
+    values = dict()
+    for name in (b'width', b'height', b'viewBox'):
+        attribute = re.search(_SVG_ATTRIBUTE.replace(b'{0}', name), tag)
+        values[name] = attribute.group(1) if attribute else b''
+    width, height = _svg_length(values[b'width']), _svg_length(values[b'height'])
+    view_box = values[b'viewBox'].replace(b',', b' ').split()
+    if (width is None or height is None) and len(view_box) == 4:
+        box_width, box_height = float(view_box[2]), float(view_box[3])
+        if width is None and height is None:
+            width, height = box_width, box_height
+        elif width is None and box_height:
+            width = height * box_width / box_height
+        elif height is None and box_width:
+            height = width * box_height / box_width
+    if width is None or height is None:
+        raise UnknownImageFormat('The svg element has no usable size')
+    return int(round(width)), int(round(height))
+
+
+def image_size(data):
+    """
+    Return the (width, height) of the image in `data` (bytes or a mmap), as displayed: the EXIF/TIFF orientation
+    and the AVIF rotation are taken into account.
+    """
+    try:
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack_from('<HH', data, 6)
+        if data[:8] == b'\211PNG\r\n\032\n':
+            if data[12:16] == b'IHDR':
+                return struct.unpack_from('>LL', data, 16)
+            # older PNGs?
+            return struct.unpack_from('>LL', data, 8)
+        if data[:2] == b'\377\330':
+            return _jpeg_size(data)
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return _webp_size(data)
+        if data[:2] == b'BM':
+            if struct.unpack_from('<I', data, 14)[0] == 12:
+                return struct.unpack_from('<HH', data, 18)
+            width, height = struct.unpack_from('<ii', data, 18)
+            # Negative for top-down bitmaps
+            return width, abs(height)
+        if data[:4] in (b'II*\0', b'MM\0*'):
+            tags = _tiff_tags(data, 0, len(data), (256, 257, 274))
+            width, height = tags[256], tags[257]
+            if tags.get(274, 1) in ROTATED_ORIENTATIONS:
+                return height, width
+            return width, height
+        if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis', b'mif1', b'msf1', b'heic', b'heix'):
+            return _avif_size(data)
+        if _SVG_TAG.search(data[:SVG_HEAD]):
+            return _svg_size(data)
+    except (struct.error, IndexError, KeyError, ValueError) as e:
+        raise UnknownImageFormat('{0} raised while reading the image header.'.format(e.__class__.__name__))
+    raise UnknownImageFormat("Sorry, don't know how to get information from this file.")
+
+
+def _mapped(f):
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty file
+        return b''
+
+
+def get_image_size(file_path):
+    """
+    Return (width, height) for a given img file content - no external
+    dependencies except the os and struct modules from core
+    """
+    with open(file_path, 'rb') as f:
+        data = _mapped(f)
+        try:
+            return image_size(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def probe_file(file_path):
+    """
+    Return the content hash of a file and its image size (None if not an image), from a single mapping.
+    """
+    with open(file_path, 'rb') as f:
+        data = _mapped(f)
+        try:
+            digest = hashlib.sha1(data).hexdigest()
+            try:
+                size = image_size(data)
+            except UnknownImageFormat:
+                size = None
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return digest, size
+
+
+def _rewind(fsrc, fdst):
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+
+
+def copy_file(src, dst):
+    """
+    Copy `src` to a new file `dst` (which must not exist yet).
+    """
+    with open(src, 'rb') as fsrc:
+        # O_EXCL: never overwrite an image stored meanwhile by another command
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            with os.fdopen(fd, 'wb') as fdst:
+                if hasattr(os, 'copy_file_range'):
+                    try:
+                        # In-kernel copy (or a reflink on CoW filesystems)
+                        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK):
+                            pass
+                        return
+                    except OSError as e:
+                        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                            raise
+                        _rewind(fsrc, fdst)
+                if hasattr(os, 'sendfile'):
+                    try:
+                        # Still in the kernel, across filesystems too (Linux only takes a file as destination)
+                        offset = 0
+                        while True:
+                            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, COPY_CHUNK)
+                            if not sent:
+                                return
+                            offset += sent
+                    except OSError as e:
+                        if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                            raise
+                        _rewind(fsrc, fdst)
+                shutil.copyfileobj(fsrc, fdst)
+        except BaseException:
+            os.remove(dst)
+            raise
+
+
+def _encode(image, image_format, quality, icc_profile):
+    options = dict()
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    if image_format == 'JPEG':
+        options.update(quality=quality, optimize=True, progressive=True)
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+    elif image_format == 'PNG':
+        options['optimize'] = True
+    elif image_format == 'WEBP':
+        options.update(quality=quality, method=6)
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def optimize_file(file_path, variants, quality=OPTIMIZE_QUALITY):
+    """
+    Recompress the image at `file_path` without its metadata (kept only if smaller) and write its downscaled
+    `variants`, a list of (width, path). Run by the worker processes.
+    Return the saved bytes and the (width, path) of the variants written.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(file_path) as image:
+        if getattr(image, 'is_animated', False):
+            # Saving would only keep the first frame
+            return 0, []
+        image_format = image.format
+        icc_profile = image.info.get('icc_profile')
+        # The EXIF orientation goes away with the metadata: turn the pixels instead
+        image = ImageOps.exif_transpose(image)
+    original_size = os.path.getsize(file_path)
+    data = _encode(image, image_format, quality, icc_profile)
+    saved = 0
+    final_size = min(len(data), original_size)
+    if len(data) < original_size:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+        saved = original_size - len(data)
+    written = []
+    for width, path in variants:
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        variant = _encode(image.resize((width, height), Image.LANCZOS), image_format, quality, icc_profile)
+        if len(variant) >= final_size:
+            # No lighter than the full image (e.g. flat graphics, which compress well)
+            continue
+        with open(path, 'wb') as f:
+            f.write(variant)
+        written.append((width, path))
+    return saved, written
+
+
+def image_reference_pattern(images_folder):
+    """
+    Return a regex matching the paths into `images_folder` (`/_images/a.png`, `../_images/a.png`...), capturing
+    the file name. The pattern starts with the folder name, so the regex engine can search it as a literal.
+    """
+    return re.compile(r'{0}/([^\s"\'()<>\[\]{{}}?#|]+)'.format(re.escape(images_folder.strip('/'))))
+
+
+def _read_references(file_path, pattern):
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    except OSError:
+        return set()
+    names = set()
+    for match in pattern.finditer(text):
+        start = match.start()
+        # Skip the folders which only end like the images folder (`my_images/`)
+        if start and (text[start - 1].isalnum() or text[start - 1] in '_.-'):
+            continue
+        # Trailing punctuation belongs to the sentence, not to the name
+        names.add(unquote(match.group(1).rstrip('.,;:!')))
+    return names
+
+
+def find_image_references(file_paths, images_folder, workers=None):
+    """
+    Return the names of the images referenced by each file, as a dict {file path: set of names}.
+    """
+    pattern = image_reference_pattern(images_folder)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(file_paths, executor.map(lambda path: _read_references(path, pattern), file_paths)))
+
+
+def expand_image_paths(paths):
+    """
+    Replace the directories in `paths` by the image files they contain.
+    """
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(path, name))))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def free_name(base, extension, taken):
+    """
+    Return the first of `base.ext`, `base-1.ext`, `base-2.ext`... not in `taken` (a set of lower-case names).
+    """
+    name = base + extension
+    index = 1
+    while name.lower() in taken:
+        name = '{0}-{1}{2}'.format(base, index, extension)
+        index += 1
+    return name
+
+
+class StoredImage(object):
+    __slots__ = ('source', 'name', 'hash', 'reused', 'size')
+
+    def __init__(self, source, name, hash, reused, size):
+        self.source = source
+        self.name = name
+        self.hash = hash
+        self.reused = reused
+        # (width, height), or None if the format is unknown
+        self.size = size
+
+
+class ImageStore(object):
+    def __init__(self, project_path, folder, cache_dir=None, workers=None):
+        self.folder_path = os.path.join(project_path, folder)
+        self.cache_dir = cache_dir or project_cache_dir(project_path)
+        self.index_path = os.path.join(self.cache_dir, 'images.json')
+        self.lock_path = self.index_path + '.lock'
+        self.workers = workers
+        # file name -> [mtime, size, hash]
+        self.files = dict()
+        # hash -> [width, height], or None if the format is unknown
+        self.sizes = dict()
+        # hash of an optimized image -> [[variant name, width], ...] (empty for the variants themselves)
+        self.optimized = dict()
+        # hash of an image before its optimization -> hash after, so the original is still recognized when added
+        self.aliases = dict()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+        if data.get('version') != INDEX_VERSION or data.get('folder') != self.folder_path:
+            return dict()
+        return data
+
+    def _save(self):
+        atomic_write_json(self.index_path, {'version': INDEX_VERSION, 'folder': self.folder_path,
+                                            'files': self.files, 'sizes': self.sizes, 'optimized': self.optimized,
+                                            'aliases': self.aliases})
+
+    def scan(self):
+        """
+        Return the (mtime, size) of each stored image by file name, without reading the images.
+        """
+        current = dict()
+        if not os.path.isdir(self.folder_path):
+            return current
+        with os.scandir(self.folder_path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    current[entry.name] = (st.st_mtime_ns, st.st_size)
+        return current
+
+    def _refresh(self):
+        data = self._load()
+        files = data.get('files', dict())
+        sizes = data.get('sizes', dict())
+        current = self.scan()
+        changed = [name for name, value in current.items()
+                   if name not in files or tuple(files[name][:2]) != value]
+        dirty = bool(changed) or any(name not in current for name in files)
+        files = {name: value for name, value in files.items() if name in current}
+        if changed:
+            paths = [os.path.join(self.folder_path, name) for name in changed]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                probes = list(executor.map(probe_file, paths))
+            for name, (digest, size) in zip(changed, probes):
+                files[name] = list(current[name]) + [digest]
+                sizes[digest] = size
+        # Forget the images no longer stored
+        hashes = {value[2] for value in files.values()}
+        self.sizes = {digest: size for digest, size in sizes.items() if digest in hashes}
+        self.optimized = {digest: [variant for variant in variants if variant[0] in files]
+                          for digest, variants in data.get('optimized', dict()).items() if digest in hashes}
+        self.aliases = {digest: target for digest, target in data.get('aliases', dict()).items()
+                        if target in self.optimized}
+        self.files = files
+        return dirty
+
+    def refresh(self):
+        """
+        Bring the hashes and sizes in line with the images folder, reading only the new/changed images.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            if self._refresh():
+                self._save()
+        return self.files
+
+    def dimensions(self):
+        """
+        Return the (width, height) of each stored image by file name, None for unknown formats.
+        """
+        self.refresh()
+        return {name: self.sizes.get(digest) for name, (mtime, size, digest) in self.files.items()}
+
+    def variants(self, name):
+        """
+        Return the (name, width) of the downscaled variants of a stored image, narrowest first.
+        """
+        entry = self.files.get(name)
+        return [tuple(variant) for variant in self.optimized.get(entry[2], ())] if entry else []
+
+    def by_hash(self):
+        names = dict()
+        for name, (mtime, size, digest) in sorted(self.files.items()):
+            names.setdefault(digest, name)
+        return names
+
+    def add(self, paths, base_name):
+        """
+        Store the images at `paths` under free names derived from `base_name` (`base.png`, `base-1.png`...).
+        An image whose content is already stored is not copied again. Return a `StoredImage` per path.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            probes = list(executor.map(probe_file, paths))
+            with file_lock(self.lock_path):
+                dirty = self._refresh()
+                stored = self.by_hash()
+                # One listing of the folder (made by the refresh above) instead of probing each candidate name
+                taken = {name.lower() for name in self.files}
+                images = []
+                copies = []
+                for path, (digest, size) in zip(paths, probes):
+                    digest = self.aliases.get(digest, digest)
+                    if digest in stored:
+                        images.append(StoredImage(path, stored[digest], digest, True, self.sizes.get(digest, size)))
+                        continue
+                    extension = os.path.splitext(path)[1].lower()
+                    name = free_name(base_name, extension, taken)
+                    taken.add(name.lower())
+                    stored[digest] = name
+                    self.sizes[digest] = size
+                    images.append(StoredImage(path, name, digest, False, size))
+                    copies.append((path, os.path.join(self.folder_path, name)))
+                if copies:
+                    list(executor.map(lambda copy: copy_file(*copy), copies))
+                    for image in images:
+                        if not image.reused and image.name not in self.files:
+                            st = os.stat(os.path.join(self.folder_path, image.name))
+                            self.files[image.name] = [st.st_mtime_ns, st.st_size, image.hash]
+                if dirty or copies:
+                    self._save()
+        return images
+
+    def optimize(self, names=None, widths=VARIANT_WIDTHS, quality=OPTIMIZE_QUALITY, workers=None):
+        """
+        Optimize the stored images `names` (all by default) across a process pool, skipping the ones already
+        optimized. Return a list of (name, saved bytes, variant names, error).
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            dirty = self._refresh()
+            variant_names = {variant[0] for variants in self.optimized.values() for variant in variants}
+            names = sorted(self.files) if names is None else names
+            taken = {name.lower() for name in self.files}
+            jobs = []
+            for name in names:
+                entry = self.files.get(name)
+                if entry is None or name in variant_names or entry[2] in self.optimized \
+                        or os.path.splitext(name)[1].lower() not in OPTIMIZABLE_EXTENSIONS:
+                    continue
+                size = self.sizes.get(entry[2])
+                base, extension = os.path.splitext(name)
+                variants = []
+                for width in sorted(widths):
+                    if size and width < size[0]:
+                        variant = free_name('{0}-{1}w'.format(base, width), extension, taken)
+                        taken.add(variant.lower())
+                        variants.append((width, os.path.join(self.folder_path, variant)))
+                jobs.append((name, variants))
+            results = []
+            if jobs:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(optimize_file, os.path.join(self.folder_path, name), variants,
+                                               quality) for name, variants in jobs]
+                    for (name, variants), future in zip(jobs, futures):
+                        try:
+                            saved, written = future.result()
+                        except Exception as e:
+                            results.append((name, 0, [], '{0}: {1}'.format(e.__class__.__name__, e)))
+                            continue
+                        results.append((name, saved, [os.path.basename(path) for width, path in written], None))
+                        self._record_optimized(name, written)
+            if dirty or jobs:
+                self._save()
+        return results
+
+    def _record_optimized(self, name, variants):
+        old_hash = self.files[name][2]
+        paths = [os.path.join(self.folder_path, name)] + [path for width, path in variants]
+        probes = [probe_file(path) for path in paths]
+        for path, (digest, size) in zip(paths, probes):
+            st = os.stat(path)
+            self.files[os.path.basename(path)] = [st.st_mtime_ns, st.st_size, digest]
+            self.sizes[digest] = size
+            self.optimized[digest] = []
+        new_hash = probes[0][0]
+        self.optimized[new_hash] = [[os.path.basename(path), width] for width, path in variants]
+        if new_hash != old_hash:
+            self.aliases[old_hash] = new_hash
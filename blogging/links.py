@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checking the links and images of the blogs.
+
+The links are extracted from the markdown/html of each post. The local ones (images, other files of the site,
+`{% post_url %}` tags and permalinks of other posts) are checked against the project, the external ones over HTTP.
+
+External URLs are checked concurrently by a small asyncio HTTP/1.1 client (standard library only): the connections
+are kept alive and reused per host, the number of concurrent requests is bounded per host and overall, and `HEAD`
+falls back to `GET` for the servers refusing it. The results are cached in the cache dir: a working URL is not
+checked again before the TTL expires, a broken one is checked again on each run.
+"""
+import asyncio
+import json
+import os
+import re
+import ssl
+import time
+from urllib.parse import unquote, urljoin, urlsplit
+
+from blogging.metadata import atomic_write_json, file_lock
+
+# Seconds a working URL stays in the cache
+LINK_TTL = 24 * 3600
+HOST_CONCURRENCY = 4
+TOTAL_CONCURRENCY = 64
+TIMEOUT = 10.0
+MAX_REDIRECTS = 5
+MAX_HEADER_SIZE = 64 * 1024
+USER_AGENT = 'Mozilla/5.0 (compatible; blogging-check-links)'
+POST_URL_PREFIX = 'post_url:'
+
+_CODE = re.compile(r'^(```|~~~).*?^\1|`[^`\n]+`', re.MULTILINE | re.DOTALL)
+_MARKDOWN_LINK = re.compile(r'\]\(\s*<?([^\s)>]+)>?(?:\s+(?:"[^"]*"|\'[^\']*\'|\([^)]*\)))?\s*\)')
+_REFERENCE_LINK = re.compile(r'^ {0,3}\[[^\]]+\]:\s*<?([^\s>]+)>?', re.MULTILINE)
+_HTML_LINK = re.compile(r'<(?:a|img|link|script|source|iframe|video|audio)\b[^>]*?\b(?:href|src)\s*=\s*'
+                        r'["\']([^"\']+)["\']', re.IGNORECASE)
+_SRCSET = re.compile(r'\bsrcset\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+_AUTOLINK = re.compile(r'<(https?://[^\s>]+)>')
+_POST_URL = re.compile(r'{%\s*post_url\s+([^\s%]+)\s*%}')
+_LIQUID_PREFIX = re.compile(r'^{{[^}]*}}')
+# Default Jekyll permalinks end with /year/month/day/slug(.html)
+_PERMALINK = re.compile(r'/(\d{4})/(\d{2})/(\d{2})/([^/]+?)(?:\.html)?/?$')
+
+
+def extract_links(text):
+    """
+    Return the link targets of a markdown/html text, in order and without duplicates. A `{% post_url name %}` tag
+    gives `post_url:name`.
+    """
+    text = _CODE.sub('', text)
+    links = [POST_URL_PREFIX + name for name in _POST_URL.findall(text)]
+    for pattern in (_MARKDOWN_LINK, _REFERENCE_LINK, _HTML_LINK, _AUTOLINK):
+        links.extend(pattern.findall(text))
+    for srcset in _SRCSET.findall(text):
+        links.extend(candidate.split()[0] for candidate in srcset.split(',') if candidate.strip())
+    return list(dict.fromkeys(links))
+
+
+def is_external(link):
+    return link.startswith(('http://', 'https://', '//'))
+
+
+def check_local(link, project_path, post_names):
+    """
+    Return None if the local `link` leads somewhere, else what is wrong.
+    `post_names` is the set of the posts' file names without extension (e.g. `2020-01-01-hello`).
+    """
+    if link.startswith(POST_URL_PREFIX):
+        name = os.path.splitext(os.path.basename(link[len(POST_URL_PREFIX):]))[0]
+        return None if name in post_names else 'no such post'
+    link = _LIQUID_PREFIX.sub('', link)
+    if '{{' in link or '{%' in link or urlsplit(link).scheme:
+        # Templated, or mailto:, ftp:...
+        return None
+    path = unquote(urlsplit(link).path)
+    if not path:
+        # Anchor in the same page
+        return None
+    target = os.path.normpath(os.path.join(project_path, path.lstrip('/')))
+    if os.path.exists(target) or any(os.path.isfile(target + extension) for extension in ('.md', '.html')) \
+            or any(os.path.isfile(os.path.join(target, name)) for name in ('index.html', 'index.md')):
+        return None
+    match = _PERMALINK.search(path)
+    if match and '{0}-{1}-{2}-{3}'.format(*match.groups()) in post_names:
+        return None
+    return 'no such file or post'
+
+
+class _ConnectionPool(object):
+    """
+    Idle keep-alive connections by (scheme, host, port).
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.idle = dict()
+        self.ssl_context = ssl.create_default_context()
+
+    async def _connect(self, scheme, host, port):
+        if scheme == 'https':
+            return await asyncio.open_connection(host, port, ssl=self.ssl_context, server_hostname=host,
+                                                 limit=MAX_HEADER_SIZE)
+        return await asyncio.open_connection(host, port, limit=MAX_HEADER_SIZE)
+
+    async def _exchange(self, reader, writer, request):
+        writer.write(request)
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('iso-8859-1').split('\r\n')
+        version, status = lines[0].split(' ', 2)[:2]
+        headers = dict()
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return version, int(status), headers
+
+    async def request(self, method, url):
+        """
+        Send a request without body and return (status, headers). Only the connections of the HEAD requests are
+        reused, as the body of a GET is not read.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        host = parts.hostname if parts.port is None else '{0}:{1}'.format(parts.hostname, parts.port)
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        keep_alive = method == 'HEAD'
+        request = ('{0} {1} HTTP/1.1\r\nHost: {2}\r\nUser-Agent: {3}\r\nAccept: */*\r\nConnection: {4}\r\n\r\n'.format(
+            method, target, host, USER_AGENT, 'keep-alive' if keep_alive else 'close')).encode('utf-8')
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            try:
+                version, status, headers = await asyncio.wait_for(self._exchange(reader, writer, request),
+                                                                  self.timeout)
+                break
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                # Closed by the server meanwhile
+                writer.close()
+        else:
+            reader, writer = await asyncio.wait_for(self._connect(scheme, parts.hostname, port), self.timeout)
+            try:
+                version, status, headers = await asyncio.wait_for(self._exchange(reader, writer, request),
+                                                                  self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+        if keep_alive and version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close':
+            self.idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        return status, headers
+
+    def close(self):
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle = dict()
+
+
+class LinkChecker(object):
+    def __init__(self, cache_path, ttl=LINK_TTL, host_concurrency=HOST_CONCURRENCY,
+                 concurrency=TOTAL_CONCURRENCY, timeout=TIMEOUT):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.host_concurrency = host_concurrency
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    async def _check(self, url, pool, semaphore, host_semaphores):
+        current = url
+        for _ in range(MAX_REDIRECTS + 1):
+            host = urlsplit(current).hostname
+            if not host:
+                return None, 'bad url'
+            host_semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(self.host_concurrency))
+            async with semaphore, host_semaphore:
+                try:
+                    status, headers = await pool.request('HEAD', current)
+                    if status >= 400:
+                        # Some servers do not handle HEAD (405, 501...) or answer it differently
+                        status, headers = await pool.request('GET', current)
+                except asyncio.TimeoutError:
+                    return None, 'timeout'
+                except (OSError, asyncio.IncompleteReadError, ValueError, UnicodeError) as e:
+                    return None, str(e) or e.__class__.__name__
+            if 300 <= status < 400 and headers.get('location'):
+                current = urljoin(current, headers['location'])
+                continue
+            return status, None if status < 400 else 'HTTP {0}'.format(status)
+        return None, 'too many redirects'
+
+    async def _check_all(self, urls):
+        pool = _ConnectionPool(self.timeout)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = dict()
+        try:
+            return await asyncio.gather(*[self._check(url, pool, semaphore, host_semaphores) for url in urls])
+        finally:
+            pool.close()
+
+    def check(self, urls, refresh=False):
+        """
+        Return {url: error} for the `urls`, with None as error for the working ones.
+        """
+        now = time.time()
+        cache = dict() if refresh else self._load()
+        results = dict()
+        todo = []
+        for url in dict.fromkeys(urls):
+            entry = cache.get(url)
+            if entry and entry[1] is None and now - entry[0] < self.ttl:
+                results[url] = None
+            else:
+                todo.append(url)
+        if todo:
+            checked = asyncio.run(self._check_all(['https:' + url if url.startswith('//') else url
+                                                    for url in todo]))
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with file_lock(self.cache_path + '.lock'):
+                cache = self._load()
+                for url, (status, error) in zip(todo, checked):
+                    results[url] = error
+                    cache[url] = [now, error]
+                # Forget the expired entries
+                cache = {url: entry for url, entry in cache.items() if now - entry[0] < self.ttl}
+                atomic_write_json(self.cache_path, cache)
+        return results
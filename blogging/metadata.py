@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent index of the blogs' meta info (title/category/tags in the front matter).
+
+Each folder (e.g. `_posts`) gets its own json file under the cache dir, keyed by file name and storing the
+mtime/size of the file when it was parsed. Only the files that changed, were added or were removed since the last
+run are re-parsed. Only a bounded window at the head of each file is read, and a folder with many changed files is
+parsed across a thread pool (which mostly helps on slow or network filesystems).
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from blogging import trace
+from blogging.catalog import PostCatalog
+from blogging.constants import BLOGGING_CACHE_DIR
+
+INDEX_VERSION = 3
+# Bytes read from the head of a file to find its front matter
+HEADER_LIMIT = 4 * 1024
+# Parse the changed files across threads when there are at least this many of them
+PARALLEL_THRESHOLD = 32
+
+
+class MalformedFrontMatter(Exception):
+    def __init__(self, message, meta):
+        super(MalformedFrontMatter, self).__init__(message)
+        self.meta = meta
+
+
+# Front matter keys we care about, and the meta info field they fill
+META_KEYS = {
+    'title': 'title',
+    'category': 'category',
+    'categories': 'category',
+    'tags': 'tag',
+    'tag': 'tag',
+}
+_FLOW_ITEM = re.compile(r'\s*("(?:[^"\\]|\\.)*"|\'(?:[^\']|\'\')*\'|[^,]+)')
+
+
+def unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        if value[0] == "'":
+            return value[1:-1].replace("''", "'")
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return value
+
+
+def list_items(value):
+    """
+    Split `[a, "b"]`, `a, b` or `a b` into its items as they are written (quotes included).
+    """
+    value = value.strip()
+    if value.startswith('[') and value.endswith(']'):
+        items = _FLOW_ITEM.findall(value[1:-1])
+    elif ',' in value:
+        items = _FLOW_ITEM.findall(value)
+    else:
+        items = value.split()
+    return [item.strip() for item in items if item.strip()]
+
+
+def parse_list(value):
+    """
+    Parse `[a, "b"]`, `a, b` or `a b` into a list.
+    """
+    return [item for item in (unquote(item) for item in list_items(value)) if item]
+
+
+def _set_field(meta, field, values):
+    if field == 'category':
+        # The tool deals with one category per blog
+        if values:
+            meta['category'] = values[0]
+    else:
+        meta['tag'] = values
+
+
+def parse_front_matter(lines):
+    """
+    Parse the meta info from the lines of a blog.
+    Return the meta info, the number of lines the front matter takes and whether its closing `---` was found.
+
+    Titles may be quoted; categories/tags may be a flow list (`[a, b]`), a plain list (`a, b` or `a b`) or a block
+    list (one `- item` per line).
+    """
+    meta = dict()
+    consumed = 0
+    closed = False
+    lines = iter(lines)
+    first_line = next(lines, '')
+    consumed += 1
+    if not first_line.startswith('---'):
+        return meta, 0, closed
+    block_field = None
+    block_values = None
+    for line in lines:
+        consumed += 1
+        if line.startswith('---'):
+            closed = True
+            break
+        stripped = line.strip()
+        if block_field is not None:
+            if stripped.startswith('-') and (len(stripped) == 1 or stripped[1] in ' \t'):
+                item = unquote(stripped[1:])
+                if item:
+                    block_values.append(item)
+                continue
+            if not stripped or stripped.startswith('#'):
+                continue
+            _set_field(meta, block_field, block_values)
+            block_field = None
+        if line[:1] in (' ', '\t') or ':' not in line:
+            continue
+        key, _, value = line.partition(':')
+        field = META_KEYS.get(key.strip())
+        if field is None:
+            continue
+        value = value.strip()
+        if field == 'title':
+            meta['title'] = unquote(value)
+        elif not value:
+            block_field = field
+            block_values = []
+        else:
+            _set_field(meta, field, parse_list(value))
+    if block_field is not None:
+        _set_field(meta, block_field, block_values)
+    return meta, consumed, closed
+
+
+def parse_meta_info(file_path, limit=HEADER_LIMIT):
+    """
+    Parse the front matter within the first `limit` bytes of the file.
+    Raise MalformedFrontMatter (carrying what could be parsed) if it is not closed within that window.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read(limit)
+    return parse_meta_head(data, limit)
+
+
+def parse_meta_head(data, limit=HEADER_LIMIT):
+    """
+    Parse the front matter from `data`, the first (at most `limit`) bytes of a file.
+    """
+    text = data.decode('utf-8', errors='replace')
+    # No need to split the lines after the closing `---`
+    end = text.find('\n---', 3)
+    if end >= 0:
+        text = text[:end + 4]
+    meta, consumed, closed = parse_front_matter(text.splitlines(True))
+    if consumed and not closed:
+        if len(data) >= limit:
+            message = 'front matter is not closed within the first {0} bytes'.format(limit)
+        else:
+            message = 'front matter is not closed'
+        raise MalformedFrontMatter(message, meta)
+    return meta
+
+
+def split_front_matter(text):
+    """
+    Return the meta info and the body (i.e. the content after the front matter) of a blog.
+    """
+    lines = text.splitlines(True)
+    meta, consumed, closed = parse_front_matter(lines)
+    return meta, ''.join(lines[consumed:])
+
+
+def project_cache_dir(project_path):
+    digest = hashlib.sha1(os.path.abspath(project_path).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(BLOGGING_CACHE_DIR, digest)
+
+
+def atomic_write_json(path, data):
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # `json.dumps` uses the C encoder, `json.dump` would write many small chunks
+            f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class MetaIndex(object):
+    def __init__(self, project_path, folder, cache_dir=None, header_limit=HEADER_LIMIT, workers=None):
+        self.folder_path = os.path.join(project_path, folder)
+        self.cache_dir = cache_dir or project_cache_dir(project_path)
+        name = folder.strip(os.sep).replace(os.sep, '_') or 'root'
+        self.index_path = os.path.join(self.cache_dir, '{0}.json'.format(name))
+        self.lock_path = self.index_path + '.lock'
+        self.header_limit = header_limit
+        self.workers = workers
+        self.catalog = None
+        self._info = None
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return PostCatalog()
+        if data.get('version') != INDEX_VERSION or data.get('folder') != self.folder_path \
+                or data.get('header_limit') != self.header_limit:
+            return PostCatalog()
+        try:
+            return PostCatalog.from_json(data['catalog'])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return PostCatalog()
+
+    def _save(self):
+        atomic_write_json(self.index_path, {'version': INDEX_VERSION, 'folder': self.folder_path,
+                                            'header_limit': self.header_limit, 'catalog': self.catalog.to_json()})
+
+    def _read_heads(self, file_names):
+        heads = []
+        for file_name in file_names:
+            try:
+                # Raw fds: a buffered file object costs more than the single read we need
+                fd = os.open(os.path.join(self.folder_path, file_name), os.O_RDONLY)
+                try:
+                    heads.append(os.read(fd, self.header_limit))
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                heads.append(e)
+        return heads
+
+    def _parse_into(self, catalog, changed):
+        """
+        Parse the (file_name, stat) pairs into the catalog. With many files, the reads are spread across threads in
+        chunks (the parsing itself stays in this thread as it holds the GIL anyway).
+        """
+        file_names = [file_name for file_name, st in changed]
+        if len(changed) < PARALLEL_THRESHOLD:
+            heads = self._read_heads(file_names)
+        else:
+            workers = self.workers or min(32, (os.cpu_count() or 1) + 4)
+            chunk_size = max(PARALLEL_THRESHOLD // 4, len(file_names) // (workers * 4) + 1)
+            chunks = [file_names[i:i + chunk_size] for i in range(0, len(file_names), chunk_size)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                heads = [head for chunk in executor.map(self._read_heads, chunks) for head in chunk]
+        for (file_name, st), head in zip(changed, heads):
+            error = None
+            if isinstance(head, OSError):
+                meta = dict()
+                error = head.strerror or str(head)
+            else:
+                try:
+                    meta = parse_meta_head(head, self.header_limit)
+                except MalformedFrontMatter as e:
+                    meta = e.meta
+                    error = str(e)
+            catalog.add(file_name, meta, st.st_mtime_ns, st.st_size, error)
+
+    @trace.traced('meta_index.refresh')
+    def refresh(self, rebuild=False):
+        """
+        Bring the index in line with the folder, re-parsing only the files whose mtime/size changed.
+        Return the number of re-parsed files.
+        """
+        if not os.path.isdir(self.folder_path):
+            self.catalog = PostCatalog()
+            self._info = None
+            return 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            catalog = PostCatalog() if rebuild else self._load()
+            seen = set()
+            changed = []
+            with os.scandir(self.folder_path) as it:
+                for dir_entry in it:
+                    if dir_entry.name.startswith('.'):
+                        continue
+                    try:
+                        st = dir_entry.stat()
+                    except OSError:
+                        continue
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+                    seen.add(dir_entry.name)
+                    post = catalog.get(dir_entry.name)
+                    if post is None or post.mtime != st.st_mtime_ns or post.size != st.st_size:
+                        changed.append((dir_entry.name, st))
+            removed = [file_name for file_name in catalog.file_names if file_name not in seen]
+            for file_name in removed:
+                catalog.remove(file_name)
+            self._parse_into(catalog, changed)
+            self.catalog = catalog
+            self._info = None
+            if changed or removed or rebuild:
+                self._save()
+        return len(changed)
+
+    def update(self, file_names):
+        """
+        Re-check only the given files (e.g. reported by a folder watcher) instead of the whole folder.
+        """
+        if self.catalog is None:
+            return self.refresh()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            changed = []
+            for file_name in file_names:
+                try:
+                    st = os.stat(os.path.join(self.folder_path, file_name))
+                except OSError:
+                    st = None
+                if file_name.startswith('.') or st is None or not stat.S_ISREG(st.st_mode):
+                    self.catalog.remove(file_name)
+                    continue
+                post = self.catalog.get(file_name)
+                if post is None or post.mtime != st.st_mtime_ns or post.size != st.st_size:
+                    changed.append((file_name, st))
+            self._parse_into(self.catalog, changed)
+            self._info = None
+            self._save()
+        return len(changed)
+
+    def get_catalog(self):
+        if self.catalog is None:
+            self.refresh()
+        return self.catalog
+
+    def info(self):
+        """
+        The meta info of every file, as a dict of the dicts returned by the parser.
+        """
+        if self._info is None:
+            catalog = self.get_catalog()
+            self._info = {post.file_name: catalog.meta_of(post) for post in catalog}
+        return self._info
+
+    def errors(self):
+        """
+        Return the files whose front matter could not be parsed, with the reason.
+        """
+        return {post.file_name: post.error for post in self.get_catalog() if post.error}
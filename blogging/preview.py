@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local preview of the drafts and posts.
+
+`blogging preview` serves the rendered drafts/posts (and the other files of the project, e.g. the images) over HTTP
+on localhost, without building the site. The markdown renders are cached by content hash, in memory and under the
+cache dir, so a page is only rendered again when its file changed. A watcher thread re-renders the files which
+change as soon as they are saved and tells the browsers showing them to reload, through a server-sent events stream.
+
+Rendering uses the `markdown` package when installed; without it the source is shown as preformatted text.
+"""
+import hashlib
+import html
+import http.server
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+from blogging.metadata import project_cache_dir, split_front_matter
+from blogging.watcher import FolderWatcher
+
+# Part of the cache key: bump when the rendering changes
+RENDER_VERSION = 1
+DEFAULT_PORT = 4000
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists']
+# Seconds between the keep-alive comments of an idle event stream
+KEEPALIVE = 15
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 46em; margin: 2em auto; padding: 0 1em; font-family: sans-serif; line-height: 1.6; }}
+img {{ max-width: 100%; }}
+pre {{ overflow: auto; background: #f6f8fa; padding: 1em; }}
+.meta {{ color: #777; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p class="meta">{meta}</p>
+{body}
+<script>
+new EventSource('/__events?path={path}&version={version}').onmessage = function () {{ location.reload(); }};
+</script>
+</body>
+</html>
+'''
+
+
+class Renderer(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, 'preview')
+        self._cache = dict()
+        self._lock = threading.Lock()
+        try:
+            import markdown
+        except ImportError:
+            self._markdown = None
+        else:
+            self._markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+    def _render(self, text):
+        if self._markdown is None:
+            return '<pre>{0}</pre>'.format(html.escape(text))
+        # A Markdown instance keeps state while converting
+        with self._lock:
+            self._markdown.reset()
+            return self._markdown.convert(text)
+
+    def render(self, text):
+        """
+        Return the html of a markdown text, from the cache when the same text was rendered before.
+        """
+        key = '{0}:{1}\n'.format(RENDER_VERSION, self._markdown is not None).encode('utf-8') + text.encode('utf-8')
+        digest = hashlib.sha1(key).hexdigest()
+        if digest in self._cache:
+            return self._cache[digest]
+        cache_path = os.path.join(self.cache_dir, digest + '.html')
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                rendered = f.read()
+        except OSError:
+            rendered = self._render(text)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(rendered)
+            os.replace(tmp_path, cache_path)
+        self._cache[digest] = rendered
+        return rendered
+
+
+class PreviewServer(object):
+    def __init__(self, project_path, folders, port=DEFAULT_PORT, cache_dir=None):
+        self.project_path = os.path.abspath(project_path)
+        self.folders = {os.path.join(self.project_path, folder): folder.strip('/') for folder in folders}
+        self.renderer = Renderer(cache_dir or project_cache_dir(project_path))
+        self.watcher = FolderWatcher(self.folders)
+        # url path -> rendered page, and the number of times its file changed
+        self.pages = dict()
+        self.versions = dict()
+        self.condition = threading.Condition()
+        self.running = False
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), type('Handler', (_Handler,),
+                                                                              {'preview': self}))
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def url(self, folder, file_name):
+        return 'http://127.0.0.1:{0}/{1}/{2}'.format(self.port, folder.strip('/'), urllib.parse.quote(file_name))
+
+    def _file_of(self, path):
+        folder, _, file_name = path.strip('/').rpartition('/')
+        file_path = os.path.join(self.project_path, folder, file_name)
+        if os.path.dirname(file_path) in self.folders and os.path.isfile(file_path):
+            return file_path
+        return None
+
+    def render_page(self, path):
+        file_path = self._file_of(path)
+        if file_path is None:
+            return None
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            meta, body = split_front_matter(f.read())
+        details = [meta['category']] if meta.get('category') else []
+        details += ['#' + tag for tag in meta.get('tag') or []]
+        with self.condition:
+            version = self.versions.get(path, 0)
+        page = PAGE_TEMPLATE.format(title=html.escape(meta.get('title') or os.path.basename(file_path)),
+                                    meta=html.escape(' '.join(details)), body=self.renderer.render(body),
+                                    path=urllib.parse.quote(path), version=version)
+        self.pages[path] = page
+        return page
+
+    def page(self, path):
+        """
+        Return the rendered page of a draft/post url path (e.g. `/_drafts/a.md`), or None if there is no such file.
+        """
+        return self.pages.get(path) or self.render_page(path)
+
+    def wait_change(self, path, version, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.versions.get(path, 0) != version or not self.running,
+                                           timeout)
+
+    def _watch(self):
+        while self.running:
+            changes = self.watcher.wait(timeout=1.0)
+            for folder, file_name in changes:
+                path = '/{0}/{1}'.format(self.folders[folder], file_name)
+                self.pages.pop(path, None)
+                with self.condition:
+                    self.versions[path] = self.versions.get(path, 0) + 1
+                # Render at once, so the page is ready when the browser reloads
+                self.page(path)
+            if changes:
+                with self.condition:
+                    self.condition.notify_all()
+
+    def serve_forever(self):
+        self.running = True
+        watch_thread = threading.Thread(target=self._watch, daemon=True)
+        watch_thread.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.running = False
+            with self.condition:
+                self.condition.notify_all()
+            watch_thread.join()
+            self.httpd.server_close()
+            self.watcher.close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = 'blogging-preview'
+    preview = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(url.path)
+        if path == '/__events':
+            query = urllib.parse.parse_qs(url.query)
+            return self._events(query.get('path', [''])[0], int(query.get('version', ['0'])[0]))
+        page = self.preview.page(path)
+        if page is not None:
+            return self._send(200, 'text/html; charset=utf-8', page.encode('utf-8'))
+        self._static(path)
+
+    def _static(self, path):
+        file_path = os.path.realpath(os.path.join(self.preview.project_path, path.lstrip('/')))
+        if not file_path.startswith(self.preview.project_path + os.sep) or not os.path.isfile(file_path):
+            return self._send(404, 'text/plain', b'Not found')
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(file_path)))
+        self.end_headers()
+        with open(file_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def _events(self, path, version):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while self.preview.running:
+                if self.preview.wait_change(path, version, KEEPALIVE):
+                    if self.preview.running:
+                        self.wfile.write(b'data: reload\n\n')
+                        self.wfile.flush()
+                    return
+                self.wfile.write(b': keep-alive\n\n')
+                self.wfile.flush()
+        except OSError:
+            # The browser went away
+            pass
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Inverted index over the meta info of the blogs, used by the `--filter` option.
+
+A query is a list of keywords which must all match (AND); `OR` between keywords starts an alternative group, e.g.
+`tag:python category:linux OR vim`. A keyword can be qualified with `title:`, `category:` (or `cat:`) or `tag:`;
+an unqualified keyword matches an exact category, an exact tag or part of the title. All matches are
+case-insensitive.
+"""
+import shlex
+
+from blogging.catalog import NO_CATEGORY
+
+NGRAM = 3
+FIELD_ALIASES = {
+    'title': 'title',
+    'category': 'category',
+    'categories': 'category',
+    'cat': 'category',
+    'tag': 'tag',
+    'tags': 'tag',
+}
+
+
+def _ngrams(text):
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def parse_query(query):
+    """
+    Return the query as a list of OR groups, each being a list of (field, keyword) to AND together.
+    `field` is None for unqualified keywords.
+    """
+    try:
+        words = shlex.split(query)
+    except ValueError:
+        words = query.split()
+    groups = [[]]
+    for word in words:
+        if word == 'OR':
+            if groups[-1]:
+                groups.append([])
+            continue
+        field = None
+        if ':' in word:
+            prefix, keyword = word.split(':', 1)
+            if prefix.lower() in FIELD_ALIASES and keyword:
+                field = FIELD_ALIASES[prefix.lower()]
+                word = keyword
+        groups[-1].append((field, word.lower()))
+    return [group for group in groups if group]
+
+
+class FilterIndex(object):
+    def __init__(self, catalog):
+        self.titles = dict()
+        self.categories = dict()
+        self.tags = dict()
+        # Lower-case each facet name once, not once per post
+        category_names = [name.lower() for name in catalog.category_names]
+        tag_names = [name.lower() for name in catalog.tag_names]
+        for post in catalog:
+            self.titles[post.file_name] = (post.title or '').lower()
+            if post.category != NO_CATEGORY:
+                self.categories.setdefault(category_names[post.category], set()).add(post.file_name)
+            for tag in post.tags:
+                self.tags.setdefault(tag_names[tag], set()).add(post.file_name)
+        self._title_grams = None
+        self._short_titles = None
+
+    def _build_title_grams(self):
+        self._title_grams = dict()
+        self._short_titles = set()
+        for file_name, title in self.titles.items():
+            if len(title) < NGRAM:
+                self._short_titles.add(file_name)
+            for gram in _ngrams(title):
+                self._title_grams.setdefault(gram, set()).add(file_name)
+
+    def warm(self):
+        if self._title_grams is None:
+            self._build_title_grams()
+
+    def match_title(self, keyword):
+        self.warm()
+        if len(keyword) >= NGRAM:
+            candidates = None
+            # Start from the rarest n-gram so the intersection stays small
+            for gram in sorted(_ngrams(keyword), key=lambda g: len(self._title_grams.get(g, ()))):
+                postings = self._title_grams.get(gram)
+                if not postings:
+                    return set()
+                candidates = set(postings) if candidates is None else candidates & postings
+                if not candidates:
+                    return set()
+        else:
+            candidates = set(self._short_titles)
+            for gram, postings in self._title_grams.items():
+                if keyword in gram:
+                    candidates |= postings
+        return {file_name for file_name in candidates if keyword in self.titles[file_name]}
+
+    def match(self, field, keyword):
+        if field == 'category':
+            return self.categories.get(keyword, set())
+        if field == 'tag':
+            return self.tags.get(keyword, set())
+        if field == 'title':
+            return self.match_title(keyword)
+        return self.categories.get(keyword, set()) | self.tags.get(keyword, set()) | self.match_title(keyword)
+
+    def query(self, query):
+        results = set()
+        for group in parse_query(query):
+            matched = None
+            # Exact facet lookups first, so the title n-gram search is skipped once nothing is left
+            for field, keyword in sorted(group, key=lambda term: term[0] in ('title', None)):
+                hits = self.match(field, keyword)
+                matched = set(hits) if matched is None else matched & hits
+                if not matched:
+                    break
+            results |= matched or set()
+        return sorted(results)
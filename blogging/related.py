@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Related posts and tag suggestions, computed from the meta info of the posts.
+
+Each post is a sparse vector of binary features: its tags, its category and the words of its title, each weighted
+by its inverse document frequency (a tag shared by a handful of posts says more than one shared by half of the
+blog). The similarity of two posts is the cosine of their vectors.
+
+The post x feature matrix is kept in typed arrays, both by row and by column, and cached under the cache dir next to
+the meta index. An update only tokenizes the posts whose file changed. A query is a single product of the query
+vector by the columns of its features, followed by a top-k selection.
+"""
+import heapq
+import html
+import json
+import math
+import os
+import re
+import tempfile
+from array import array
+
+from blogging import trace
+from blogging.metadata import file_lock, project_cache_dir
+
+INDEX_VERSION = 1
+# Weight of each kind of feature, on top of its idf
+KIND_WEIGHTS = {'tag': 1.0, 'category': 0.5, 'word': 0.8}
+# Posts whose tags are voted for when suggesting tags
+SUGGEST_NEIGHBOURS = 30
+STOP_WORDS = frozenset('''
+    a an and are as at be but by can do does for from how i in into is it its my not of on or so than that the
+    their this to use using vs was what when where which who why will with without you your
+'''.split())
+_WORD = re.compile(r'\w+')
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]')
+# The arrays of the cache file, in order, with their type
+_ARRAYS = (('mtimes', 'q'), ('sizes', 'q'), ('row_starts', 'i'), ('row_terms', 'i'), ('col_starts', 'i'),
+           ('col_rows', 'i'), ('weights', 'd'), ('norms', 'd'))
+
+
+def title_words(title):
+    words = []
+    for word in _WORD.findall(html.unescape(title or '').lower()):
+        if _CJK.search(word):
+            # No spaces between the words: use the pairs of characters instead
+            words.extend(word[i:i + 2] for i in range(max(1, len(word) - 1)))
+        elif len(word) > 1 and not word.isdigit() and word not in STOP_WORDS:
+            words.append(word)
+    return words
+
+
+def features(title, category=None, tags=()):
+    """
+    Return the features of a post, e.g. `['word:docker', 'category:devops', 'tag:docker']`.
+    """
+    result = ['word:' + word for word in title_words(title)]
+    if category:
+        result.append('category:' + category)
+    result.extend('tag:' + tag for tag in tags if tag)
+    return list(dict.fromkeys(result))
+
+
+class RelatedIndex(object):
+    def __init__(self, project_path, folder, cache_dir=None):
+        self.folder_path = os.path.join(project_path, folder)
+        self.cache_dir = cache_dir or project_cache_dir(project_path)
+        name = folder.strip(os.sep).replace(os.sep, '_') or 'root'
+        self.index_path = os.path.join(self.cache_dir, '{0}.related'.format(name))
+        self.lock_path = self.index_path + '.lock'
+        self.loaded = False
+        self._build([])
+
+    def _build(self, rows):
+        """
+        Build the matrix from a list of (file_name, mtime, size, features).
+        """
+        self.terms = []
+        self.term_ids = dict()
+        self.files = []
+        self.mtimes = array('q')
+        self.sizes = array('q')
+        self.row_starts = array('i', [0])
+        self.row_terms = array('i')
+        for file_name, mtime, size, post_features in rows:
+            for feature in post_features:
+                term = self.term_ids.get(feature)
+                if term is None:
+                    term = self.term_ids[feature] = len(self.terms)
+                    self.terms.append(feature)
+                self.row_terms.append(term)
+            self.row_starts.append(len(self.row_terms))
+            self.files.append(file_name)
+            self.mtimes.append(mtime)
+            self.sizes.append(size)
+        # The columns, by counting sort of the rows' terms
+        counts = [0] * len(self.terms)
+        for term in self.row_terms:
+            counts[term] += 1
+        self.col_starts = array('i', [0])
+        total = 0
+        for count in counts:
+            total += count
+            self.col_starts.append(total)
+        self.col_rows = array('i', [0]) * len(self.row_terms)
+        fill = list(self.col_starts[:-1])
+        for row in range(len(self.files)):
+            for term in self.row_terms[self.row_starts[row]:self.row_starts[row + 1]]:
+                self.col_rows[fill[term]] = row
+                fill[term] += 1
+        posts = len(self.files)
+        self.weights = array('d', (KIND_WEIGHTS[feature.split(':', 1)[0]] * self._idf(count, posts)
+                                   for feature, count in zip(self.terms, counts)))
+        self.norms = array('d', (math.sqrt(sum(self.weights[term] ** 2 for term in self.row_terms[start:end]))
+                                 for start, end in zip(self.row_starts, self.row_starts[1:])))
+        self._index_rows()
+
+    @staticmethod
+    def _idf(count, posts):
+        return math.log((posts + 1.0) / (count + 1.0)) + 1.0
+
+    def _index_rows(self):
+        self.rows = {file_name: row for row, file_name in enumerate(self.files)}
+
+    def _row_features(self, row):
+        return [self.terms[term] for term in self.row_terms[self.row_starts[row]:self.row_starts[row + 1]]]
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            end = data.index(b'\n')
+            header = json.loads(data[:end].decode('utf-8'))
+        except (OSError, ValueError):
+            return False
+        if header.get('version') != INDEX_VERSION or header.get('folder') != self.folder_path:
+            return False
+        arrays = dict()
+        offset = end + 1
+        try:
+            for name, typecode in _ARRAYS:
+                values = array(typecode)
+                size = header['lengths'][name] * values.itemsize
+                values.frombytes(data[offset:offset + size])
+                offset += size
+                arrays[name] = values
+        except (KeyError, TypeError, ValueError):
+            return False
+        if offset != len(data):
+            return False
+        self.terms = header['terms']
+        self.term_ids = {feature: term for term, feature in enumerate(self.terms)}
+        self.files = header['files']
+        for name, values in arrays.items():
+            setattr(self, name, values)
+        self._index_rows()
+        return True
+
+    def _save(self):
+        header = {'version': INDEX_VERSION, 'folder': self.folder_path, 'terms': self.terms, 'files': self.files,
+                  'lengths': {name: len(getattr(self, name)) for name, typecode in _ARRAYS}}
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+                for name, typecode in _ARRAYS:
+                    getattr(self, name).tofile(f)
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @trace.traced('related.update')
+    def update(self, catalog, rebuild=False):
+        """
+        Bring the matrix in line with the catalog of the posts, tokenizing only the posts which changed.
+        Return the number of (re-)tokenized posts.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            if not self.loaded and not rebuild:
+                self._load()
+            self.loaded = True
+            rows = self.rows
+            changed = [file_name for file_name, mtime, size in catalog.stamps() if file_name not in rows
+                       or self.mtimes[rows[file_name]] != mtime or self.sizes[rows[file_name]] != size]
+            removed = [file_name for file_name in rows if file_name not in catalog]
+            if not changed and not removed and not rebuild:
+                return 0
+            changed_names = set(changed)
+            rows = [(file_name, self.mtimes[row], self.sizes[row], self._row_features(row))
+                    for file_name, row in rows.items() if file_name in catalog and file_name not in changed_names]
+            for post in map(catalog.get, changed):
+                rows.append((post.file_name, post.mtime, post.size,
+                             features(post.title, catalog.category_of(post), catalog.tags_of(post))))
+            self._build(rows)
+            self._save()
+        return len(changed)
+
+    def _query_weights(self, query_features):
+        """
+        Return the known terms of the query with their weights, and the norm of the whole query vector.
+        """
+        weights = dict()
+        norm = 0.0
+        for feature in query_features:
+            term = self.term_ids.get(feature)
+            if term is None:
+                weight = KIND_WEIGHTS[feature.split(':', 1)[0]] * self._idf(0, len(self.files))
+            else:
+                weight = weights[term] = self.weights[term]
+            norm += weight ** 2
+        return weights, math.sqrt(norm)
+
+    def query(self, query_features, limit=10, exclude=()):
+        """
+        Return the `limit` posts most similar to the features, as a list of (file_name, score), best first.
+        """
+        weights, norm = self._query_weights(query_features)
+        scores = dict()
+        get = scores.get
+        for term, weight in weights.items():
+            # Both vectors share the weight of the term
+            weight *= weight
+            for row in self.col_rows[self.col_starts[term]:self.col_starts[term + 1]]:
+                scores[row] = get(row, 0.0) + weight
+        for file_name in exclude:
+            scores.pop(self.rows.get(file_name), None)
+        norms = self.norms
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1] / norms[item[0]])
+        return [(self.files[row], score / (norms[row] * norm)) for row, score in best]
+
+    def suggest_tags(self, query_features, limit=5, exclude=(), neighbours=SUGGEST_NEIGHBOURS):
+        """
+        Return the tags of the posts most similar to the features (which are not in `exclude`), as a list of
+        (tag, score), best first. Each of these posts votes for its tags with its similarity.
+        """
+        votes = dict()
+        for file_name, score in self.query(query_features, neighbours):
+            for feature in self._row_features(self.rows[file_name]):
+                if feature.startswith('tag:'):
+                    votes[feature[4:]] = votes.get(feature[4:], 0.0) + score
+        for tag in exclude:
+            votes.pop(tag, None)
+        return heapq.nlargest(limit, votes.items(), key=lambda item: item[1])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The settings file (`~/.blogging`).
+
+It holds `key=value` lines for the default project, optionally followed by other projects, each one under a
+`[name]` line:
+
+    project_path=/path/to/blog
+    drafts_folder=_drafts
+    posts_folder=_posts
+    images_folder=_images
+
+    [team]
+    project_path=/path/to/team-blog
+
+A named project takes the keys it does not set (e.g. the folder names) from the default one, except `project_path`
+which it must set. The project is selected with `--project {name}` or the `BLOGGING_PROJECT` environment variable.
+As the completers need the settings before the arguments are parsed, the selection is read from the raw command line
+(or the line being completed).
+Only the standard library is used here, so the completion entry point can read it cheaply.
+"""
+import os
+
+PROJECT_ENV = 'BLOGGING_PROJECT'
+DEFAULT_PROJECT = 'default'
+
+
+class SettingsError(Exception):
+    pass
+
+
+def read_projects(setting_path):
+    """
+    Return the keys (upper case) of each project of the settings file, by project name, in the order of the file.
+    Raise SettingsError for a named project without its own `project_path`.
+    """
+    sections = {DEFAULT_PROJECT: dict()}
+    current = sections[DEFAULT_PROJECT]
+    if not os.path.isfile(setting_path):
+        return dict()
+    with open(setting_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                current = sections.setdefault(line[1:-1].strip(), dict())
+                continue
+            key, _, value = line.partition('=')
+            current[key.strip().upper()] = value.strip()
+    projects = dict()
+    for name, values in sections.items():
+        if name != DEFAULT_PROJECT:
+            if 'PROJECT_PATH' not in values:
+                # Inherited, it would make another name for the default blog
+                raise SettingsError('[{0}] has no project_path'.format(name))
+            values = dict(sections[DEFAULT_PROJECT], **values)
+        if 'PROJECT_PATH' in values:
+            projects[name] = values
+    return projects
+
+
+def selected_project(argv, environ=os.environ):
+    """
+    Return the name of the project selected by `--project` or the environment, or None.
+    """
+    words = argv[1:]
+    if 'COMP_LINE' in environ:
+        words = environ['COMP_LINE'].split()[1:]
+    project = environ.get(PROJECT_ENV) or None
+    for i, word in enumerate(words):
+        if word == '--project' and i + 1 < len(words):
+            project = words[i + 1]
+        elif word.startswith('--project='):
+            project = word.split('=', 1)[1]
+    return project
+
+
+class Settings(object):
+    def __init__(self, setting_path, project=None):
+        self.PROJECT_PATH = None
+        # Reported by the command (the completers just find nothing)
+        self.error = None
+        try:
+            projects = read_projects(setting_path)
+        except SettingsError as e:
+            self.error = str(e)
+            projects = dict()
+        self.PROJECTS = list(projects)
+        # The project asked for, even if there is no such project (see `unknown_project`)
+        self.PROJECT = project
+        if project not in projects:
+            # The default project, else the first one of the file
+            project = DEFAULT_PROJECT if DEFAULT_PROJECT in projects else next(iter(projects), None)
+        for key, value in projects.get(project, dict()).items():
+            setattr(self, key, value)
+        self.PROJECT_NAME = project
+
+    @property
+    def unknown_project(self):
+        return self.PROJECT is not None and self.PROJECT not in self.PROJECTS
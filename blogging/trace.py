@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timing of the phases of a run, to find what makes a command or a tab completion slow.
+
+Tracing is off unless `BLOGGING_TRACE` is set (`1` for the default trace file, or the path of a file) or the command
+is run with `--profile`. The environment variable also works for the tab completions, whose output stream is left
+alone: each finished phase (interpreter start-up, imports, settings, parser, completers, meta index, subprocesses,
+the subcommand itself...) is appended right away to the trace file as a json line, so nothing is lost when
+argcomplete ends the process with `os._exit`.
+
+`BLOGGING_CPROFILE` (or `--cprofile FILE`) also dumps a cProfile of the run, to be read with `pstats`.
+`blogging trace summary` aggregates the traces into percentiles per phase.
+"""
+import atexit
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from blogging.constants import BLOGGING_CACHE_DIR
+
+TRACE_ENV = 'BLOGGING_TRACE'
+CPROFILE_ENV = 'BLOGGING_CPROFILE'
+DEFAULT_TRACE_FILE = os.path.join(BLOGGING_CACHE_DIR, 'traces.jsonl')
+# Global options followed by a value (see blogging.build_parser), which is not the command
+VALUE_OPTIONS = ('--cprofile', '--project')
+
+_trace_path = None
+_run = None
+_command = None
+_started = None
+_stack = []
+_profiler = None
+_profile_path = None
+
+
+def enabled():
+    return _trace_path is not None
+
+
+def _process_start():
+    """
+    Wall-clock time the process started at (Linux only), to account for the interpreter start-up.
+    """
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            # The command name may contain spaces: the fields after it are counted from its closing parenthesis
+            start_ticks = int(f.read().rsplit(b')', 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.time() - age
+
+
+def enable(trace_path=DEFAULT_TRACE_FILE, profile_path=None, command=None):
+    global _trace_path, _run, _command, _started, _profiler, _profile_path
+    if _trace_path is not None:
+        return
+    _trace_path = trace_path
+    _run = '{0}-{1}'.format(int(time.time() * 1000), os.getpid())
+    _command = command
+    _started = time.time()
+    os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+    process_start = _process_start()
+    if process_start is not None and 0 <= _started - process_start < 60:
+        _write('interpreter', 'phase', None, process_start, _started - process_start)
+    if profile_path:
+        import cProfile
+        _profile_path = profile_path
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(finish)
+
+
+def _command_name(args):
+    """
+    The subcommand among the arguments: the first one which is neither an option nor the value of a global option.
+    """
+    args = iter(args)
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def enable_from_environment(argv):
+    """
+    Turn tracing on if asked by the environment or the command line (checked before the parser is even built).
+    """
+    trace_path = os.environ.get(TRACE_ENV)
+    profile_path = os.environ.get(CPROFILE_ENV)
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == '--profile':
+            trace_path = trace_path or '1'
+        elif arg == '--cprofile':
+            profile_path = next(args, None)
+        elif arg.startswith('--cprofile='):
+            profile_path = arg.split('=', 1)[1]
+    if profile_path:
+        trace_path = trace_path or '1'
+    if not trace_path or trace_path == '0':
+        return
+    command = _command_name(argv[1:])
+    if 'COMP_LINE' in os.environ:
+        command = 'complete ' + (_command_name(os.environ['COMP_LINE'].split()[1:]) or '')
+    enable(DEFAULT_TRACE_FILE if trace_path == '1' else trace_path, profile_path, command)
+
+
+def _write(name, kind, parent, start, duration, **fields):
+    record = {'run': _run, 'command': _command, 'phase': name, 'kind': kind, 'parent': parent,
+              'start_ms': round((start - _started) * 1000, 3), 'ms': round(duration * 1000, 3)}
+    record.update(fields)
+    try:
+        # One small append per phase: whole lines even when several runs trace at once
+        with open(_trace_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError:
+        pass
+
+
+@contextmanager
+def phase(name, kind='phase', **fields):
+    """
+    Record the wall time spent in the block as the phase `name` (nested phases record their parent).
+    """
+    if _trace_path is None:
+        yield
+        return
+    parent = _stack[-1][0] if _stack else None
+    _stack.append((name, kind, parent, time.time(), time.perf_counter(), fields))
+    try:
+        yield
+    finally:
+        _end_phase()
+
+
+def _end_phase():
+    name, kind, parent, start, counter, fields = _stack.pop()
+    _write(name, kind, parent, start, time.perf_counter() - counter, **fields)
+
+
+def traced(name):
+    """
+    Decorator recording each call of the function as the phase `name`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish():
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        try:
+            _profiler.dump_stats(_profile_path)
+        except OSError:
+            pass
+        _profiler = None
+
+
+def exit_completion(code=0):
+    """
+    Exit method for argcomplete, which would skip the atexit handlers (and the end of the running phases).
+    """
+    while _stack:
+        _end_phase()
+    finish()
+    os._exit(code)
+
+
+def load(trace_path=DEFAULT_TRACE_FILE):
+    records = []
+    try:
+        with open(trace_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def _percentile(values, percent):
+    # Nearest rank
+    index = max(0, min(len(values) - 1, int(round(percent / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(records, command=None):
+    """
+    Return a row per phase: (phase, kind, count, p50, p90, p99, max, total), the slowest total first.
+    `command` keeps the runs of the commands starting with it (e.g. `complete`, `publish`).
+    """
+    durations = dict()
+    for record in records:
+        if command and not (record.get('command') or '').startswith(command):
+            continue
+        durations.setdefault((record['phase'], record.get('kind')), []).append(record['ms'])
+    rows = []
+    for (name, kind), values in durations.items():
+        values.sort()
+        rows.append((name, kind, len(values), _percentile(values, 50), _percentile(values, 90),
+                     _percentile(values, 99), values[-1], sum(values)))
+    rows.sort(key=lambda row: row[-1], reverse=True)
+    return rows
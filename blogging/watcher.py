@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watch folders for changed files.
+
+On Linux this uses inotify (through ctypes, no extra dependency), so an idle watcher costs nothing and its
+`fileno()` can be handed to `select`. Elsewhere (e.g. macOS) it falls back to comparing `os.scandir` snapshots
+every `poll_interval` seconds.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not hasattr(os, 'O_CLOEXEC'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FolderWatcher(object):
+    def __init__(self, folders, poll_interval=1.0):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._watches = dict()
+        self._snapshots = dict()
+        self._last_poll = 0
+        libc = _load_libc()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                for folder in self.folders:
+                    wd = libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK)
+                    if wd >= 0:
+                        self._watches[wd] = folder
+        if self._fd is None:
+            for folder in self.folders:
+                self._snapshots[folder] = self._snapshot(folder)
+            self._last_poll = time.monotonic()
+
+    @property
+    def polling(self):
+        return self._fd is None
+
+    def fileno(self):
+        return self._fd
+
+    @staticmethod
+    def _snapshot(folder):
+        snapshot = dict()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.name] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+        return snapshot
+
+    def _poll(self):
+        changes = set()
+        for folder in self.folders:
+            old = self._snapshots.get(folder, dict())
+            new = self._snapshot(folder)
+            for name in set(old) | set(new):
+                if old.get(name) != new.get(name):
+                    changes.add((folder, name))
+            self._snapshots[folder] = new
+        self._last_poll = time.monotonic()
+        return changes
+
+    def _read_inotify(self):
+        changes = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Too many events: report every file as changed
+                    for folder in self.folders:
+                        changes.update((folder, n) for n in self._snapshot(folder))
+                elif wd in self._watches and name:
+                    changes.add((self._watches[wd], name))
+        return changes
+
+    def read_events(self):
+        """
+        Return a set of (folder, file_name) changed since the last call, without blocking.
+        """
+        if self._fd is not None:
+            return self._read_inotify()
+        if time.monotonic() - self._last_poll >= self.poll_interval:
+            return self._poll()
+        return set()
+
+    def next_timeout(self):
+        """
+        How long a caller may block in `select` before `read_events` should be called again.
+        """
+        if self._fd is not None:
+            return None
+        return max(0.0, self.poll_interval - (time.monotonic() - self._last_poll))
+
+    def wait(self, timeout=None):
+        """
+        Block until some files change (or `timeout` seconds pass) and return them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self._fd is not None:
+                select.select([self._fd], [], [], remaining)
+            else:
+                poll_timeout = self.next_timeout()
+                time.sleep(poll_timeout if remaining is None else min(poll_timeout, remaining))
+            changes = self.read_events()
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
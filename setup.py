@@ -57,10 +57,14 @@ setuptools.setup(
         'tabulate',
         'termcolor',
     ],
+    extras_require={
+        'images': ['Pillow'],
+        'preview': ['Markdown'],
+    },
     url='https://github.com/cuyu/blogging',
     entry_points={
         "console_scripts": [
-            "blogging = blogging.blogging:main",
+            "blogging = blogging.cli:main",
         ],
     },
     license='MIT',
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from blogging.catalog import COMPACT_MIN, PostCatalog
+
+
+def meta(title, category=None, tags=()):
+    return {'title': title, 'category': category, 'tag': list(tags)}
+
+
+def test_dead_rows_are_compacted():
+    catalog = PostCatalog()
+    for i in range(100):
+        catalog.add('post-{0}.md'.format(i), meta('Post {0}'.format(i), 'linux', ['tag-{0}'.format(i % 3)]),
+                    mtime=i, size=i)
+    catalog.add('broken.md', meta('Broken'), error='unclosed front matter')
+    # A long running process saving the same posts again and again
+    for rounds in range(50):
+        for i in range(10):
+            catalog.add('post-{0}.md'.format(i), meta('Post {0}'.format(i), 'linux', ['tag-{0}'.format(i % 3)]),
+                        mtime=i, size=rounds)
+    assert len(catalog._file_names) - len(catalog) <= max(COMPACT_MIN, len(catalog) // 4) + 1
+    assert len(catalog) == 101
+    assert catalog.category_stats() == {'linux': 100}
+    assert catalog.tag_stats() == {'tag-0': 34, 'tag-1': 33, 'tag-2': 33}
+    post = catalog.get('post-3.md')
+    assert (post.title, catalog.tags_of(post), post.size) == ('Post 3', ['tag-0'], 49)
+    assert catalog.get('post-99.md').title == 'Post 99'
+    assert catalog.get('broken.md').error == 'unclosed front matter'
+    assert PostCatalog.from_json(catalog.to_json()).to_json() == catalog.to_json()
+
+
+def test_shared_titles():
+    catalog = PostCatalog()
+    catalog.add('a.md', meta('Notes'))
+    catalog.add('b.md', meta('Notes'))
+    catalog.remove('b.md')
+    assert catalog.titles == {'Notes': 'a.md'}
+    catalog.add('c.md', meta('Notes'))
+    catalog.add('a.md', meta('Renamed'))
+    assert catalog.titles == {'Notes': 'c.md', 'Renamed': 'a.md'}
+    catalog.remove('c.md')
+    assert catalog.titles == {'Renamed': 'a.md'}
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from blogging import feeds
+from blogging.catalog import PostCatalog
+from blogging.feeds import FeedWriter, Site
+
+NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+
+@pytest.fixture
+def writer(tmp_path):
+    (tmp_path / 'blog' / '_posts').mkdir(parents=True)
+    site = Site('https://example.org', '/blog', permalink='pretty')
+    return FeedWriter(str(tmp_path / 'blog'), '_posts', site, cache_dir=str(tmp_path / 'cache'))
+
+
+def catalog_of(count, mtime=10 ** 18):
+    catalog = PostCatalog()
+    # Not in date order, plus a page without a date
+    for i in reversed(range(count)):
+        catalog.add('2020-01-{0:02d}-post-{0}.md'.format(i + 1), {'category': 'Linux'}, mtime=mtime, size=i)
+    catalog.add('about.md', {'title': 'About'}, mtime=mtime, size=1)
+    return catalog
+
+
+def locs(path):
+    return [element.text for element in ET.parse(path).getroot().iter(NS + 'loc')]
+
+
+def test_sitemap(writer):
+    path = os.path.join(writer.project_path, 'sitemap.xml')
+    assert writer.write_sitemap(catalog_of(3), path) == [path]
+    assert locs(path) == ['https://example.org/blog/'] + [
+        'https://example.org/blog/linux/2020/01/0{0}/post-{0}/'.format(i) for i in (1, 2, 3)]
+    assert writer.write_sitemap(catalog_of(3), path) == []
+
+
+def test_sitemap_parts(writer, monkeypatch):
+    monkeypatch.setattr(feeds, 'SITEMAP_LIMIT', 4)
+    path = os.path.join(writer.project_path, 'sitemap.xml')
+    part_paths = [os.path.join(writer.project_path, 'sitemap-{0}.xml'.format(i)) for i in (1, 2, 3)]
+    # The home and 9 posts
+    assert writer.write_sitemap(catalog_of(9), path) == part_paths + [path]
+    assert [len(locs(part_path)) for part_path in part_paths] == [4, 4, 2]
+    assert locs(path) == ['https://example.org/blog/sitemap-{0}.xml'.format(i) for i in (1, 2, 3)]
+    # A new post only changes the last part (and the index, for its lastmod)
+    catalog = catalog_of(9)
+    catalog.add('2020-01-10-post-10.md', {}, mtime=2 * 10 ** 18, size=0)
+    assert writer.write_sitemap(catalog, path) == part_paths[2:] + [path]
+    assert locs(part_paths[2])[-1] == 'https://example.org/blog/2020/01/10/post-10/'
+    # Fewer posts: fewer parts, the old ones are removed
+    assert writer.write_sitemap(catalog_of(5), path) == [part_paths[1], path, part_paths[2]]
+    assert [os.path.exists(part_path) for part_path in part_paths] == [True, True, False]
+    assert len(locs(path)) == 2
+    assert writer.write_sitemap(catalog_of(2), path) == [path] + part_paths[:2]
+    assert not any(os.path.exists(part_path) for part_path in part_paths)
+    assert locs(path) == ['https://example.org/blog/'] + [
+        'https://example.org/blog/linux/2020/01/0{0}/post-{0}/'.format(i) for i in (1, 2)]
+    # Back to several parts
+    assert writer.write_sitemap(catalog_of(9), path) == part_paths + [path]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from blogging.frontmatter import apply_rewrites, discard_rewrites, prepare_rewrites
+from blogging.metadata import parse_front_matter
+
+BODY = 'The body, tags: [a, b]\n'
+
+
+def retag(old_tag, new_tag):
+    def edit(meta):
+        meta['tag'] = [new_tag if tag == old_tag else tag for tag in meta.get('tag') or []]
+        return meta
+    return edit
+
+
+def set_meta(**fields):
+    def edit(meta):
+        meta.update(fields)
+        return meta
+    return edit
+
+
+def write_post(folder, name, front_matter):
+    path = str(folder / name)
+    with open(path, 'w', newline='') as f:
+        f.write('---\ntitle: "A post"\n' + front_matter + '---\n' + BODY)
+    return path
+
+
+def read(path):
+    with open(path, newline='') as f:
+        return f.read()
+
+
+def rewrite(path, edit):
+    rewrites, errors = prepare_rewrites([path], edit)
+    assert errors == []
+    assert apply_rewrites(rewrites) == [rewrite.path for rewrite in rewrites]
+    text = read(path)
+    assert text.endswith('---\n' + BODY)
+    return text[len('---\ntitle: "A post"\n'):-len('---\n' + BODY)]
+
+
+@pytest.mark.parametrize('before, after', [
+    ('tags: [a, "c++", b]\n', 'tags: [a, "c++", x]\n'),
+    ('tags: a, "c++", b\n', 'tags: a, "c++", x\n'),
+    ('tags: a c++ b\n', 'tags: a c++ x\n'),
+    ("tags: a 'c++' b\n", "tags: a 'c++' x\n"),
+    ('tags:\n  - a\n  - "c++"  \n  - b\n# end\n', 'tags:\n  - a\n  - "c++"  \n  - x\n# end\n'),
+])
+def test_styles(tmp_path, before, after):
+    path = write_post(tmp_path, 'post.md', before)
+    assert rewrite(path, retag('b', 'x')) == after
+    meta = parse_front_matter(read(path).splitlines(True))[0]
+    assert meta['tag'] == ['a', 'c++', 'x']
+
+
+def test_line_ends_are_kept(tmp_path):
+    path = str(tmp_path / 'post.md')
+    with open(path, 'w', newline='') as f:
+        f.write('---\r\ntitle: A post\r\ntags: [a, "c++", b]\r\n---\r\nBody\r\n')
+    rewrites, errors = prepare_rewrites([path], set_meta(tag=['a', 'c++', 'x'], category='linux'))
+    apply_rewrites(rewrites)
+    assert read(path) == '---\r\ntitle: A post\r\ntags: [a, "c++", x]\r\ncategory: [linux]\r\n---\r\nBody\r\n'
+
+
+def test_new_items_are_quoted_when_needed(tmp_path):
+    path = write_post(tmp_path, 'post.md', 'tags: a b\n')
+    # A space list cannot hold an item with a space
+    assert rewrite(path, retag('b', 'x y')) == 'tags: [a, x y]\n'
+    path = write_post(tmp_path, 'other.md', 'tags:\n- a\n- b\n')
+    assert rewrite(path, retag('b', 'c: d')) == 'tags:\n- a\n- "c: d"\n'
+
+
+def test_categories_alias(tmp_path):
+    path = write_post(tmp_path, 'post.md', 'categories: [linux, "notes"]\n')
+    # Only the first one is the category, the others are kept
+    assert rewrite(path, set_meta(category='shell')) == 'categories: [shell, "notes"]\n'
+    assert parse_front_matter(read(path).splitlines(True))[0]['category'] == 'shell'
+
+
+def test_missing_key_is_added(tmp_path):
+    path = write_post(tmp_path, 'post.md', 'category: linux\n')
+    assert rewrite(path, set_meta(tag=['a', 'b c'])) == 'category: linux\ntags: [a, b c]\n'
+
+
+def test_unchanged(tmp_path):
+    path = write_post(tmp_path, 'post.md', 'tags: [a, b]\n')
+    assert prepare_rewrites([path], retag('z', 'x')) == ([], [])
+
+
+def test_dry_run(tmp_path):
+    path = write_post(tmp_path, 'post.md', 'tags: [a, b]\n')
+    before = read(path)
+    rewrites, errors = prepare_rewrites([path], retag('b', 'x'), dry_run=True)
+    assert errors == [] and len(rewrites) == 1
+    assert rewrites[0].tmp_path is None
+    assert rewrites[0].diff() == ['-tags: [a, b]\n', '+tags: [a, x]\n']
+    assert read(path) == before
+    assert os.listdir(str(tmp_path)) == ['post.md']
+
+
+def test_failing_file_leaves_the_others(tmp_path):
+    paths = [write_post(tmp_path, '{0}.md'.format(i), 'tags: [a, b]\n') for i in range(5)]
+    (tmp_path / 'broken.md').write_text('---\ntags: [b]\n')
+    (tmp_path / 'no-front-matter.md').write_text('tags: [b]\n')
+    contents = {path: read(path) for path in paths}
+    rewrites, errors = prepare_rewrites(paths + [str(tmp_path / 'broken.md'), str(tmp_path / 'no-front-matter.md')],
+                                        retag('b', 'x'))
+    assert len(rewrites) == 5
+    assert sorted(os.path.basename(path) for path, error in errors) == ['broken.md', 'no-front-matter.md']
+    # As `blogging retag` does when any file fails
+    discard_rewrites(rewrites)
+    assert {path: read(path) for path in paths} == contents
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith('.rewrite-')]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import time
+
+import pytest
+
+from blogging.gitops import GitSession, PushQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git(cwd, *args):
+    return subprocess.run(['git'] + list(args), cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True).stdout
+
+
+@pytest.fixture
+def blog(tmp_path, monkeypatch):
+    """
+    A blog cloned from a local bare remote, whose post-receive hook counts the pushes in `pushes.log`.
+    """
+    for key, value in (('GIT_AUTHOR_NAME', 'a'), ('GIT_AUTHOR_EMAIL', 'a@b'), ('GIT_COMMITTER_NAME', 'a'),
+                       ('GIT_COMMITTER_EMAIL', 'a@b')):
+        monkeypatch.setenv(key, value)
+    # For the worker processes spawned by PushQueue
+    monkeypatch.setenv('PYTHONPATH', ROOT)
+    remote = tmp_path / 'remote.git'
+    git(str(tmp_path), 'init', '--quiet', '--bare', str(remote))
+    hook = remote / 'hooks' / 'post-receive'
+    hook.write_text('#!/bin/sh\necho push >> "{0}"\n'.format(tmp_path / 'pushes.log'))
+    hook.chmod(0o755)
+    project = tmp_path / 'blog'
+    git(str(tmp_path), 'clone', '--quiet', str(remote), str(project))
+    (project / '_drafts').mkdir()
+    (project / '_drafts' / 'first.md').write_text('first\n')
+    git(str(project), 'add', '-A')
+    git(str(project), 'commit', '--quiet', '-m', 'first')
+    git(str(project), 'push', '--quiet', '-u', 'origin', 'HEAD')
+    (tmp_path / 'pushes.log').write_text('')
+    return project
+
+
+def pushes(project):
+    return len((project.parent / 'pushes.log').read_text().splitlines())
+
+
+def save(project, name):
+    (project / '_drafts' / name).write_text(name + '\n')
+    session = GitSession(str(project))
+    session.stage([str(project / '_drafts' / name)])
+    assert session.commit('Save ' + name)
+
+
+def wait_for(condition, timeout=20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_saves_are_pushed_at_once(blog, tmp_path):
+    queue = PushQueue(str(blog), str(tmp_path / 'state'), delay=0.5)
+    for i in range(5):
+        save(blog, 'draft-{0}.md'.format(i))
+        # Every command spawns a worker, only the one holding the lock pushes
+        queue.request()
+    assert wait_for(lambda: not queue.pending() and not queue.worker_running())
+    assert pushes(blog) == 1
+    assert GitSession(str(blog)).unpushed_commits() == 0
+    state = queue.state()
+    assert state['pushed'] == state['requested'] == 5
+    assert state.get('error') is None
+
+
+def test_worker_lock_is_exclusive(blog, tmp_path):
+    import fcntl
+    queue = PushQueue(str(blog), str(tmp_path / 'state'), delay=0)
+    save(blog, 'draft.md')
+    queue.request(spawn=False)
+    os.makedirs(queue.state_dir, exist_ok=True)
+    with open(queue.worker_lock_path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        assert queue.worker_running()
+        # Another worker is there: this one leaves the push to it
+        queue.work()
+        assert queue.pending()
+        assert pushes(blog) == 0
+    queue.work()
+    assert not queue.pending()
+    assert pushes(blog) == 1
+
+
+def test_failed_push_is_reported_and_retried(blog, tmp_path):
+    queue = PushQueue(str(blog), str(tmp_path / 'state'), delay=0)
+    remote = git(str(blog), 'remote', 'get-url', 'origin').strip()
+    git(str(blog), 'remote', 'set-url', 'origin', str(tmp_path / 'missing.git'))
+    save(blog, 'draft.md')
+    queue.request(spawn=False)
+    queue.work()
+    state = queue.state()
+    assert state['error']
+    assert state['pushed'] < state['requested']
+    assert queue.pending()
+    assert pushes(blog) == 0
+
+    # The next command retries it
+    git(str(blog), 'remote', 'set-url', 'origin', remote)
+    save(blog, 'other.md')
+    queue.request()
+    assert wait_for(lambda: not queue.pending() and not queue.worker_running())
+    state = queue.state()
+    assert state.get('error') is None
+    assert state['pushed'] == state['requested'] == 2
+    assert pushes(blog) == 1
+    assert GitSession(str(blog)).unpushed_commits() == 0
+
+
+def test_changed_files_of_a_blog_in_a_subfolder(blog):
+    site = blog / 'site'
+    (site / '_posts').mkdir(parents=True)
+    (site / '_posts' / 'post.md').write_text('post\n')
+    git(str(blog), 'add', '-A')
+    git(str(blog), 'commit', '--quiet', '-m', 'site')
+    (site / '_posts' / 'post.md').write_text('edited\n')
+    (site / '_drafts').mkdir()
+    (site / '_drafts' / 'draft.md').write_text('draft\n')
+    session = GitSession(str(site))
+    changes = session.changed_files(['_drafts', '_posts'])
+    assert sorted(changes) == [('added', '_drafts/draft.md'), ('modified', '_posts/post.md')]
+    session.stage([str(site / path) for status, path in changes])
+    assert session.commit('Save')
+    assert session.changed_files(['_drafts', '_posts']) == []
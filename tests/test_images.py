@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+from blogging.images import UnknownImageFormat, image_size
+
+
+def box(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def full_box(kind, body, version=0, flags=0):
+    return box(kind, bytes([version]) + flags.to_bytes(3, 'big'), body)
+
+
+def ispe(width, height):
+    return full_box(b'ispe', struct.pack('>II', width, height))
+
+
+def avif(properties, associations=None, primary=1, mdat=b''):
+    """
+    An AVIF file whose `ipco` holds `properties`, associated to items by `associations` ({item: [indexes]}).
+    """
+    meta = [full_box(b'hdlr', b'\0' * 4 + b'pict' + b'\0' * 13), full_box(b'pitm', struct.pack('>H', primary))]
+    iprp = [box(b'ipco', *properties)]
+    if associations is not None:
+        entries = b''.join(struct.pack('>HB', item, len(indexes)) + bytes(0x80 | index for index in indexes)
+                           for item, indexes in sorted(associations.items()))
+        iprp.append(full_box(b'ipma', struct.pack('>I', len(associations)) + entries))
+    meta.append(box(b'iprp', *iprp))
+    return box(b'ftyp', b'avif', b'\0' * 4, b'mif1avif') + full_box(b'meta', b''.join(meta)) + box(b'mdat', mdat)
+
+
+def test_avif_size():
+    assert image_size(avif([ispe(640, 480)], {1: [1]})) == (640, 480)
+
+
+def test_avif_size_of_the_primary_item():
+    # A larger alpha/thumbnail item: the associations tell which size is the primary one's
+    data = avif([ispe(1920, 1080), ispe(640, 360), box(b'irot', b'\x01')], {1: [2, 3], 2: [1]}, primary=1)
+    assert image_size(data) == (360, 640)
+    # The rotation of another item does not count
+    data = avif([ispe(640, 360), box(b'irot', b'\x01')], {1: [1], 2: [2]})
+    assert image_size(data) == (640, 360)
+
+
+def test_avif_boxes_outside_the_properties_are_ignored():
+    # The coded data happens to contain the property names
+    mdat = b'ispe' + struct.pack('>II', 9999, 9999) + b'irot\x01'
+    assert image_size(avif([ispe(800, 600)], {1: [1]}, mdat=mdat)) == (800, 600)
+    # Without associations, the largest size of the properties is used
+    assert image_size(avif([ispe(200, 100), ispe(800, 600)], mdat=mdat)) == (800, 600)
+
+
+def test_avif_without_size():
+    with pytest.raises(UnknownImageFormat):
+        image_size(avif([], mdat=b'ispe' + struct.pack('>II', 9999, 9999)))
+    with pytest.raises(UnknownImageFormat):
+        image_size(avif([ispe(800, 600)])[:-20])
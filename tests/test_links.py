@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import http.server
+import socket
+import threading
+
+import pytest
+
+from blogging.links import LinkChecker, extract_links
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        self.requests.append((self.command, self.path))
+        if self.path == '/ok':
+            self._reply(200, body=b'ok')
+        elif self.path == '/moved':
+            self._reply(301, [('Location', '/ok')])
+        elif self.path == '/loop':
+            self._reply(302, [('Location', '/loop')])
+        elif self.path == '/no-head':
+            self._reply(405 if self.command == 'HEAD' else 200, body=b'ok')
+        else:
+            self._reply(404, body=b'not found')
+
+    do_HEAD = _handle
+    do_GET = _handle
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    Handler.requests = []
+    yield 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def checker(tmp_path):
+    return LinkChecker(str(tmp_path / 'links.json'), timeout=5.0)
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_statuses(server, checker):
+    urls = [server + path for path in ('/ok', '/missing', '/moved', '/loop', '/no-head')]
+    results = checker.check(urls)
+    assert results[server + '/ok'] is None
+    assert results[server + '/missing'] == 'HTTP 404'
+    assert results[server + '/moved'] is None
+    assert results[server + '/loop'] == 'too many redirects'
+    # HEAD refused: checked again with GET
+    assert results[server + '/no-head'] is None
+    assert ('GET', '/no-head') in Handler.requests
+
+
+def test_connection_refused(checker):
+    url = 'http://127.0.0.1:{0}/'.format(closed_port())
+    error = checker.check([url])[url]
+    assert error is not None and error != 'timeout'
+
+
+def test_working_links_are_cached(server, checker):
+    checker.check([server + '/ok', server + '/missing'])
+    Handler.requests = []
+    results = checker.check([server + '/ok', server + '/missing'])
+    assert results == {server + '/ok': None, server + '/missing': 'HTTP 404'}
+    # Only the broken one is checked again
+    assert {path for method, path in Handler.requests} == {'/missing'}
+    Handler.requests = []
+    checker.check([server + '/ok'], refresh=True)
+    assert Handler.requests
+
+
+def test_links_in_code_are_ignored():
+    text = '\n'.join([
+        'See [the docs](https://example.org/docs "Docs") and <https://example.org/auto>.',
+        'Inline `[not a link](https://example.org/inline)` code.',
+        '```',
+        '[fenced](https://example.org/fenced)',
+        '<img src="/fenced.png">',
+        '```',
+        '![image](/images/a.png) {% post_url 2020-01-01-hello %}',
+        '[ref]: https://example.org/ref',
+    ])
+    links = extract_links(text)
+    assert 'https://example.org/docs' in links
+    assert 'https://example.org/auto' in links
+    assert 'https://example.org/ref' in links
+    assert '/images/a.png' in links
+    assert 'post_url:2020-01-01-hello' in links
+    assert not any('inline' in link or 'fenced' in link for link in links)
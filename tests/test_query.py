@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from blogging.catalog import PostCatalog
+from blogging.query import FilterIndex, parse_query
+
+POSTS = {
+    '2020-01-01-docker-networking.md': {'title': 'Docker networking', 'category': 'Linux', 'tag': ['docker', 'net']},
+    '2020-02-01-vim-tips.md': {'title': 'Vim tips', 'category': 'Tools', 'tag': ['vim', 'Editor']},
+    '2020-03-01-python-gil.md': {'title': 'The Python GIL', 'category': 'Programming', 'tag': ['python', 'go']},
+    '2020-04-01-go.md': {'title': 'Go', 'category': 'Programming', 'tag': ['go']},
+    '2020-05-01-linux-shell.md': {'title': 'Linux shell scripting', 'category': 'linux', 'tag': ['shell', 'vim']},
+    '2020-06-01-untitled.md': {'title': '', 'category': 'Notes', 'tag': []},
+    '2020-07-01-ai.md': {'title': 'AI', 'category': 'Notes', 'tag': ['ml']},
+}
+
+
+def filter_by_keyword(info, keyword):
+    """
+    The filter before the query language: an exact category or tag, or part of the title.
+    """
+    keyword_lower = keyword.lower()
+    results = []
+    for filename, meta_data in info.items():
+        if (meta_data.get('category') and keyword_lower == meta_data.get('category').lower()) \
+                or keyword_lower in meta_data['title'].lower() \
+                or (meta_data.get('tag') and keyword_lower in [tag.lower() for tag in meta_data.get('tag')]):
+            results.append(filename)
+    return sorted(results)
+
+
+@pytest.fixture
+def index():
+    catalog = PostCatalog()
+    for file_name, meta in POSTS.items():
+        catalog.add(file_name, meta)
+    return FilterIndex(catalog)
+
+
+@pytest.mark.parametrize('keyword', ['linux', 'LINUX', 'docker', 'networking', 'work', 'vim', 'editor', 'go', 'g',
+                                     'i', 'ai', 'AI', 'tips', 'notes', 'python gil', 'script', 'missing', 'x'])
+def test_single_keyword_matches_as_before(index, keyword):
+    query = '"{0}"'.format(keyword) if ' ' in keyword else keyword
+    assert index.query(query) == filter_by_keyword(POSTS, keyword)
+
+
+def test_parse_query():
+    assert parse_query('tag:Python cat:linux OR vim') == [[('tag', 'python'), ('category', 'linux')], [(None, 'vim')]]
+    assert parse_query('OR title:"the python" OR OR') == [[('title', 'the python')]]
+    # Not a field: the whole word is the keyword
+    assert parse_query('c++:x tag:') == [[(None, 'c++:x'), (None, 'tag:')]]
+
+
+def test_and(index):
+    assert index.query('vim linux') == ['2020-05-01-linux-shell.md']
+    assert index.query('vim docker') == []
+
+
+def test_or(index):
+    assert index.query('docker OR tips') == ['2020-01-01-docker-networking.md', '2020-02-01-vim-tips.md']
+    assert index.query('vim linux OR ml') == ['2020-05-01-linux-shell.md', '2020-07-01-ai.md']
+
+
+def test_qualifiers(index):
+    # `go` is a tag of two posts and in the title of another one
+    assert index.query('go') == ['2020-03-01-python-gil.md', '2020-04-01-go.md']
+    assert index.query('title:go') == ['2020-04-01-go.md']
+    assert index.query('tag:go') == ['2020-03-01-python-gil.md', '2020-04-01-go.md']
+    assert index.query('category:linux') == ['2020-01-01-docker-networking.md', '2020-05-01-linux-shell.md']
+    assert index.query('cat:Programming tag:python') == ['2020-03-01-python-gil.md']
+    # Qualified keywords are exact: no partial category or tag
+    assert index.query('tag:pyth') == []
+    assert index.query('title:"linux shell"') == ['2020-05-01-linux-shell.md']
+
+
+def test_short_title_keywords(index):
+    # Shorter than the n-grams: titles shorter than them are searched too
+    assert index.query('title:ai') == ['2020-07-01-ai.md']
+    assert index.query('title:il') == ['2020-03-01-python-gil.md']
+    assert index.query('title:i') == sorted(file_name for file_name, meta in POSTS.items()
+                                            if 'i' in meta['title'].lower())
+    assert index.query('title:xyz') == []
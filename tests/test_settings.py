@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from blogging.settings import DEFAULT_PROJECT, Settings, SettingsError, read_projects, selected_project
+
+LEGACY = """project_path=/blogs/mine
+drafts_folder=_drafts
+posts_folder=_posts
+images_folder=_images
+"""
+
+
+def settings_file(tmp_path, text):
+    path = tmp_path / '.blogging'
+    path.write_text(text)
+    return str(path)
+
+
+def test_legacy_file(tmp_path):
+    path = settings_file(tmp_path, LEGACY)
+    assert read_projects(path) == {DEFAULT_PROJECT: {'PROJECT_PATH': '/blogs/mine', 'DRAFTS_FOLDER': '_drafts',
+                                                     'POSTS_FOLDER': '_posts', 'IMAGES_FOLDER': '_images'}}
+    settings = Settings(path)
+    assert (settings.PROJECT_PATH, settings.POSTS_FOLDER, settings.PROJECT_NAME) == ('/blogs/mine', '_posts', 'default')
+    assert settings.PROJECTS == [DEFAULT_PROJECT]
+    assert not settings.unknown_project and settings.error is None
+
+
+def test_missing_file(tmp_path):
+    settings = Settings(str(tmp_path / '.blogging'))
+    assert settings.PROJECT_PATH is None and settings.PROJECTS == []
+
+
+def test_named_project(tmp_path):
+    path = settings_file(tmp_path, LEGACY + '\n# The team blog\n[team]\nproject_path = /blogs/team\n'
+                                            'posts_folder=posts\n')
+    assert list(read_projects(path)) == [DEFAULT_PROJECT, 'team']
+    settings = Settings(path, 'team')
+    # The keys it does not set come from the default project
+    assert (settings.PROJECT_PATH, settings.POSTS_FOLDER, settings.DRAFTS_FOLDER) == ('/blogs/team', 'posts', '_drafts')
+    assert settings.PROJECT_NAME == 'team'
+    assert Settings(path).PROJECT_PATH == '/blogs/mine'
+    settings = Settings(path, 'other')
+    assert settings.unknown_project and settings.PROJECT_PATH == '/blogs/mine'
+
+
+def test_named_project_needs_its_path(tmp_path):
+    path = settings_file(tmp_path, LEGACY + '[team]\nposts_folder=posts\n')
+    with pytest.raises(SettingsError, match=r'\[team\]'):
+        read_projects(path)
+    settings = Settings(path, 'team')
+    assert settings.error and settings.PROJECT_PATH is None and settings.PROJECTS == []
+
+
+def test_values_with_equal_signs(tmp_path):
+    path = settings_file(tmp_path, LEGACY + 'site_url=https://example.org/?a=b\n')
+    assert Settings(path).SITE_URL == 'https://example.org/?a=b'
+
+
+def test_selected_project():
+    assert selected_project(['blogging', 'ls', 'posts'], {}) is None
+    assert selected_project(['blogging', '--project', 'team', 'ls'], {}) == 'team'
+    assert selected_project(['blogging', '--project=team', 'ls'], {}) == 'team'
+    assert selected_project(['blogging', 'ls'], {'BLOGGING_PROJECT': 'team'}) == 'team'
+    # The command line wins over the environment
+    assert selected_project(['blogging', '--project', 'mine'], {'BLOGGING_PROJECT': 'team'}) == 'mine'
+    # While completing, the project comes from the line being completed
+    environ = {'COMP_LINE': 'blogging --project team edit 2020', '_ARGCOMPLETE': '1'}
+    assert selected_project(['blogging'], environ) == 'team'
+    assert selected_project(['blogging'], {'COMP_LINE': 'blogging --project'}) is None